@@ -9,8 +9,9 @@ The dataframe is created in a notebook that is also included in
 the app's repository. The data that goes into it is secret.
 """
 # ----- Imports -----
+import functools
+
 import streamlit as st
-import pandas as pd
 
 
 # Add an extra bit to the path if we need to.
@@ -27,25 +28,187 @@ except ModuleNotFoundError:
     sys.path.append('./streamlit_descriptive_stats/')
     # The following should work now:
     from utilities_descriptive.fixed_params import page_setup
-try:
-    test_file = pd.read_csv(
-        './data_descriptive/stroke_teams.csv',
-        index_col='stroke_team'
-        )
-    dir = './'
-except FileNotFoundError:
-    # If the import fails, add the landing page directory to path.
-    # Assume that the script is being run from the directory above
-    # the landing page directory, which is called
-    # stroke_outcome_app.
-    dir = 'streamlit_descriptive_stats/'
-
 # Custom functions:
-from utilities_descriptive.fixed_params import all_teams_str, all_years_str
+from utilities_descriptive.fixed_params import \
+    all_teams_str, get_cohort_label, get_data_dir
 import utilities_descriptive.container_inputs
+import utilities_descriptive.data_loading
+import utilities_descriptive.export
 import utilities_descriptive.container_results
 import utilities_descriptive.container_plots
 import utilities_descriptive.plot_utils
+import utilities_descriptive.profiling
+
+
+@st.fragment
+def show_violins(
+        profile_setting,
+        stats_cube,
+        cohort,
+        year_options,
+        stroke_teams_selected_without_year,
+        all_years_str,
+        team_colours_dict,
+        interval_cube
+        ):
+    """
+    Section with one feature over time.
+
+    This is a fragment, so changing the feature only reruns this
+    function with the same inputs as the last full run of the page.
+    Every run records its own timings and the feature picked.
+
+    Inputs:
+    -------
+    profile_setting                    - str or None. Output of
+                                         get_profile_setting().
+    stats_cube                         - StatsCube. Stats to plot.
+    cohort                             - str. Name of the cohort.
+    year_options                       - list. Every year label.
+    stroke_teams_selected_without_year - list. Highlighted teams.
+    all_years_str                      - str. "All years" label.
+    team_colours_dict                  - dict. Colour of each team.
+    interval_cube                      - StatsCube or None.
+                                         Confidence intervals.
+    """
+    index_names = utilities_descriptive.container_results.\
+        metric_display_names
+    inverse_index_names = dict(zip(index_names.values(), index_names.keys()))
+
+    # A new profiler for each run, so that reruns of only this
+    # fragment are recorded too:
+    profiler = utilities_descriptive.profiling.RerunProfiler(
+        profile_setting, run='violins')
+    with profiler.section('container_violins'):
+        st.header('One feature over time')
+        st.markdown('Compare one feature across multiple years.')
+
+        # User inputs for which feature to plot:
+        feature_display = st.selectbox(
+            'Pick a feature to plot',
+            options=index_names.values(),
+            key='violin_feature_ds',
+            # default='count'
+        )
+        # Convert this to actual feature name:
+        feature = inverse_index_names[feature_display]
+
+        utilities_descriptive.container_plots.plot_violins(
+            stats_cube,
+            cohort,
+            feature,
+            feature_display,
+            year_options,
+            stroke_teams_selected_without_year,
+            all_years_str,
+            all_teams_str,
+            team_colours_dict,
+            interval_cube
+            )
+    profiler.finish(
+        st.container(),
+        selection={'cohort': cohort, 'violin_feature': feature}
+        )
+
+
+@st.fragment
+def show_scatter(
+        profile_setting,
+        stats_cube,
+        cohort,
+        year_options,
+        stroke_teams_selected_without_year,
+        team_colours_dict,
+        interval_cube
+        ):
+    """
+    Section with the relation between two features.
+
+    This is a fragment, so changing the features or year only reruns
+    this function with the same inputs as the last full run of the
+    page. Every run records its own timings and the options picked.
+
+    Inputs:
+    -------
+    profile_setting                    - str or None. Output of
+                                         get_profile_setting().
+    stats_cube                         - StatsCube. Stats to plot.
+    cohort                             - str. Name of the cohort.
+    year_options                       - list. Every year label.
+    stroke_teams_selected_without_year - list. Highlighted teams.
+    team_colours_dict                  - dict. Colour of each team.
+    interval_cube                      - StatsCube or None.
+                                         Confidence intervals.
+    """
+    index_names = utilities_descriptive.container_results.\
+        metric_display_names
+    inverse_index_names = dict(zip(index_names.values(), index_names.keys()))
+
+    # A new profiler for each run, so that reruns of only this
+    # fragment are recorded too:
+    profiler = utilities_descriptive.profiling.RerunProfiler(
+        profile_setting, run='scatter')
+    with profiler.section('container_scatter'):
+        st.header('Relation between two features')
+        st.markdown('Compare the variation of two features across hospitals.')
+        cols_scatter_inputs = st.columns(4)
+        # Pick two features to scatter:
+        with cols_scatter_inputs[0]:
+            x_feature_display_name = st.selectbox(
+                'Feature for x-axis',
+                options=index_names.values(),
+                key='scatter_x_feature_ds'
+            )
+            x_feature_name = inverse_index_names[x_feature_display_name]
+
+        with cols_scatter_inputs[1]:
+            y_feature_display_name = st.selectbox(
+                'Feature for y-axis',
+                options=index_names.values(),
+                key='scatter_y_feature_ds'
+            )
+            y_feature_name = inverse_index_names[y_feature_display_name]
+
+        with cols_scatter_inputs[2]:
+            c_feature_display_name = st.selectbox(
+                'Feature for colour',
+                options=['None'] + list(index_names.values()),
+                key='scatter_colour_feature_ds'
+            )
+            c_feature_name = (inverse_index_names[c_feature_display_name]
+                              if c_feature_display_name != 'None'
+                              else c_feature_display_name)
+
+        with cols_scatter_inputs[3]:
+            year_restriction = st.selectbox(
+                'Years to show',
+                options=year_options,
+                key='scatter_year_ds'
+            )
+
+        utilities_descriptive.container_plots.scatter_fields(
+            x_feature_name,
+            y_feature_name,
+            c_feature_name,
+            year_restriction,
+            stats_cube,
+            cohort,
+            stroke_teams_selected_without_year,
+            team_colours_dict,
+            x_feature_display_name,
+            y_feature_display_name,
+            c_feature_display_name,
+            interval_cube
+            )
+    profiler.finish(
+        st.container(),
+        selection={
+            'cohort': cohort,
+            'scatter_features': [
+                x_feature_name, y_feature_name, c_feature_name],
+            'scatter_year': year_restriction
+            }
+        )
 
 
 def main():
@@ -54,6 +217,15 @@ def main():
     # ###########################
     page_setup()
 
+    # Folder with the data files:
+    data_dir = get_data_dir()
+
+    # Optional timings for each section of the page
+    # (only recorded when switched on, see profiling.py):
+    profile_setting = utilities_descriptive.profiling.get_profile_setting()
+    profiler = utilities_descriptive.profiling.RerunProfiler(
+        profile_setting)
+
     # Title:
     st.markdown('# 📊 Descriptive statistics')
     st.markdown(''.join([
@@ -84,6 +256,8 @@ def main():
     |                        container_scatter                        |
     |                                                                 |
     |                        container_details                        |
+    |                                                                 |
+    |                      container_diagnostics                      |
     +-----------------------------------------------------------------+
     """
     cols_inputs_map = st.columns([0.6, 0.4])
@@ -114,17 +288,31 @@ def main():
     container_violins = st.container()
     container_scatter = st.container()
     container_details = st.container()
+    container_diagnostics = st.container()
 
 
     # ###########################
     # ########## SETUP ##########
     # ###########################
 
+    # The cohort cube allows more filters on the patients.
+    # It's optional, so only show the 4hr toggle if it's missing.
+    cohort_cube = utilities_descriptive.data_loading.\
+        load_cohort_cube(data_dir)
+
     # Decide which descriptive stats file to use:
     with container_input_4hr_toggle:
-        limit_to_4hr = st.toggle('Limit to arrival within 4hr')
+        if cohort_cube is None:
+            limit_to_4hr = st.toggle(
+                'Limit to arrival within 4hr', key='arrive_in_4hr_ds')
+            cohort_filter = {'arrive_in_4_hours': limit_to_4hr}
+        else:
+            cohort_filter = utilities_descriptive.container_inputs.\
+                input_cohort_filters()
+            limit_to_4hr = cohort_filter['arrive_in_4_hours']
+    # 'all' or '4hr' for the stats files, or a list of the filters:
+    cohort = get_cohort_label(cohort_filter)
     if limit_to_4hr:
-        summary_stats_file = 'summary_stats_4hr.csv'
         with container_dataset:
             st.markdown(
                 '''  
@@ -139,7 +327,6 @@ def main():
                 '''
                 )
     else:
-        summary_stats_file = 'summary_stats.csv'
         with container_dataset:
             st.markdown(
                 '''        
@@ -153,31 +340,66 @@ def main():
                 | 💉 Teams with at least 10 thrombolysis |  |
                 '''
                 )
-    # Read in the data:
-    summary_stats_df = pd.read_csv(
-        f'{dir}/data_descriptive/{summary_stats_file}',
-        index_col=0
-        )
+    # Describe any filters other than the 4hr one:
+    other_filters = get_cohort_label(
+        dict(cohort_filter, arrive_in_4_hours=False))
+    if other_filters != 'all':
+        with container_dataset:
+            st.markdown(f'+ Further limited to patients with: {other_filters}')
+    # Read in the data.
+    profiler.start('load_data')
+    # This is cached so the files are only parsed once per process.
+    # The stats for all teams are in an array for fast lookups:
+    stats_cube = utilities_descriptive.data_loading.\
+        load_stats_cube(data_dir)
+    # The stats files only have the 'all' and '4hr' cohorts.
+    # Work out the stats for any other filter from the cohort cube:
+    stats_from_cube = cohort not in stats_cube.cohorts
+    if stats_from_cube:
+        stats_cube = utilities_descriptive.data_loading.\
+            load_filtered_stats_cube(data_dir, cohort_filter)
+
+    # Import list of all stroke teams (already sorted by team name):
+    df_stroke_team = utilities_descriptive.data_loading.\
+        load_stroke_team_locations(
+            f'{data_dir}/hospitals_and_lsoas_descriptive_stats.csv'
+            )
 
-    # Import list of all stroke teams:
-    df_stroke_team = pd.read_csv(
-        f'{dir}/data_descriptive/hospitals_and_lsoas_descriptive_stats.csv',
-        index_col=False
-        ).sort_values('Stroke Team')
+    # Confidence intervals for the stats files, if they exist:
+    interval_cube = utilities_descriptive.data_loading.\
+        load_interval_cube(data_dir)
 
-    # List of years in the data:
-    year_options = sorted(set(summary_stats_df.loc['year']))
-    # Move the "all years" option to the front of the list:
-    year_options.remove(all_years_str)
-    year_options = [all_years_str] + year_options
+    # Lookups between teams, regions and the stats:
+    team_index = utilities_descriptive.data_loading.load_team_index(
+        data_dir,
+        f'{data_dir}/hospitals_and_lsoas_descriptive_stats.csv'
+        )
+    profiler.stop()
+
+    # List of years in the data.
+    # The cube already has the "all years" option at the front.
+    # Take its label from the data so that it still matches when
+    # another year is added, e.g. "2016 to 2022".
+    year_options = list(stats_cube.years)
+    all_years_str = year_options[0]
 
     with container_years:
         years_selected = st.multiselect(
             'Select year(s):',
             year_options,
-            default=all_years_str
+            default=all_years_str,
+            key='year_input_ds'
         )
 
+    # The stats for the results table only need the selected years:
+    with profiler.section('load_stats_table'):
+        if stats_from_cube:
+            summary_stats_df = stats_cube.to_summary_stats(
+                cohort, years_selected)
+        else:
+            summary_stats_df = utilities_descriptive.data_loading.\
+                load_stats_table(data_dir, cohort, years_selected)
+
     # Pull in the list of stroke teams that have already been selected.
     try:
         # If we've already selected highlighted teams using the
@@ -186,36 +408,27 @@ def main():
     except KeyError:
         # Make a dummy list so streamlit behaves as normal:
         existing_teams = [f'{all_teams_str}']
-    # Check which regions those existing teams belong in:
-    existing_regions = []
-    for team in existing_teams:
-        if team[:4] != 'All ':
-            region = df_stroke_team['RGN11NM'][
-                df_stroke_team['Stroke Team'] == team].squeeze()
-            if region not in existing_regions:
-                existing_regions.append(region)
+    # Check which regions those existing teams belong in.
+    # Skip any team that isn't in the locations file:
+    existing_regions = list(dict.fromkeys(
+        team_index.region_of_team.get(team) for team in existing_teams
+        if team[:4] != 'All '
+        ))
+    existing_regions = [r for r in existing_regions if r is not None]
 
     with container_input_regions:
         # Select regions:
         regions_selected = utilities_descriptive.container_inputs.\
             inputs_region_choice(
-                df_stroke_team,
+                team_index,
                 existing_regions
                 )
         # Remove teams that aren't in the selected regions:
-        existing_teams_selected_regions = []
-        for team in existing_teams:
-            if team[:4] != 'All ':
-                region = df_stroke_team['RGN11NM'][
-                    df_stroke_team['Stroke Team'] == team].squeeze()
-                if region in regions_selected:
-                    existing_teams_selected_regions.append(team)
-            else:
-                if team[:len(all_teams_str)] == all_teams_str:
-                    existing_teams_selected_regions.append(team)
-                region = team.split('All ')[1]
-                if region in regions_selected:
-                    existing_teams_selected_regions.append(team)
+        existing_teams_selected_regions = [
+            team for team in existing_teams
+            if (team == all_teams_str or
+                team_index.region_of_team.get(team) in regions_selected)
+            ]
 
     st.session_state['highlighted_teams_with_click_ds'] = (
         existing_teams_selected_regions
@@ -228,7 +441,7 @@ def main():
          short_stroke_teams_selected_without_year) = \
             utilities_descriptive.container_inputs.\
             input_stroke_teams_to_highlight(
-                df_stroke_team,
+                team_index,
                 regions_selected,
                 all_teams_str,
                 years_selected,
@@ -243,119 +456,144 @@ def main():
         stroke_teams_selected_without_year)
     # ... and this line pulls out the results of those functions:
     team_colours_dict = st.session_state['highlighted_teams_colours_ds']
-    # List of the team colours in the same order as the teams list
-    # (used for adding colours to the table).
-    team_colours = [team_colours_dict[t] for t
-                    in stroke_teams_selected_without_year]
 
     # Now use these colours in drawing the map:
-    with container_map:
+    with container_map, profiler.section('container_map'):
+        # Optionally shade the regions and teams by one feature:
+        (map_feature, map_feature_display, map_year) = \
+            utilities_descriptive.container_inputs.input_map_shading(
+                utilities_descriptive.container_results.metric_display_names,
+                year_options
+                )
+        if map_feature is None:
+            map_shading = None
+        else:
+            map_shading = utilities_descriptive.container_plots.\
+                get_map_shading(
+                    stats_cube,
+                    team_index,
+                    cohort,
+                    map_feature,
+                    map_feature_display,
+                    map_year
+                    )
         # Plot the team locations
         utilities_descriptive.container_plots.\
             plot_geography_pins(
                 df_stroke_team,
+                team_index,
                 short_stroke_teams_selected_without_year,
-                team_colours_dict
+                team_colours_dict,
+                map_shading
                 )
 
     # ###########################
     # ######### RESULTS #########
     # ###########################
 
+    profiler.start('container_results_table')
+    with container_results_table:
+        st.header('Results')
+        # The intervals are only worked out for the stats files:
+        if interval_cube is not None and not stats_from_cube:
+            show_intervals = st.toggle('Show 95% confidence intervals')
+        else:
+            show_intervals = False
     # Check that all of the requested data exists.
     # Remove any teams that don't exist and print a warning message.
     df_to_show = utilities_descriptive.container_results.\
         check_teams_in_stats_df(
             summary_stats_df,
             stroke_teams_selected,
+            team_index,
+            # A filter from the cohort cube can leave some teams and
+            # years with no patients, so check its own table:
+            None if stats_from_cube else cohort,
             container_warnings
         )
 
-    # Save a copy of the table for the download button.
-    # The button needs df.to_csv() and so does not work with a
-    # styled dataframe. We also should avoid the % formatting and
-    # prettier column names here because they're incompatible with
-    # the full data file.
-    df_to_download = df_to_show.copy()
+    # The download button uses the numbers as they are.
+    # We should avoid the % formatting and prettier column names
+    # here because they're incompatible with the full data file.
+    # (df_to_show isn't changed below, so no copy is needed.)
+    df_to_download = df_to_show
 
     # Update the order of the rows to this:
-    index_names = {
-        'count': 'Count',
-        'age': 'Average age',
-        'male': 'Male',
-        'infarction': 'Infarction',
-        'stroke_severity': 'Stroke severity',
-        'afib_anticoagulant': 'AF anticoagulants',
-        'prior_disability': 'Average pre-stroke disability',
-        'prestroke_mrs_0-2': 'Pre-stroke mRS 0-2',
-        'onset_known': 'Onset known',
-        'precise_onset_known': 'Precise onset known',
-        'onset_during_sleep': 'Onset during sleep',
-        'onset_to_arrival_time': 'Onset-to-arrival time (minutes)',
-        'arrive_in_4_hours': 'Arrive within 4 hours',
-        'arrival_to_scan_time': 'Arrival-to-scan time (minutes)',
-        'thrombolysis': 'Thrombolysis',
-        'scan_to_thrombolysis_time': 'Scan-to-thrombolysis time (minutes)',
-        'death': 'Death',
-        'discharge_disability': 'Average discharge disability',
-        'increased_disability_due_to_stroke':
-            'Increased disability due to stroke',
-        'mrs_5-6': 'Discharge disability 5-6',
-        'mrs_0-2': 'Discharge disability 0-2'
-    }
-    inverse_index_names = dict(zip(index_names.values(), index_names.keys()))
-    # Reduce the dataframe to only these rows, in that order:
-    df_to_show = df_to_show.loc[list(index_names.keys())]
-    # Convert all string values to numeric:
-    # (when imported, the dataframe contained strings in the stroke_team
-    # column. Now that's gone, it's all numeric data.)
-    df_to_show = df_to_show.apply(pd.to_numeric)
-
-    # Change format to percentage:
-    rows_percentage = [
-        'male', 'infarction', 'afib_anticoagulant',
-        'prestroke_mrs_0-2', 'onset_known', 'precise_onset_known',
-        'onset_during_sleep', 'arrive_in_4_hours', 'thrombolysis',
-        'death', 'mrs_5-6', 'mrs_0-2'
-    ]
-    for row in rows_percentage:
-        df_to_show.loc[row] = df_to_show.loc[row].apply('{:.1%}'.format)
-    # Change format to integer:
-    df_to_show.loc['count'] = df_to_show.loc['count'].apply('{:.0f}'.format)
-    # Change format of time rows:
-    rows_time = [
-        'onset_to_arrival_time',
-        'arrival_to_scan_time',
-        'scan_to_thrombolysis_time'
-    ]
-    for row in rows_time:
-        df_to_show.loc[row] = df_to_show.loc[row].apply('{:.0f}'.format)
-    # Change format of float rows:
-    rows_float = [
-        'age', 'stroke_severity', 'prior_disability',
-        'discharge_disability', 'increased_disability_due_to_stroke'
-    ]
-    for row in rows_float:
-        df_to_show.loc[row] = df_to_show.loc[row].apply('{:.2f}'.format)
-
-    # Update index names.
-    df_to_show.index = index_names.values()
-
-    # Apply styles to the table:
-    df_to_show = utilities_descriptive.container_results.\
-        apply_styles_to_dataframe(df_to_show, team_colours)
+    index_names = utilities_descriptive.container_results.\
+        metric_display_names
+    # Colour of each column that's left, from its team:
+    team_of_label = dict(zip(
+        stroke_teams_selected, stroke_teams_selected_without_year))
+    column_colours = [
+        team_colours_dict[team_of_label[label]]
+        for label in df_to_show.columns
+        ]
+
+    # Fingerprint of the data files for the cached table and downloads:
+    data_version = utilities_descriptive.data_loading.get_data_version(
+        data_dir)
+
+    # Format the rows in the order of index_names and make the
+    # table. This is cached, so it's only done again when the teams,
+    # years, cohort or colours change:
+    table_html = utilities_descriptive.container_results.\
+        render_results_table(
+            tuple(df_to_show.columns),
+            tuple(column_colours),
+            cohort,
+            show_intervals,
+            data_version,
+            df_to_show,
+            interval_cube,
+            index_names
+            )
 
     # Draw in streamlit:
     with container_results_table:
-        st.header('Results')
-        st.table(df_to_show)
-
-        # Add an option to include this data:
+        st.html(table_html)
+
+        # Add an option to include this data.
+        # The files are only made when a button is clicked, in
+        # the export functions given to the buttons:
+        export_format = st.radio(
+            'Download format',
+            options=list(utilities_descriptive.export.export_formats),
+            horizontal=True
+            )
+        extension, mime = \
+            utilities_descriptive.export.export_formats[export_format]
+        st.download_button(
+            f'Download this table as {extension}',
+            functools.partial(
+                utilities_descriptive.export.export_selection,
+                tuple(df_to_download.columns),
+                cohort,
+                export_format,
+                data_version,
+                df_to_download
+                ),
+            file_name=f'stroke_descriptive_stats{extension}',
+            mime=mime,
+            # Don't rerun the page after the download:
+            on_click='ignore',
+            key='download_selection'
+        )
         st.download_button(
-            'Download this table as .csv',
-            # df_to_download,
-            df_to_download.to_csv(),
-            file_name='stroke_descriptive_stats.csv'
+            f'Download the stats for all teams, years and cohorts '
+            f'as {extension}',
+            functools.partial(
+                utilities_descriptive.export.export_all_stats,
+                data_dir,
+                data_version,
+                export_format
+                ),
+            file_name=(
+                f'{utilities_descriptive.export.full_export_name}'
+                f'{extension}'
+                ),
+            mime=mime,
+            on_click='ignore',
+            key='download_all'
         )
         st.markdown(
             '''
@@ -365,80 +603,36 @@ def main():
             [github-img]: https://img.shields.io/badge/github-%23121011.svg?style=for-the-badge&logo=github&logoColor=white
             [github-data]: https://github.com/samuel-book/streamlit_descriptive_stats/tree/main/data_descriptive
             ''')
+    profiler.stop()
 
     # #########################
     # ######### PLOTS #########
     # #########################
 
+    # Each plot is in a fragment, so changing its own options only
+    # reruns that plot and not the rest of the page:
     with container_violins:
-        st.header('One feature over time')
-        st.markdown('Compare one feature across multiple years.')
-
-        # User inputs for which feature to plot:
-        feature_display = st.selectbox(
-            'Pick a feature to plot',
-            options=index_names.values(),
-            # default='count'
-        )
-        # Convert this to actual feature name:
-        feature = inverse_index_names[feature_display]
-
-        utilities_descriptive.container_plots.plot_violins(
-            summary_stats_df,
-            feature,
-            feature_display,
+        show_violins(
+            profile_setting,
+            stats_cube,
+            cohort,
             year_options,
             stroke_teams_selected_without_year,
             all_years_str,
-            all_teams_str,
-            team_colours_dict
+            team_colours_dict,
+            # The intervals are only worked out for the stats files:
+            None if stats_from_cube else interval_cube
             )
 
     with container_scatter:
-        st.header('Relation between two features')
-        st.markdown('Compare the variation of two features across hospitals.')
-        cols_scatter_inputs = st.columns(4)
-        # Pick two features to scatter:
-        with cols_scatter_inputs[0]:
-            x_feature_display_name = st.selectbox(
-                'Feature for x-axis',
-                options=index_names.values()
-            )
-            x_feature_name = inverse_index_names[x_feature_display_name]
-
-        with cols_scatter_inputs[1]:
-            y_feature_display_name = st.selectbox(
-                'Feature for y-axis',
-                options=index_names.values()
-            )
-            y_feature_name = inverse_index_names[y_feature_display_name]
-
-        with cols_scatter_inputs[2]:
-            c_feature_display_name = st.selectbox(
-                'Feature for colour',
-                options=['None'] + list(index_names.values())
-            )
-            c_feature_name = (inverse_index_names[c_feature_display_name]
-                              if c_feature_display_name != 'None'
-                              else c_feature_display_name)
-
-        with cols_scatter_inputs[3]:
-            year_restriction = st.selectbox(
-                'Years to show',
-                options=year_options
-            )
-
-        utilities_descriptive.container_plots.scatter_fields(
-            x_feature_name,
-            y_feature_name,
-            c_feature_name,
-            year_restriction,
-            summary_stats_df,
+        show_scatter(
+            profile_setting,
+            stats_cube,
+            cohort,
+            year_options,
             stroke_teams_selected_without_year,
             team_colours_dict,
-            x_feature_display_name,
-            y_feature_display_name,
-            c_feature_display_name
+            None if stats_from_cube else interval_cube
             )
 
     with container_details:
@@ -454,6 +648,8 @@ The data comes from the Sentinel Stroke National Audit Programme (SSNAP).
 
 We keep a copy of this original data and also create a subset that contains only patients who have known onset time and who arrived at hospital within four hours of stroke onset.
 Which of these two datasets is shown in the app is controlled with a "limit to 4hrs" toggle button.
+If the "cohort cube" file is available, more toggles can limit the patients further, e.g. to infarctions only or to some age bands.
+The stats for these are added up from smaller groups of patients while the app runs.
 
 ### Calculating the statistics
 
@@ -467,9 +663,25 @@ We show the total number in the group with the "count" row in the table.
 For all of the other rows in the table, we wish to show an average value across all of these patients.
 For properties involving time ('onset_to_arrival_time', 'arrival_to_scan_time', 'scan_to_thrombolysis_time') we take the median time.
 For all other properties, we take the mean value across all patients.
+
+The 95% confidence intervals show how much each number could change by chance with this many patients.
+For proportions we use the Wilson score interval, for other means the Student t interval, and for median times the bootstrap interval.
 '''
         )
 
+    # Show the timings if they were recorded. The plot fragments
+    # record their own options:
+    profiler.finish(
+        container_diagnostics,
+        selection={
+            'cohort': cohort,
+            'years': years_selected,
+            'teams': short_stroke_teams_selected_without_year,
+            'map_feature': map_feature,
+            'map_year': map_year
+            }
+        )
+
     # ----- The end! -----
 
 
@@ -0,0 +1,196 @@
+"""
+Saved team-level accumulators for adding new years of data.
+
+aggregation.py turns the patient data into "accumulators" for each
+stroke team, year and cohort cell: sums and counts for the means and
+exact histograms for the medians. Everything in the descriptive
+stats tables and the cohort cube can be worked out from these
+without the patient data.
+
+This module saves the accumulators as Arrow IPC datasets split into
+one folder per year:
+
+    stats_accumulators/totals/year=2019/part-0.arrow
+    stats_accumulators/arrival_to_scan_time/year=2019/part-0.arrow
+
+When a new year of patient data arrives, only that year has to be
+accumulated and written. The folders for the other years are left
+as they are.
+
+These files hold counts of patients for every team and year, so
+treat them like the patient-level data and don't publish them.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from utilities_descriptive.aggregation import \
+    cohort_cell_key, median_fields
+
+
+# Name of the folder inside data_descriptive:
+accumulator_store_dir = 'stats_accumulators'
+
+# One folder per year:
+partitioning = ds.partitioning(
+    pa.schema([('year', pa.string())]), flavor='hive')
+
+# Separator between the accumulator and feature names in the
+# totals column names, e.g. 'sum.age' for ('sum', 'age').
+column_separator = '.'
+
+
+def stats_to_tables(stats):
+    """
+    Convert the accumulators to Arrow tables.
+
+    Inputs:
+    -------
+    stats - dict. Output of accumulate_cohort_cube() or merge_stats().
+
+    Returns:
+    --------
+    tables - dict. 'totals' and each median feature name, with a table
+             for each. Every table has 'year', 'stroke_team' and
+             'cohort_cell' columns.
+    """
+    tables = {}
+    totals = stats['totals']
+    # One column per accumulator, keeping the dtypes (e.g. integer
+    # counts) as they are:
+    df = pd.DataFrame({
+        column_separator.join(c): totals[c].to_numpy()
+        for c in totals.columns
+        })
+    tables['totals'] = _add_labels(df, totals.index)
+
+    for field, hist in stats['histograms'].items():
+        df = pd.DataFrame({
+            'value': hist.index.get_level_values(3).astype(float),
+            'patients': hist.to_numpy()
+            })
+        tables[field] = _add_labels(df, hist.index)
+    return tables
+
+
+def _add_labels(df, index):
+    df.insert(0, cohort_cell_key, index.get_level_values(2).astype(np.int16))
+    df.insert(0, 'stroke_team', index.get_level_values(0).astype(str))
+    df.insert(0, 'year', index.get_level_values(1).astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _get_index(df, value_level=None):
+    levels = ['stroke_team', 'year', cohort_cell_key]
+    if value_level is not None:
+        levels.append(value_level)
+    return pd.MultiIndex.from_arrays(
+        [df[level] if level != 'year' else df[level].astype(int)
+         for level in levels],
+        names=levels
+        )
+
+
+def tables_to_stats(tables):
+    """
+    Convert Arrow tables back to accumulators.
+
+    Inputs:
+    -------
+    tables - dict. Output of stats_to_tables().
+
+    Returns:
+    --------
+    stats - dict. Accumulators in the same format as
+            accumulate_cohort_cube(), sorted by team, year and cell.
+    """
+    df = tables['totals'].to_pandas()
+    index = _get_index(df)
+    columns = [c for c in df.columns
+               if c not in ['year', 'stroke_team', cohort_cell_key]]
+    totals = df[columns].set_axis(index)
+    totals.columns = pd.MultiIndex.from_tuples(
+        [tuple(c.split(column_separator, 1)) for c in columns])
+    totals = totals.sort_index()
+
+    histograms = {}
+    for field in median_fields:
+        df = tables[field].to_pandas()
+        index = _get_index(df.rename(columns={'value': field}), field)
+        histograms[field] = pd.Series(
+            df['patients'].to_numpy(), index=index).sort_index()
+    return {'totals': totals, 'histograms': histograms}
+
+
+def write_accumulators(cube_stats, path):
+    """
+    Save the accumulators.
+
+    Only the folders for the years in cube_stats are written. Any
+    existing files for those years are replaced and the other years
+    are left as they are.
+
+    Inputs:
+    -------
+    cube_stats - dict. Output of accumulate_cohort_cube().
+    path       - str. Folder to save the accumulators in.
+    """
+    for name, table in stats_to_tables(cube_stats).items():
+        ds.write_dataset(
+            table,
+            os.path.join(path, name),
+            format='ipc',
+            partitioning=partitioning,
+            basename_template='part-{i}.arrow',
+            existing_data_behavior='delete_matching'
+            )
+
+
+def read_accumulators(path, years=None):
+    """
+    Load the saved accumulators.
+
+    Inputs:
+    -------
+    path  - str. Folder the accumulators were saved in.
+    years - list or None. Years to load. None loads all of them.
+
+    Returns:
+    --------
+    cube_stats - dict. Accumulators in the same format as
+                 accumulate_cohort_cube().
+    """
+    tables = {}
+    for name in ['totals'] + median_fields:
+        dataset = ds.dataset(
+            os.path.join(path, name), format='ipc',
+            partitioning=partitioning
+            )
+        expression = None
+        if years is not None:
+            expression = ds.field('year').isin([str(y) for y in years])
+        tables[name] = dataset.to_table(filter=expression)
+    return tables_to_stats(tables)
+
+
+def get_stored_years(path):
+    """
+    Find which years have saved accumulators.
+
+    Inputs:
+    -------
+    path - str. Folder the accumulators were saved in.
+
+    Returns:
+    --------
+    years - list. Sorted years (int).
+    """
+    dataset = ds.dataset(
+        os.path.join(path, 'totals'), format='ipc',
+        partitioning=partitioning
+        )
+    years = dataset.to_table(columns=['year']).column('year')
+    return sorted(int(y) for y in np.unique(years.to_numpy()))
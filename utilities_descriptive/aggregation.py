@@ -0,0 +1,1115 @@
+"""
+Calculate the descriptive stats from the patient-level data.
+
+This does the work of the summary stats loops in the notebook
+data_descriptive/01_descriptive_stats.ipynb, and gives the same
+summary_stats.csv and summary_stats_4hr.csv files.
+
+Instead of masking the full patient data once for every team, region
+and year, the patients are grouped by stroke team and year in a
+single pass. Each group is stored as "accumulators" that can be added
+together without going back to the patient data:
+
++ for features that take the mean, the sum of values and the number
+  of non-missing values.
++ for features that take the sum, the sum.
++ for features that take the median, an exact histogram: how many
+  patients had each value.
+
+The regional, national and "all years" results are then found by
+adding up the team-level accumulators. Their confidence intervals
+come from the same accumulators (see confidence_intervals.py), with
+the sums of squares kept for means of features that aren't
+True/False.
+
+The patients are also split by a "cohort cell" within each team and
+year: one cell for each combination of the True/False fields in
+cohort_dimensions and the age bands. Any cohort that is made of whole
+cells, like the 4hr cohort, is found by adding up its cells, so
+there's only one pass over the patients however many cohorts there
+are. The app uses the same cells to filter the patients on the fly
+(see cohort_cube.py).
+"""
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from utilities_descriptive.confidence_intervals import \
+    interval_names, mean_interval, median_interval_from_histogram, \
+    wilson_interval
+from utilities_descriptive.fixed_params import \
+    age_band_edges, age_band_labels, all_teams_str, cohort_cube_file, \
+    cohort_dimensions, get_all_years_str, stats_dataset_dir, \
+    summary_stats_files, summary_stats_interval_files
+
+
+# How to summarise each feature in the patient data.
+# 'none' marks the labels that are added separately.
+summary_stats_dict = {
+    'count': 'sum',
+    'stroke_team': 'none',
+    'age': 'mean',
+    'male': 'mean',
+    'infarction': 'mean',
+    'stroke_severity': 'mean',
+    'onset_to_arrival_time': 'median',
+    'onset_known': 'mean',
+    'arrive_in_4_hours': 'mean',
+    'precise_onset_known': 'mean',
+    'onset_during_sleep': 'mean',
+    'year': 'none',
+    'afib_anticoagulant': 'mean',
+    'prior_disability': 'mean',
+    'prestroke_mrs_0-2': 'mean',
+    'arrival_to_scan_time': 'median',
+    'thrombolysis': 'mean',
+    'scan_to_thrombolysis_time': 'median',
+    'death': 'mean',
+    'discharge_disability': 'mean',
+    'increased_disability_due_to_stroke': 'mean',
+    'mrs_5-6': 'mean',
+    'mrs_0-2': 'mean'
+}
+mean_fields = [k for k, v in summary_stats_dict.items() if v == 'mean']
+median_fields = [k for k, v in summary_stats_dict.items() if v == 'median']
+sum_fields = [k for k, v in summary_stats_dict.items() if v == 'sum']
+# Mean features that are True/False, so the mean is a proportion:
+proportion_fields = [
+    'male', 'infarction', 'onset_known', 'arrive_in_4_hours',
+    'precise_onset_known', 'onset_during_sleep', 'afib_anticoagulant',
+    'prestroke_mrs_0-2', 'thrombolysis', 'death', 'mrs_5-6', 'mrs_0-2'
+]
+# The other mean features also need the sum of squares for the
+# confidence intervals:
+spread_fields = [f for f in mean_fields if f not in proportion_fields]
+# Features with confidence intervals and the names of the limits:
+interval_fields = mean_fields + median_fields
+interval_stats_fields = [
+    name for field in summary_stats_dict if field in interval_fields
+    for name in interval_names(field)
+    ]
+
+# Columns of the patient data that make up each group:
+group_keys = ['stroke_team', 'year']
+
+# Columns needed from the raw SSNAP extract:
+extract_fields = [
+    'stroke_team', 'age', 'male', 'infarction', 'stroke_severity',
+    'onset_to_arrival_time', 'onset_known', 'precise_onset_known',
+    'onset_during_sleep', 'arrive_by_ambulance', 'year',
+    'afib_anticoagulant', 'prior_disability', 'arrival_to_scan_time',
+    'thrombolysis', 'scan_to_thrombolysis_time', 'death',
+    'discharge_disability'
+]
+
+# Smaller dtypes for reading the extract in chunks. The times and
+# scores are whole numbers so float32 stores them exactly, and there
+# are few enough teams to store them as categories. The True/False
+# fields are left to the parser so that missing values are handled
+# in the same way as when the whole file is read at once.
+extract_dtypes = {
+    'stroke_team': 'category',
+    'year': 'int16',
+    'stroke_severity': 'float32',
+    'onset_to_arrival_time': 'float32',
+    'arrival_to_scan_time': 'float32',
+    'scan_to_thrombolysis_time': 'float32',
+    'prior_disability': 'float32',
+    'discharge_disability': 'float32'
+}
+
+# Subsets of patients that each get their own stats file.
+# The values are the True/False field that picks out the patients
+# in the cohort, or None for all patients.
+cohort_fields = {
+    'all': None,
+    '4hr': 'arrive_in_4_hours'
+}
+# The files they're written to are summary_stats_files and
+# summary_stats_interval_files in fixed_params.py.
+
+# The fields and age bands that the patients can be filtered by,
+# cohort_dimensions and age_band_labels, are in fixed_params.py so
+# that the app can use them without this module.
+# Name of the index level for the cohort cell:
+cohort_cell_key = 'cohort_cell'
+
+# Only keep teams with more than this many admissions:
+min_team_count = 100
+
+
+def prepare_patient_data(data_all):
+    """
+    Restrict the SSNAP extract to the patients and fields we need.
+
+    Keeps only patients who arrived by ambulance and adds the extra
+    fields that are summarised in the descriptive stats.
+
+    Inputs:
+    -------
+    data_all - pd.DataFrame. Patient-level SSNAP data with at least
+               the columns in extract_fields.
+
+    Returns:
+    --------
+    data_all - pd.DataFrame. New dataframe with one row per patient
+               and one column per feature in summary_stats_dict.
+    """
+    # Limit data to out of hospital onset arriving by ambulance only.
+    # (Can't limit by onset_to_arrival_time > 0 as the cleaned data
+    # has no onset to arrival time given whenever onset known is 0.)
+    data_all = data_all[data_all['arrive_by_ambulance'] == True].copy()
+
+    # Add new fields
+    data_all['count'] = 1
+    data_all['prestroke_mrs_0-2'] = data_all['prior_disability'] <= 2
+    data_all['mrs_5-6'] = data_all['discharge_disability'] >= 5
+    data_all['mrs_0-2'] = data_all['discharge_disability'] <= 2
+
+    data_all['arrive_in_4_hours'] = (
+        (data_all['onset_known'] == True) &
+        (data_all['onset_to_arrival_time'] <= 240)
+    )
+    # Add change in disability
+    data_all['increased_disability_due_to_stroke'] = (
+        data_all['discharge_disability'] - data_all['prior_disability'])
+
+    return data_all[list(summary_stats_dict.keys())]
+
+
+def accumulate_stats(data, keys=group_keys):
+    """
+    Group patients by team and year and store the accumulators.
+
+    Inputs:
+    -------
+    data - pd.DataFrame. Patient-level data, e.g. the output of
+           prepare_patient_data().
+    keys - list. Columns to group the patients by. The first two
+           must be the team and year.
+
+    Returns:
+    --------
+    stats - dict. Contains:
+            'totals' - pd.DataFrame indexed by (stroke_team, year).
+                       Columns ('sum', feature) for mean and sum
+                       features, ('n', feature) for the number of
+                       non-missing values of mean features and
+                       ('sumsq', feature) for the sum of squares of
+                       the features in spread_fields.
+            'histograms' - dict. For each median feature, a pd.Series
+                       of patient counts indexed by
+                       (stroke_team, year, value).
+            Any extra keys are extra index levels after the year.
+    """
+    group_columns = keys
+    keys = [data[k] for k in group_columns]
+    # Means. Convert to float so that True/False columns with
+    # missing values are summed in the same way as numbers.
+    values = data[mean_fields].astype(float)
+    grouped = values.groupby(keys, sort=True, observed=True)
+    totals = pd.concat({'sum': grouped.sum(), 'n': grouped.count()}, axis=1)
+    # Sums keep their original dtype so that counts stay integers:
+    for field in sum_fields:
+        totals[('sum', field)] = (
+            data[field].groupby(keys, observed=True).sum())
+    for field in spread_fields:
+        totals[('sumsq', field)] = (
+            (values[field] ** 2).groupby(keys, observed=True).sum())
+
+    # Exact histograms for the medians. Missing values are dropped
+    # by the groupby in the same way that median() ignores them.
+    histograms = {
+        field: data.groupby(
+            group_columns + [field], sort=True, observed=True).size()
+        for field in median_fields
+        }
+    return {'totals': totals, 'histograms': histograms}
+
+
+def merge_stats(stats_list):
+    """
+    Add together the accumulators from separate groups of patients.
+
+    Inputs:
+    -------
+    stats_list - list. Outputs from accumulate_stats().
+
+    Returns:
+    --------
+    stats - dict. The combined accumulators in the same format.
+    """
+    if len(stats_list) == 0:
+        # There's no index to make empty accumulators with, and
+        # pd.concat() can't join an empty list.
+        raise ValueError('There are no accumulators to merge.')
+    totals = pd.concat([s['totals'] for s in stats_list])
+    totals = totals.groupby(
+        level=list(range(totals.index.nlevels)), sort=True).sum()
+    histograms = {}
+    for field in median_fields:
+        hist = pd.concat([s['histograms'][field] for s in stats_list])
+        # observed=True so that a categorical team level doesn't fill
+        # in a zero for every combination of team, year and value:
+        histograms[field] = hist.groupby(
+            level=list(range(hist.index.nlevels)), sort=True,
+            observed=True
+            ).sum()
+    return {'totals': totals, 'histograms': histograms}
+
+
+def rollup_stats(stats, team_groups, all_years_str=None):
+    """
+    Combine team-level accumulators into larger groups.
+
+    Inputs:
+    -------
+    stats         - dict. Output of accumulate_stats().
+    team_groups   - dict. Keys are stroke teams and values are the
+                    name of the group they belong to, e.g. their
+                    region. Teams not in the dict are left out.
+    all_years_str - str or None. If given, combine all years into
+                    one with this label. Otherwise keep each year.
+
+    Returns:
+    --------
+    stats - dict. Accumulators in the same format indexed by
+            (group, year). Year labels are converted to strings.
+    """
+    def group_codes(index):
+        # Work with the integer codes of the index levels so that
+        # only the unique team names and years are looked up and
+        # converted, rather than one label per row. The new codes
+        # follow the sorted order of the labels, like a sorted groupby.
+        team_level = index.levels[0].map(team_groups)
+        groups = pd.Index(sorted(set(team_level.dropna())))
+        group_codes = groups.get_indexer(team_level)[index.codes[0]]
+        # Teams not in the dict are left out:
+        keep = (group_codes >= 0) & (index.codes[0] >= 0)
+        if all_years_str is None:
+            year_level = index.levels[1].astype(str)
+            years = pd.Index(sorted(set(year_level)))
+            year_codes = years.get_indexer(year_level)[index.codes[1]]
+        else:
+            years = pd.Index([all_years_str])
+            year_codes = np.zeros(len(index), dtype=int)
+        return groups, group_codes, years, year_codes, keep
+
+    totals = stats['totals']
+    groups, group_codes_totals, years, year_codes, keep = \
+        group_codes(totals.index)
+    totals = totals[keep].groupby(
+        [group_codes_totals[keep], year_codes[keep]], sort=True).sum()
+    totals.index = pd.MultiIndex(
+        levels=[groups, years],
+        codes=[totals.index.get_level_values(i) for i in range(2)]
+        )
+
+    # The histograms are much longer than the totals, so add them up
+    # with np.bincount on one combined code for (group, year, value).
+    histograms = {}
+    for field, hist in stats['histograms'].items():
+        groups, group_codes_hist, years, year_codes, keep = \
+            group_codes(hist.index)
+        values = hist.index.levels[2]
+        value_codes = hist.index.codes[2]
+        if not values.is_monotonic_increasing:
+            # Renumber the values so that the codes are in order:
+            order = np.argsort(values.to_numpy())
+            rank = np.empty(len(order), dtype=int)
+            rank[order] = np.arange(len(order))
+            values = values[order]
+            value_codes = rank[value_codes]
+        n_years = len(years)
+        n_values = len(values)
+        key = (
+            (group_codes_hist[keep] * n_years + year_codes[keep]) *
+            n_values + value_codes[keep]
+            )
+        # Only add up the keys that turn up, so the memory needed
+        # doesn't grow with groups x years x values:
+        present, inverse = np.unique(key, return_inverse=True)
+        counts = np.bincount(inverse, weights=hist.to_numpy()[keep])
+        group_year, value_code = np.divmod(present, n_values)
+        group_code, year_code = np.divmod(group_year, n_years)
+        index = pd.MultiIndex(
+            levels=[groups, years, values],
+            codes=[group_code, year_code, value_code]
+            )
+        histograms[field] = pd.Series(
+            counts.astype(hist.dtype), index=index)
+    return {'totals': totals, 'histograms': histograms}
+
+
+def median_from_histogram(hist):
+    """
+    Find the median of each group from an exact histogram.
+
+    This matches pd.Series.median(): for an even number of values,
+    the median is halfway between the two middle values.
+
+    Inputs:
+    -------
+    hist - pd.Series. Counts indexed by (group levels..., value),
+           sorted so that values increase within each group.
+
+    Returns:
+    --------
+    medians - pd.Series. One median per group.
+    """
+    hist = hist[hist > 0]
+    levels = list(range(hist.index.nlevels - 1))
+    values = hist.index.get_level_values(-1).to_numpy(dtype=float)
+    groups = hist.index.droplevel(-1)
+    grouped = hist.groupby(level=levels, sort=False)
+    cumulative = grouped.cumsum().to_numpy()
+    total = grouped.transform('sum').to_numpy()
+
+    # The k-th value (counting from zero) is the first value whose
+    # cumulative count is more than k.
+    def value_at(k):
+        mask = cumulative > k
+        return pd.Series(values[mask], index=groups[mask]).groupby(
+            level=levels, sort=True).first()
+
+    lower = value_at((total - 1) // 2)
+    upper = value_at(total // 2)
+    return (lower + upper) / 2
+
+
+def summarise_stats(stats):
+    """
+    Turn accumulators into the descriptive stats for each group.
+
+    Inputs:
+    -------
+    stats - dict. Output of accumulate_stats() or rollup_stats().
+
+    Returns:
+    --------
+    results - pd.DataFrame. One row per group in the accumulators
+              and one column per feature in summary_stats_dict.
+    """
+    totals = stats['totals']
+    results = pd.DataFrame(index=totals.index)
+    for field, how in summary_stats_dict.items():
+        if how == 'mean':
+            results[field] = totals[('sum', field)] / totals[('n', field)]
+        elif how == 'median':
+            medians = median_from_histogram(stats['histograms'][field])
+            results[field] = medians.reindex(totals.index)
+        elif how == 'sum':
+            results[field] = totals[('sum', field)]
+    return results
+
+
+def summarise_confidence_intervals(stats):
+    """
+    Find the confidence intervals for each group from accumulators.
+
+    Inputs:
+    -------
+    stats - dict. Output of accumulate_stats() or rollup_stats().
+
+    Returns:
+    --------
+    intervals - pd.DataFrame. One row per group in the accumulators
+                and the lower and upper limits of each feature in
+                interval_fields as columns, named by interval_names().
+    """
+    totals = stats['totals']
+    intervals = pd.DataFrame(index=totals.index)
+    for field in summary_stats_dict:
+        lower_name, upper_name = interval_names(field)
+        if field in proportion_fields:
+            lower, upper = wilson_interval(
+                totals[('sum', field)], totals[('n', field)])
+        elif field in spread_fields:
+            lower, upper = mean_interval(
+                totals[('sum', field)], totals[('sumsq', field)],
+                totals[('n', field)]
+                )
+        elif field in median_fields:
+            lower, upper = median_interval_from_histogram(
+                stats['histograms'][field])
+            lower = lower.reindex(totals.index)
+            upper = upper.reindex(totals.index)
+        else:
+            continue
+        intervals[lower_name] = np.asarray(lower)
+        intervals[upper_name] = np.asarray(upper)
+    return intervals
+
+
+def select_years(stats, years):
+    """
+    Keep only the accumulators for some years.
+
+    Inputs:
+    -------
+    stats - dict. Output of accumulate_stats() or merge_stats().
+    years - list. Years to keep.
+
+    Returns:
+    --------
+    stats - dict. The accumulators for those years.
+    """
+    def in_years(index):
+        return index.get_level_values(1).isin(years)
+
+    totals = stats['totals']
+    return {
+        'totals': totals[in_years(totals.index)],
+        'histograms': {
+            field: hist[in_years(hist.index)]
+            for field, hist in stats['histograms'].items()
+            }
+        }
+
+
+def get_group_order(df_stroke_team, stroke_teams):
+    """
+    List the groups in the order of the summary_stats.csv columns.
+
+    Inputs:
+    -------
+    df_stroke_team - pd.DataFrame. Team locations with column
+                     'RGN11NM' (region name).
+    stroke_teams   - list. Teams to give their own results.
+
+    Returns:
+    --------
+    group_order - list. The national group, then each region, then
+                  each team.
+    """
+    regions = sorted(set(df_stroke_team['RGN11NM']))
+    return (
+        [all_teams_str] + [f'All {r}' for r in regions] + list(stroke_teams))
+
+
+def summarise_all_groups(
+        stats,
+        df_stroke_team,
+        stroke_teams,
+        years,
+        all_years_str=None
+        ):
+    """
+    Find the stats for the nation, each region and each team.
+
+    Inputs:
+    -------
+    stats          - dict. Team-level output of accumulate_stats().
+    df_stroke_team - pd.DataFrame. Team locations with columns
+                     'Stroke Team' and 'RGN11NM' (region name).
+    stroke_teams   - list. Teams to give their own results.
+    years          - list. Sorted years to give their own results.
+    all_years_str  - str or None. Label for all of the years in stats
+                     combined. If None, the first and last of the
+                     years make the label, e.g. "2016 to 2021".
+
+    Returns:
+    --------
+    results - pd.DataFrame. One row per (group, year) label and one
+              column per feature and per confidence limit, in the
+              same order as the summary_stats.csv columns. Groups
+              with no patients have a count of zero and missing
+              values elsewhere.
+    """
+    team_regions = dict(zip(
+        df_stroke_team['Stroke Team'], df_stroke_team['RGN11NM']))
+    if all_years_str is None:
+        all_years_str = get_all_years_str(years)
+    year_labels = [all_years_str] + [str(y) for y in years]
+    # Only the requested years need their own results:
+    stats_years = select_years(stats, years)
+
+    # Only patients at teams in the locations file are included,
+    # so the national group is made of every team in there.
+    team_groupings = [
+        {t: all_teams_str for t in team_regions},
+        {t: f'All {r}' for t, r in team_regions.items()},
+        {t: t for t in team_regions}
+        ]
+    results = []
+    for team_groups in team_groupings:
+        for rolled_up in [
+                rollup_stats(stats, team_groups, all_years_str),
+                rollup_stats(stats_years, team_groups)
+                ]:
+            results.append(pd.concat([
+                summarise_stats(rolled_up),
+                summarise_confidence_intervals(rolled_up)
+                ], axis=1))
+    results = pd.concat(results)
+
+    # Put the groups in order and include any with no patients:
+    group_order = get_group_order(df_stroke_team, stroke_teams)
+    index = pd.MultiIndex.from_product(
+        [group_order, year_labels], names=['stroke_team', 'year'])
+    results = results.reindex(index)
+    for field in sum_fields:
+        dtype = stats['totals'][('sum', field)].dtype
+        results[field] = results[field].fillna(0).astype(dtype)
+    return results
+
+
+def format_summary_stats(results, mask_count=None, fields=None):
+    """
+    Lay out the stats in the same format as summary_stats.csv.
+
+    Inputs:
+    -------
+    results    - pd.DataFrame. Output of summarise_all_groups().
+    mask_count - pd.Series or None. Which columns of the output to
+                 keep. If None, keep groups with more than
+                 min_team_count admissions.
+    fields     - list or None. Which results to include as rows.
+                 If None, the features in summary_stats_dict.
+
+    Returns:
+    --------
+    summary_stats_df - pd.DataFrame. One column per "team (year)"
+                       and one row per feature, plus the
+                       'stroke_team' and 'year' rows.
+    mask_count       - pd.Series. Which columns were kept. Pass this
+                       in again to keep the same columns for a
+                       subset of patients.
+    """
+    teams = results.index.get_level_values(0)
+    years = results.index.get_level_values(1)
+    df = results.copy()
+    df.index = [f'{t} ({y})' for t, y in zip(teams, years)]
+
+    if mask_count is None:
+        mask_count = df['count'] > min_team_count
+    keep = mask_count.reindex(df.index, fill_value=False).to_numpy()
+    df = df[keep]
+
+    # Round floats to 3 decimal places. The notebook's values were
+    # np.float64, so its round() used numpy's rounding, and so does
+    # CohortCube.stats_cube():
+    float_fields = df.select_dtypes(include='float').columns
+    df[float_fields] = np.round(df[float_fields], 3)
+
+    df['stroke_team'] = teams[keep]
+    df['year'] = years[keep]
+
+    if fields is None:
+        fields = [k for k, v in summary_stats_dict.items() if v != 'none']
+    summary_stats_df = df[fields + ['stroke_team', 'year']].T
+    return summary_stats_df, mask_count
+
+
+def get_cohort_cells(data):
+    """
+    Find the cohort cell of each patient.
+
+    The cell number has one bit for each field in cohort_dimensions,
+    set when the field is True, and the age band above those bits.
+
+    Inputs:
+    -------
+    data - pd.DataFrame. Output of prepare_patient_data().
+
+    Returns:
+    --------
+    cells - np.ndarray. Cell number (int16) of each patient.
+    """
+    cells = np.zeros(len(data), dtype=np.int16)
+    for bit, field in enumerate(cohort_dimensions):
+        cells |= (data[field] == True).to_numpy().astype(np.int16) << bit
+    age = data['age'].to_numpy(dtype=float)
+    age_bands = np.searchsorted(age_band_edges, age, side='right')
+    age_bands[np.isnan(age)] = len(age_band_labels) - 1
+    cells |= age_bands.astype(np.int16) << len(cohort_dimensions)
+    return cells
+
+
+def get_cell_dimensions(cells):
+    """
+    Split cell numbers back into the cohort dimensions.
+
+    Inputs:
+    -------
+    cells - np.ndarray. Cell numbers from get_cohort_cells().
+
+    Returns:
+    --------
+    dimensions - dict. For each field in cohort_dimensions, a bool
+                 array that is True where the field is True. Also
+                 'age_band', the position in age_band_labels.
+    """
+    cells = np.asarray(cells)
+    dimensions = {
+        field: ((cells >> bit) & 1).astype(bool)
+        for bit, field in enumerate(cohort_dimensions)
+        }
+    dimensions['age_band'] = cells >> len(cohort_dimensions)
+    return dimensions
+
+
+def accumulate_cohort_cube(data):
+    """
+    Accumulate the stats for each team, year and cohort cell.
+
+    Inputs:
+    -------
+    data - pd.DataFrame. Output of prepare_patient_data().
+
+    Returns:
+    --------
+    cube_stats - dict. Output of accumulate_stats() with an extra
+                 index level for the cohort cell after the year.
+    """
+    data = data.assign(**{cohort_cell_key: get_cohort_cells(data)})
+    return accumulate_stats(data, group_keys + [cohort_cell_key])
+
+
+def cohorts_from_cube(cube_stats):
+    """
+    Add up the cohort cells to get the stats for each cohort.
+
+    Inputs:
+    -------
+    cube_stats - dict. Output of accumulate_cohort_cube() or
+                 merge_stats().
+
+    Returns:
+    --------
+    cohort_stats - dict. Keys are the names in cohort_fields and
+                   values are accumulators in the same format as
+                   accumulate_stats().
+    """
+    def in_cohort(index, field):
+        if field is None:
+            return np.ones(len(index), dtype=bool)
+        cells = index.get_level_values(2).to_numpy()
+        return get_cell_dimensions(cells)[field]
+
+    cohort_stats = {}
+    for cohort, field in cohort_fields.items():
+        totals = cube_stats['totals']
+        totals = totals[in_cohort(totals.index, field)].groupby(
+            level=[0, 1], sort=True, observed=True).sum()
+        histograms = {}
+        for name, hist in cube_stats['histograms'].items():
+            histograms[name] = hist[in_cohort(hist.index, field)].groupby(
+                level=[0, 1, 3], sort=True, observed=True).sum()
+        cohort_stats[cohort] = {'totals': totals, 'histograms': histograms}
+    return cohort_stats
+
+
+def accumulate_cohorts(data):
+    """
+    Accumulate the stats for each cohort of patients.
+
+    Inputs:
+    -------
+    data - pd.DataFrame. Output of prepare_patient_data().
+
+    Returns:
+    --------
+    cohort_stats - dict. Keys are the names in cohort_fields and
+                   values are outputs of accumulate_stats().
+    """
+    return cohorts_from_cube(accumulate_cohort_cube(data))
+
+
+def merge_cohorts(cohort_stats_list):
+    """
+    Add together the accumulators for each cohort.
+
+    Inputs:
+    -------
+    cohort_stats_list - list. Outputs from accumulate_cohorts().
+
+    Returns:
+    --------
+    cohort_stats - dict. The combined accumulators in the same format.
+    """
+    return {
+        cohort: merge_stats([c[cohort] for c in cohort_stats_list])
+        for cohort in cohort_fields
+        }
+
+
+def summary_stats_from_cohorts(
+        cohort_stats,
+        df_stroke_team,
+        stroke_teams,
+        years=None,
+        all_years_str=None,
+        map_function=map
+        ):
+    """
+    Create the descriptive stats tables from the accumulators.
+
+    Inputs:
+    -------
+    cohort_stats   - dict. Output of accumulate_cohorts().
+    df_stroke_team - pd.DataFrame. Team locations with columns
+                     'Stroke Team' and 'RGN11NM' (region name).
+                     Only patients at these teams are included.
+    stroke_teams   - list. Teams to give their own results.
+    years          - list or None. Years to give their own results.
+                     If None, use every year in the data.
+    all_years_str  - str or None. Label for all of the years in the
+                     data combined. If None, the first and last of
+                     the years make the label.
+    map_function   - callable. Used like the built-in map() to
+                     summarise the cohorts, e.g. the map() of a
+                     ProcessPoolExecutor to do them in parallel.
+
+    Returns:
+    --------
+    summary_stats_dfs - dict. Keys are cohort names and values are
+                        the stats tables. Every cohort keeps the
+                        same teams as the 'all' cohort.
+    interval_dfs      - dict. Keys are cohort names and values are
+                        the confidence intervals in the same layout
+                        with the same columns as the stats tables.
+    """
+    if years is None:
+        years = sorted(set(
+            cohort_stats['all']['totals'].index.get_level_values(1)))
+
+    # The cohorts don't depend on each other until they're formatted:
+    results_list = map_function(
+        functools.partial(
+            summarise_all_groups,
+            df_stroke_team=df_stroke_team,
+            stroke_teams=stroke_teams,
+            years=years,
+            all_years_str=all_years_str
+            ),
+        cohort_stats.values()
+        )
+
+    summary_stats_dfs = {}
+    interval_dfs = {}
+    # Only keep hospitals with more than 100 admissions in the full
+    # data (not the 4hr data), so work out the mask from 'all' first.
+    mask_count = None
+    for cohort, results in zip(cohort_stats.keys(), results_list):
+        summary_stats_dfs[cohort], mask_count = format_summary_stats(
+            results, mask_count)
+        interval_dfs[cohort], _ = format_summary_stats(
+            results, mask_count, interval_stats_fields)
+    return summary_stats_dfs, interval_dfs
+
+
+def build_summary_stats(data_all, df_stroke_team, stroke_teams, years=None):
+    """
+    Calculate both descriptive stats tables from the patient data.
+
+    Inputs:
+    -------
+    data_all       - pd.DataFrame. Output of prepare_patient_data().
+    df_stroke_team - pd.DataFrame. Team locations with columns
+                     'Stroke Team' and 'RGN11NM' (region name).
+    stroke_teams   - list. Teams to give their own results.
+    years          - list or None. Years to give their own results.
+                     If None, use every year in the data.
+
+    Returns:
+    --------
+    summary_stats_df     - pd.DataFrame. Stats for all patients.
+    summary_stats_4hr_df - pd.DataFrame. Stats for patients who
+                           arrived within 4 hours of known onset.
+                           Uses the same teams as summary_stats_df.
+    interval_dfs         - dict. Keys are cohort names and values
+                           are the confidence intervals for the
+                           stats tables, to be saved in the files in
+                           summary_stats_interval_files.
+    """
+    summary_stats_dfs, interval_dfs = summary_stats_from_cohorts(
+        accumulate_cohorts(data_all), df_stroke_team, stroke_teams, years)
+    return summary_stats_dfs['all'], summary_stats_dfs['4hr'], interval_dfs
+
+
+def replace_years_in_summary_stats(
+        summary_stats_df,
+        new_summary_stats_df,
+        group_order,
+        year_labels
+        ):
+    """
+    Swap new columns into an existing descriptive stats table.
+
+    Columns in the old table for any year in the new table are
+    replaced, and columns for years that aren't in year_labels (such
+    as an old "all years" label) are removed. The other columns are
+    kept exactly as they were.
+
+    Inputs:
+    -------
+    summary_stats_df     - pd.DataFrame. The existing stats table in
+                           the summary_stats.csv layout.
+    new_summary_stats_df - pd.DataFrame. Stats for the new years in
+                           the same layout.
+    group_order          - list. Order of the groups in the output,
+                           from get_group_order().
+    year_labels          - list. Order of the years in the output,
+                           starting with the "all years" label.
+
+    Returns:
+    --------
+    summary_stats_df - pd.DataFrame. The combined stats table.
+    """
+    new_years = set(new_summary_stats_df.loc['year'].astype(str))
+    old_years = summary_stats_df.loc['year'].astype(str)
+    keep = old_years.isin(year_labels) & ~old_years.isin(new_years)
+    df = pd.concat(
+        [summary_stats_df.loc[:, keep.to_numpy()], new_summary_stats_df],
+        axis=1
+        )
+
+    # Put the columns in the usual order. Groups that aren't in the
+    # group order any more go at the end.
+    group_rank = {g: i for i, g in enumerate(group_order)}
+    year_rank = {y: i for i, y in enumerate(year_labels)}
+    rank = [
+        (group_rank.get(g, len(group_rank)), year_rank[str(y)])
+        for g, y in zip(df.loc['stroke_team'], df.loc['year'])
+        ]
+    order = sorted(range(len(rank)), key=lambda i: rank[i])
+    return df.iloc[:, order]
+
+
+def accumulate_extract_in_chunks(path, chunksize=200000):
+    """
+    Read a patient-level SSNAP extract in chunks and accumulate stats.
+
+    Only the columns in extract_fields are read, using the smaller
+    dtypes in extract_dtypes. Each chunk is prepared, accumulated
+    and added to the running totals before the next one is read, so
+    the memory used depends on the chunk size and the number of
+    teams and years rather than the number of patients.
+
+    Inputs:
+    -------
+    path      - str. Path to the extract .csv file.
+    chunksize - int. Number of patients to read at once.
+
+    Returns:
+    --------
+    cube_stats - dict. Accumulators for each team, year and cohort
+                 cell in the same format as accumulate_cohort_cube().
+    """
+    reader = pd.read_csv(
+        path,
+        usecols=extract_fields,
+        dtype=extract_dtypes,
+        chunksize=chunksize
+        )
+    cube_stats = None
+    for chunk in reader:
+        chunk_stats = accumulate_cohort_cube(prepare_patient_data(chunk))
+        if cube_stats is None:
+            cube_stats = chunk_stats
+        else:
+            cube_stats = merge_stats([cube_stats, chunk_stats])
+    if cube_stats is None:
+        raise ValueError(f'There are no patients to accumulate in {path}.')
+    return cube_stats
+
+
+def write_summary_stats(
+        cube_stats,
+        data_dir,
+        stroke_teams,
+        df_stroke_team,
+        years=None,
+        map_function=map
+        ):
+    """
+    Write the stats files from accumulators for the given years.
+
+    If years is None, every file is written from scratch. Otherwise
+    only the columns for those years and for all years combined are
+    worked out and they replace the matching columns in the existing
+    files. The confidence interval files are written from scratch
+    when any of them don't exist yet, e.g. when they were never made
+    for the existing stats.
+
+    The cohort cube for the app is always written for every year.
+
+    Inputs:
+    -------
+    cube_stats     - dict. Accumulators for every year, e.g. from
+                     read_accumulators().
+    data_dir       - str. Folder for the output files.
+    stroke_teams   - list. Teams to give their own results.
+    df_stroke_team - pd.DataFrame. Team locations.
+    years          - list or None. Years that have changed.
+    map_function   - callable. Passed on to
+                     summary_stats_from_cohorts().
+    """
+    from utilities_descriptive.cohort_cube import write_cohort_cube
+    from utilities_descriptive.stats_dataset import \
+        delete_stale_years, write_stats_dataset
+
+    cohort_stats = cohorts_from_cube(cube_stats)
+    all_years = sorted(set(
+        cohort_stats['all']['totals'].index.get_level_values(1)))
+    all_years_str = get_all_years_str(all_years)
+    year_labels = [all_years_str] + [str(y) for y in all_years]
+
+    summary_stats_dfs, interval_dfs = summary_stats_from_cohorts(
+        cohort_stats, df_stroke_team, stroke_teams,
+        years=all_years if years is None else years,
+        all_years_str=all_years_str,
+        map_function=map_function
+        )
+    # There's nothing to swap the new years into if the intervals
+    # haven't been written before, so work them out for every year:
+    intervals_missing = years is not None and not all(
+        os.path.isfile(os.path.join(data_dir, file))
+        for file in summary_stats_interval_files.values()
+        )
+    if intervals_missing:
+        _, interval_dfs = summary_stats_from_cohorts(
+            cohort_stats, df_stroke_team, stroke_teams,
+            years=all_years,
+            all_years_str=all_years_str,
+            map_function=map_function
+            )
+    # The confidence intervals are written in the same way as the
+    # stats next to them:
+    for dfs, files, replace_years in [
+            (summary_stats_dfs, summary_stats_files, years is not None),
+            (interval_dfs, summary_stats_interval_files,
+             years is not None and not intervals_missing)
+            ]:
+        for cohort, summary_stats_df in dfs.items():
+            path = os.path.join(data_dir, files[cohort])
+            if replace_years:
+                # Keep the existing columns for the other years:
+                summary_stats_df = replace_years_in_summary_stats(
+                    pd.read_csv(path, index_col=0),
+                    summary_stats_df,
+                    get_group_order(df_stroke_team, stroke_teams),
+                    year_labels
+                    )
+            summary_stats_df.to_csv(path)
+
+    # Also write the columnar copy that the app reads. Only the
+    # folders for the years in summary_stats_dfs are replaced.
+    dataset_path = os.path.join(data_dir, stats_dataset_dir)
+    write_stats_dataset(summary_stats_dfs, dataset_path)
+    delete_stale_years(dataset_path, year_labels)
+
+    # And the cohort cells so that the app can filter the patients:
+    write_cohort_cube(
+        cube_stats, df_stroke_team, stroke_teams,
+        os.path.join(data_dir, cohort_cube_file)
+        )
+
+
+def main():
+    """
+    Build the stats files from an extract without loading it all.
+
+    Run from the top of the repository, e.g.
+        python -m utilities_descriptive.aggregation \\
+            ~/ssnap_data/clean_samuel_ssnap_extract_v2.csv
+
+    The team-level accumulators are also saved in the data folder.
+    To add a new year of data to the existing stats, run with an
+    extract of only the new patients and --append. Only the new
+    patients are read and the columns for the other years are kept.
+
+    With --workers above 1, the patients are split between that many
+    processes. The results are the same for any number of workers.
+    """
+    import argparse
+    import shutil
+
+    from utilities_descriptive.accumulator_store import \
+        accumulator_store_dir, read_accumulators, write_accumulators
+
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+        )
+    parser.add_argument('extract', help='Patient-level SSNAP .csv file.')
+    parser.add_argument(
+        '--data-dir', default='./data_descriptive',
+        help='Folder with the team files and for the output files.')
+    parser.add_argument(
+        '--chunksize', type=int, default=200000,
+        help='Number of patients to read at once.')
+    parser.add_argument(
+        '--append', action='store_true',
+        help='Add the years in the extract to the existing stats.')
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of processes to use.')
+    parser.add_argument(
+        '--shard-by', choices=['stroke_team', 'year'],
+        default='stroke_team',
+        help='How to split the patients between the processes.')
+    args = parser.parse_args()
+
+    stroke_teams = list(pd.read_csv(
+        os.path.join(args.data_dir, 'stroke_teams.csv'), index_col=False
+        ).squeeze().values)
+    df_stroke_team = pd.read_csv(
+        os.path.join(
+            args.data_dir, 'hospitals_and_lsoas_descriptive_stats.csv'),
+        index_col=False
+        )
+
+    store_path = os.path.join(args.data_dir, accumulator_store_dir)
+    if args.workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(args.workers)
+        map_function = executor.map
+    else:
+        executor = None
+        map_function = map
+    # Shut down the workers even if something below fails:
+    try:
+        if executor is not None:
+            from utilities_descriptive.parallel_aggregation import \
+                accumulate_extract_in_parallel, shards_per_worker
+
+            cube_stats = accumulate_extract_in_parallel(
+                args.extract, executor, shards_per_worker * args.workers,
+                args.chunksize, args.shard_by
+                )
+        else:
+            cube_stats = accumulate_extract_in_chunks(
+                args.extract, args.chunksize)
+
+        if args.append:
+            # Save the new years next to the old ones and then load all
+            # of them. The accumulators are much smaller than the
+            # patient data, so the "all years" stats are quick to find
+            # from them.
+            new_years = sorted(set(
+                cube_stats['totals'].index.get_level_values(1)))
+            write_accumulators(cube_stats, store_path)
+            write_summary_stats(
+                read_accumulators(store_path), args.data_dir, stroke_teams,
+                df_stroke_team, years=new_years, map_function=map_function
+                )
+        else:
+            # Start the saved accumulators again from this extract:
+            shutil.rmtree(store_path, ignore_errors=True)
+            write_accumulators(cube_stats, store_path)
+            write_summary_stats(
+                cube_stats, args.data_dir, stroke_teams, df_stroke_team,
+                map_function=map_function
+                )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+"""
+Small JSON API for the descriptive stats.
+
+This serves the same stats as the results table on the demo page so
+that other dashboards can read them directly instead of scraping the
+app or copying the .csv files. It uses Python's own http.server and
+the same cached loading functions as the app, and can run next to
+it, e.g.
+    python -m utilities_descriptive.api --port 8502
+
+Endpoints (all GET):
+
++ /teams   - every stroke team and its region.
++ /regions - every region and its stroke teams.
++ /years   - the year labels, starting with all years combined.
++ /metrics - the names of the features.
++ /cohorts - the names of the cohorts, e.g. 'all' and '4hr'.
++ /stats   - the stats for some teams and years, e.g.
+      /stats?teams=Torbay Hospital,All England %26 Wales
+            &years=2019,2020&metrics=age,male&cohort=4hr
+  Every parameter is optional. teams defaults to every team and
+  group, years to all years combined, metrics to every feature and
+  cohort to 'all'. Lists can be given either separated by commas or
+  by repeating the parameter. Any team and year combinations without
+  stats are listed under "missing" as in the app's warning message.
+
+Each response has a strong ETag made from the version of the data
+files and the request. A client that sends the ETag back in an
+If-None-Match header gets an empty 304 response until the data
+files change, without the stats being looked up or converted to
+JSON again. The JSON for recent requests is also kept in memory so
+that other clients asking for the same thing get it straight away.
+"""
+import argparse
+import collections
+import hashlib
+import json
+import math
+import os
+import threading
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utilities_descriptive.data_loading import \
+    get_data_version, load_stats_cube, load_team_index
+
+
+# Name of the team locations file in the data_descriptive folder:
+locations_file = 'hospitals_and_lsoas_descriptive_stats.csv'
+
+# Paths that can be requested:
+endpoints = ['/teams', '/regions', '/years', '/metrics', '/cohorts', '/stats']
+
+# Default cohort for /stats:
+default_cohort = 'all'
+
+# Number of responses to keep in memory:
+response_cache_size = 256
+
+# Clients may keep a response but must check the ETag every time:
+cache_control = 'no-cache'
+
+
+class ApiError(Exception):
+    """
+    Problem with a request that should be reported to the client.
+    """
+    def __init__(self, message, status=HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+def get_list_param(params, name):
+    """
+    Get a list from the query parameters.
+
+    Inputs:
+    -------
+    params - dict. Output of urllib.parse.parse_qs().
+    name   - str. Name of the parameter, e.g. 'teams'.
+
+    Returns:
+    --------
+    values - list or None. The values in the order given, or None
+             if the parameter isn't there.
+    """
+    if name not in params:
+        return None
+    values = [v.strip() for value in params[name] for v in value.split(',')]
+    return [v for v in values if v != '']
+
+
+def parse_stats_request(params, stats_cube):
+    """
+    Check the /stats parameters and fill in the defaults.
+
+    Inputs:
+    -------
+    params     - dict. Output of urllib.parse.parse_qs().
+    stats_cube - StatsCube. The stats for every cohort.
+
+    Returns:
+    --------
+    request - tuple. (teams, years, metrics, cohort) with tuples
+              of names, so that it can be used in cache keys.
+    """
+    cohort = params.get('cohort', [default_cohort])[-1]
+    if cohort not in stats_cube.cohort_index:
+        raise ApiError(f'Unknown cohort: {cohort}')
+
+    teams = get_list_param(params, 'teams')
+    if teams is None:
+        teams = list(stats_cube.teams)
+
+    years = get_list_param(params, 'years')
+    if years is None:
+        # The "all years" label is first:
+        years = stats_cube.years[:1]
+    unknown = [y for y in years if y not in stats_cube.year_index]
+    if len(unknown) > 0:
+        raise ApiError('Unknown years: ' + ', '.join(unknown))
+
+    metrics = get_list_param(params, 'metrics')
+    if metrics is None:
+        metrics = stats_cube.metrics
+    unknown = [m for m in metrics if m not in stats_cube.metric_index]
+    if len(unknown) > 0:
+        raise ApiError('Unknown metrics: ' + ', '.join(unknown))
+    return tuple(teams), tuple(years), tuple(metrics), cohort
+
+
+def get_stats(stats_cube, team_index, teams, years, metrics, cohort):
+    """
+    Look up the stats for every combination of teams and years.
+
+    The combinations are in the same order as the columns of the
+    results table on the demo page: each year in turn with all of
+    the teams.
+
+    Inputs:
+    -------
+    stats_cube - StatsCube. The stats for every cohort.
+    team_index - TeamIndex. Lookups for the stroke teams.
+    teams      - tuple. Team names.
+    years      - tuple. Year labels.
+    metrics    - tuple. Feature names.
+    cohort     - str. Name of the cohort.
+
+    Returns:
+    --------
+    response - dict. 'cohort', 'metrics', 'stats' with one dict per
+               team and year that has stats, and 'missing' with the
+               labels of the combinations that don't.
+    """
+    labels = [f'{team} ({year})' for year in years for team in teams]
+    missing = team_index.missing_labels(labels, cohort)
+    missing_set = set(missing)
+    found = [
+        (team, year) for year in years for team in teams
+        if f'{team} ({year})' not in missing_set
+        ]
+    found_teams = [team for team, year in found]
+    found_years = [year for team, year in found]
+    values = {
+        metric: stats_cube.lookup(metric, found_teams, found_years, cohort)
+        for metric in metrics
+        }
+
+    stats = []
+    for i, (team, year) in enumerate(found):
+        row = {'stroke_team': team, 'year': year}
+        for metric in metrics:
+            value = float(values[metric][i])
+            if math.isnan(value):
+                # JSON has no NaN, so use null:
+                value = None
+            elif metric == 'count':
+                # The stats cube keeps every metric as a float:
+                value = int(value)
+            row[metric] = value
+        stats.append(row)
+    return {
+        'cohort': cohort,
+        'metrics': list(metrics),
+        'stats': stats,
+        'missing': missing
+        }
+
+
+class StatsApi:
+    """
+    Answer API requests from the cached stats.
+
+    This holds the data folder and the responses made so far. It
+    doesn't depend on http.server, so it can also be used from
+    another web framework.
+
+    Attributes:
+    -----------
+    data_dir       - str. Path to the data_descriptive folder.
+    locations_path - str. Path to the team locations .csv file.
+    """
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.locations_path = os.path.join(data_dir, locations_file)
+        self._responses = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_etag(self, path, query):
+        """
+        Make the ETag for a request without answering it.
+
+        Inputs:
+        -------
+        path  - str. Path part of the address, e.g. '/stats'.
+        query - str. Query string of the address.
+
+        Returns:
+        --------
+        key  - tuple. Key for the response cache.
+        etag - str. Quoted strong ETag.
+        """
+        if path not in endpoints:
+            raise ApiError(f'Not found: {path}', HTTPStatus.NOT_FOUND)
+        # Sort the parameters so that their order doesn't matter.
+        # The order of the values within each one is kept because
+        # it sets the order of the stats in the response.
+        params = sorted(urllib.parse.parse_qs(query).items())
+        key = (path, repr(params), repr(get_data_version(self.data_dir)))
+        digest = hashlib.sha256('\n'.join(key).encode()).hexdigest()
+        return key, f'"{digest[:32]}"'
+
+    def respond(self, key, path, query):
+        """
+        Get the JSON for a request.
+
+        Inputs:
+        -------
+        key   - tuple. Key for the response cache from get_etag().
+        path  - str. Path part of the address, e.g. '/stats'.
+        query - str. Query string of the address.
+
+        Returns:
+        --------
+        body - bytes. JSON response.
+        """
+        with self._lock:
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                return self._responses[key]
+
+        body = json.dumps(
+            self.make_response(path, urllib.parse.parse_qs(query)),
+            separators=(',', ':')
+            ).encode('utf-8')
+
+        with self._lock:
+            self._responses[key] = body
+            while len(self._responses) > response_cache_size:
+                self._responses.popitem(last=False)
+        return body
+
+    def make_response(self, path, params):
+        """
+        Look up the data for a request.
+
+        Inputs:
+        -------
+        path   - str. Path part of the address, e.g. '/stats'.
+        params - dict. Output of urllib.parse.parse_qs().
+
+        Returns:
+        --------
+        response - dict. Data to send as JSON.
+        """
+        stats_cube = load_stats_cube(self.data_dir)
+        team_index = load_team_index(self.data_dir, self.locations_path)
+        if path == '/teams':
+            return {'teams': [
+                {'stroke_team': team,
+                 'region': team_index.region_of_team[team]}
+                for team in team_index.teams
+                ]}
+        elif path == '/regions':
+            return {'regions': [
+                {'region': region,
+                 'stroke_teams': team_index.teams_in_region[region]}
+                for region in team_index.regions
+                ]}
+        elif path == '/years':
+            return {'years': stats_cube.years}
+        elif path == '/metrics':
+            return {'metrics': stats_cube.metrics}
+        elif path == '/cohorts':
+            return {'cohorts': stats_cube.cohorts}
+        else:
+            return get_stats(
+                stats_cube, team_index,
+                *parse_stats_request(params, stats_cube)
+                )
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """
+    http.server handler that passes GET requests to a StatsApi.
+
+    The StatsApi is the "api" attribute of the server.
+    """
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+        try:
+            api = self.server.api
+            key, etag = api.get_etag(path, url.query)
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                # The client already has this, so don't look it up:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+            body = api.respond(key, path, url.query)
+        except ApiError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+        self.send_json(HTTPStatus.OK, body, etag)
+
+    def send_json(self, status, body, etag=None):
+        """
+        Send a JSON response.
+
+        Inputs:
+        -------
+        status - HTTPStatus. Response code.
+        body   - bytes or dict. JSON, or data to convert to JSON.
+        etag   - str or None. ETag to send with the response.
+        """
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an ETag.
+
+    Inputs:
+    -------
+    if_none_match - str or None. Value of the header.
+    etag          - str. Quoted ETag of the current response.
+
+    Returns:
+    --------
+    matches - bool. True if the client already has this response.
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # Weak versions of the tag count too for If-None-Match:
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def main():
+    """
+    Serve the descriptive stats as JSON.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--data-dir', default='./data_descriptive',
+        help='Folder with the stats and team files.')
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help='Address to listen on.')
+    parser.add_argument(
+        '--port', type=int, default=8502,
+        help='Port to listen on.')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StatsRequestHandler)
+    server.api = StatsApi(args.data_dir)
+    print(f'Serving the stats on http://{args.host}:{args.port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,625 @@
+"""
+Timings for the app at different numbers of stroke teams.
+
+There are two sets of timings:
+
++ The interactive demo page is run headlessly with Streamlit's
+  AppTest and taken through a script of interactions: toggling the
+  4hr cohort, picking a region and teams, and changing the years and
+  the violin and scatter features. Each interaction is one rerun.
++ The main functions behind the page are timed on their own:
+  plot_violins(), scatter_fields(), plot_geography_pins(),
+  check_teams_in_stats_df() and render_results_table().
+
+Both run at 1x, 10x and 100x the number of stroke teams in the real
+data. The extra teams are copies of the real teams with slightly
+jittered stats and locations. The same number of teams is highlighted
+at every scale so that only the size of the data changes.
+
+The results are written to a .json file. Give an older results file
+with --compare to print how much each timing has changed.
+
+Run from the top of the repository, e.g.
+    python -m utilities_descriptive.benchmark --output bench.json
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utilities_descriptive.fixed_params import \
+    all_teams_str, data_dir_env_var, stats_dataset_dir
+from utilities_descriptive.stats_cube import build_stats_cube_from_records
+from utilities_descriptive.stats_dataset import \
+    read_stats_dataset, table_to_records, table_to_summary_stats, \
+    write_stats_dataset
+from utilities_descriptive.team_index import TeamIndex
+
+
+# Number of copies of the real stroke teams to time:
+default_scales = [1, 10, 100]
+# How many times to repeat each timing:
+default_repeats = 5
+# Highlighted teams are picked from this region:
+benchmark_region = 'South West'
+# Number of highlighted teams (as well as the "all teams" group):
+default_highlighted = 10
+# Year to show in the results table and the violins as well as the
+# "all years" group, which is taken from the data:
+benchmark_year = '2019'
+
+# Files the page needs in the data_descriptive folder:
+locations_file = 'hospitals_and_lsoas_descriptive_stats.csv'
+page_file = 'pages/2_Interactive_demo.py'
+
+
+# #############################
+# ##### SCALED-UP DATA ########
+# #############################
+
+def scale_stats_table(table, scale, seed=42):
+    """
+    Make a stats table with more stroke teams.
+
+    Each extra copy of the individual teams gets a number on the end
+    of its name, e.g. "Derriford Hospital 2", and has every stat
+    except the count multiplied by a random factor close to 1.
+    The "All ..." groups are kept as they are.
+
+    Inputs:
+    -------
+    table - pa.Table. The stats in the layout from read_stats_dataset().
+    scale - int. Number of copies of each individual team.
+    seed  - int. Seed for the random jitter.
+
+    Returns:
+    --------
+    table - pa.Table. The stats with scale times as many teams.
+    """
+    df = table.to_pandas()
+    is_group = df['stroke_team'].str[:4] == 'All '
+    df_teams = df[~is_group]
+    metrics = [
+        c for c in df.columns
+        if c not in ['cohort', 'year', 'stroke_team', 'count']
+        ]
+
+    rng = np.random.default_rng(seed)
+    dfs = [df]
+    for i in range(2, scale + 1):
+        df_copy = df_teams.copy()
+        df_copy['stroke_team'] = df_copy['stroke_team'] + f' {i}'
+        df_copy[metrics] = df_copy[metrics] * rng.normal(
+            1.0, 0.05, size=(len(df_copy), len(metrics)))
+        dfs.append(df_copy)
+    return pa.Table.from_pandas(pd.concat(dfs), preserve_index=False)
+
+
+def scale_stroke_team_locations(df_stroke_team, scale, seed=42):
+    """
+    Make a team locations table that matches scale_stats_table().
+
+    Each extra copy of a team keeps its region and has its location
+    moved by a few kilometres.
+
+    Inputs:
+    -------
+    df_stroke_team - pd.DataFrame. The real team locations.
+    scale          - int. Number of copies of each team.
+    seed           - int. Seed for the random jitter.
+
+    Returns:
+    --------
+    df_stroke_team - pd.DataFrame. Team locations sorted by team name.
+    """
+    rng = np.random.default_rng(seed)
+    dfs = [df_stroke_team]
+    for i in range(2, scale + 1):
+        df_copy = df_stroke_team.copy()
+        df_copy['Stroke Team'] = df_copy['Stroke Team'] + f' {i}'
+        df_copy['long'] += rng.normal(0.0, 0.05, size=len(df_copy))
+        df_copy['lat'] += rng.normal(0.0, 0.05, size=len(df_copy))
+        dfs.append(df_copy)
+    df = pd.concat(dfs, ignore_index=True)
+    return df.sort_values('Stroke Team', ignore_index=True)
+
+
+def write_scaled_data_dir(repo_dir, out_dir, table, df_stroke_team):
+    """
+    Write a data_descriptive folder with scaled-up data for the page.
+
+    Inputs:
+    -------
+    repo_dir       - str. Top of the repository.
+    out_dir        - str. Folder to create data_descriptive inside.
+    table          - pa.Table. Scaled-up stats.
+    df_stroke_team - pd.DataFrame. Scaled-up team locations.
+
+    Returns:
+    --------
+    data_dir - str. The new data_descriptive folder.
+    """
+    data_dir = os.path.join(out_dir, 'data_descriptive')
+    os.makedirs(data_dir)
+    # Files that don't change with the number of teams:
+    shutil.copyfile(
+        os.path.join(repo_dir, 'data_descriptive', 'stroke_teams.csv'),
+        os.path.join(data_dir, 'stroke_teams.csv')
+        )
+    df_stroke_team.to_csv(os.path.join(data_dir, locations_file), index=False)
+    summary_stats_dfs = {
+        cohort: table_to_summary_stats(
+            table.filter(pc.equal(table['cohort'], cohort)))
+        for cohort in pc.unique(table['cohort']).to_pylist()
+        }
+    write_stats_dataset(
+        summary_stats_dfs, os.path.join(data_dir, stats_dataset_dir))
+    return data_dir
+
+
+def pick_highlighted_teams(team_index, n_highlighted):
+    """
+    Pick the teams to highlight in the benchmarks.
+
+    Inputs:
+    -------
+    team_index    - TeamIndex. Lookups for the stroke teams.
+    n_highlighted - int. Number of individual teams to pick.
+
+    Returns:
+    --------
+    teams - list. The "all teams" group and then the first teams in
+            the benchmark region.
+    """
+    teams = team_index.teams_in_regions([benchmark_region])
+    return [all_teams_str] + teams[:n_highlighted]
+
+
+# ##########################
+# ##### TIMING HELPERS #####
+# ##########################
+
+def time_call(func, repeats):
+    """
+    Time a function a few times.
+
+    Inputs:
+    -------
+    func    - callable. Takes no arguments.
+    repeats - int. Number of times to call it.
+
+    Returns:
+    --------
+    times - list. Wall time of each call in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarise_times(times):
+    """
+    Summarise a list of timings for the results file.
+
+    Inputs:
+    -------
+    times - list. Wall times in seconds.
+
+    Returns:
+    --------
+    summary - dict. The times and their minimum, median and mean.
+    """
+    return {
+        'times': times,
+        'min': float(np.min(times)),
+        'median': float(np.median(times)),
+        'mean': float(np.mean(times))
+        }
+
+
+# ###############################
+# ##### FUNCTION BENCHMARKS #####
+# ###############################
+
+def benchmark_functions(table, df_stroke_team, n_highlighted, repeats):
+    """
+    Time the functions behind the page at one scale.
+
+    The plot functions are run outside of a streamlit app, so their
+    st.plotly_chart() calls still build the chart message but don't
+    send it anywhere.
+
+    Inputs:
+    -------
+    table          - pa.Table. Stats for every team.
+    df_stroke_team - pd.DataFrame. Team locations.
+    n_highlighted  - int. Number of teams to highlight.
+    repeats        - int. Number of times to call each function.
+
+    Returns:
+    --------
+    results - dict. Keys are function names and values are the
+              summaries from summarise_times().
+    """
+    import streamlit as st
+    from utilities_descriptive import container_plots, container_results
+    from utilities_descriptive.plot_utils import ColourAllocator
+
+    cohort = 'all'
+    stats_cube = build_stats_cube_from_records(*table_to_records(table))
+    team_index = TeamIndex(df_stroke_team, stats_cube)
+    all_years_str = stats_cube.years[0]
+    benchmark_years = [all_years_str, benchmark_year]
+    summary_stats_df = table_to_summary_stats(table.filter(
+        pc.and_(
+            pc.equal(table['cohort'], cohort),
+            pc.is_in(table['year'], pa.array(benchmark_years))
+            )
+        ))
+
+    teams = pick_highlighted_teams(team_index, n_highlighted)
+    teams_with_year = [f'{t} ({y})' for y in benchmark_years for t in teams]
+    teams_without_year = teams * len(benchmark_years)
+    team_colours_dict = ColourAllocator().assign(teams)
+    df_to_show = summary_stats_df[teams_with_year]
+    index_names = {m: m for m in container_results.metric_formats}
+    container_warnings = st.container()
+
+    calls = {
+        # A new allocator each time, so every team gets a new colour:
+        'assign_colours': lambda: ColourAllocator().assign(teams),
+        'plot_violins': lambda: container_plots.plot_violins(
+            stats_cube, cohort, 'age', 'Average age', stats_cube.years,
+            teams_without_year, all_years_str, all_teams_str,
+            team_colours_dict
+            ),
+        'scatter_fields': lambda: container_plots.scatter_fields(
+            'age', 'thrombolysis', 'death', all_years_str, stats_cube,
+            cohort, teams_without_year, team_colours_dict,
+            'Average age', 'Thrombolysis', 'Death'
+            ),
+        'plot_geography_pins': lambda: container_plots.plot_geography_pins(
+            df_stroke_team, team_index, teams, team_colours_dict),
+        'check_teams_in_stats_df': lambda:
+            container_results.check_teams_in_stats_df(
+                summary_stats_df, teams_with_year, team_index, cohort,
+                container_warnings
+                ),
+        # Skip the cache so that the table is made every time:
+        'render_results_table': lambda:
+            container_results.render_results_table.__wrapped__(
+                tuple(teams_with_year),
+                tuple(team_colours_dict[t] for t in teams_without_year),
+                cohort, False, None, df_to_show, None, index_names
+                ),
+        }
+    return {
+        name: summarise_times(time_call(func, repeats))
+        for name, func in calls.items()
+        }
+
+
+# ##########################
+# ##### APP BENCHMARKS #####
+# ##########################
+
+def app_interactions(n_highlighted):
+    """
+    The script of interactions with the demo page.
+
+    Inputs:
+    -------
+    n_highlighted - int. Number of teams to pick.
+
+    Returns:
+    --------
+    interactions - list. (name, function) pairs. Each function takes
+                   an AppTest and changes one widget.
+    """
+    def pick_teams(at):
+        teams = at.multiselect(key='team_input_ds')
+        teams.set_value(teams.options[:n_highlighted + 1])
+
+    def pick_years(at):
+        # The first option is the "all years" group:
+        years = at.multiselect(key='year_input_ds')
+        years.set_value([years.options[0], benchmark_year])
+
+    # Look the widgets up by key rather than position, so that adding
+    # widgets to the page doesn't change which ones are picked:
+    return [
+        ('toggle_4hr',
+         lambda at: at.toggle(key='arrive_in_4hr_ds').set_value(True)),
+        ('select_region',
+         lambda at: at.multiselect(key='region_input_ds').set_value(
+             [benchmark_region])),
+        ('select_teams', pick_teams),
+        ('select_years', pick_years),
+        ('violin_feature',
+         lambda at: at.selectbox(key='violin_feature_ds').set_value(
+             'Thrombolysis')),
+        ('scatter_x_feature',
+         lambda at: at.selectbox(key='scatter_x_feature_ds').set_value(
+             'Average age')),
+        ('scatter_colour',
+         lambda at: at.selectbox(key='scatter_colour_feature_ds').set_value(
+             'Death')),
+        ('scatter_year',
+         lambda at: at.selectbox(key='scatter_year_ds').set_value(
+             benchmark_year)),
+        ('toggle_all',
+         lambda at: at.toggle(key='arrive_in_4hr_ds').set_value(False)),
+        ]
+
+
+def check_page_teams(at, n_region_teams):
+    """
+    Check that the page is showing the scaled-up teams.
+
+    Inputs:
+    -------
+    at             - AppTest. The page after picking benchmark_region.
+    n_region_teams - int. Number of teams in benchmark_region in the
+                     scaled-up data.
+    """
+    # The options are the teams in the region and the "all teams" and
+    # "all of this region" groups:
+    n_options = len(at.multiselect(key='team_input_ds').options)
+    if n_options != n_region_teams + 2:
+        raise RuntimeError(
+            f'The page has {n_options - 2} teams in {benchmark_region} ' +
+            f'but the scaled-up data has {n_region_teams}.'
+            )
+
+
+def benchmark_app(page_path, data_dir, n_region_teams, n_highlighted,
+                  repeats):
+    """
+    Time each rerun of the demo page through the interaction script.
+
+    The first pass fills the caches, so the first time in each list
+    includes loading the data.
+
+    Inputs:
+    -------
+    page_path      - str. Absolute path to the demo page.
+    data_dir       - str. The data_descriptive folder for the page.
+    n_region_teams - int. Number of teams in benchmark_region in the
+                     data, to check that the page uses that data.
+    n_highlighted  - int. Number of teams to pick.
+    repeats        - int. Number of passes through the script.
+
+    Returns:
+    --------
+    results - dict. Keys are interaction names and values are the
+              summaries from summarise_times().
+    """
+    from streamlit.testing.v1 import AppTest
+
+    interactions = app_interactions(n_highlighted)
+    times = {'first_run': []}
+    times.update({name: [] for name, _ in interactions})
+
+    # Point the page at the scaled-up data:
+    old_data_dir = os.environ.get(data_dir_env_var)
+    os.environ[data_dir_env_var] = data_dir
+    try:
+        for _ in range(repeats):
+            at = AppTest.from_file(page_path, default_timeout=600)
+            start = time.perf_counter()
+            at.run()
+            times['first_run'].append(time.perf_counter() - start)
+            for name, interaction in interactions:
+                interaction(at)
+                start = time.perf_counter()
+                at.run()
+                times[name].append(time.perf_counter() - start)
+                if len(at.exception) > 0:
+                    raise RuntimeError(
+                        f'The page failed after "{name}": ' +
+                        at.exception[0].message
+                        )
+                if name == 'select_region':
+                    check_page_teams(at, n_region_teams)
+    finally:
+        if old_data_dir is None:
+            del os.environ[data_dir_env_var]
+        else:
+            os.environ[data_dir_env_var] = old_data_dir
+    return {name: summarise_times(t) for name, t in times.items()}
+
+
+# ###################
+# ##### RESULTS #####
+# ###################
+
+def get_environment():
+    """
+    Details of the code and packages the results are for.
+
+    Returns:
+    --------
+    environment - dict. Git commit, Python and package versions.
+    """
+    import plotly
+    import streamlit
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+        'plotly': plotly.__version__,
+        'streamlit': streamlit.__version__,
+        }
+
+
+def compare_results(old, new, threshold=1.2):
+    """
+    Print the change in each median timing between two results.
+
+    Inputs:
+    -------
+    old       - dict. Earlier results from run_benchmarks().
+    new       - dict. Later results from run_benchmarks().
+    threshold - float. Flag timings that are this many times slower.
+
+    Returns:
+    --------
+    slower - list. Names of the timings that got slower by more than
+             the threshold.
+    """
+    slower = []
+    for scale, new_scale in new['scales'].items():
+        old_scale = old['scales'].get(scale, {})
+        for group in ['app', 'functions']:
+            for name, new_times in new_scale.get(group, {}).items():
+                old_times = old_scale.get(group, {}).get(name)
+                if old_times is None:
+                    continue
+                ratio = new_times['median'] / old_times['median']
+                label = f'{scale}x {group} {name}'
+                flag = ''
+                if ratio > threshold:
+                    flag = '  <-- slower'
+                    slower.append(label)
+                print(
+                    f'{label:<45} {old_times["median"]:9.4f}s ' +
+                    f'-> {new_times["median"]:9.4f}s ({ratio:.2f}x){flag}'
+                    )
+    return slower
+
+
+def run_benchmarks(
+        repo_dir,
+        scales=default_scales,
+        repeats=default_repeats,
+        n_highlighted=default_highlighted,
+        run_app=True
+        ):
+    """
+    Run the function and page benchmarks at each scale.
+
+    Inputs:
+    -------
+    repo_dir      - str. Top of the repository.
+    scales        - list. Numbers of copies of the teams to time.
+    repeats       - int. Number of times to repeat each timing.
+    n_highlighted - int. Number of teams to highlight.
+    run_app       - bool. Whether to run the page benchmarks.
+
+    Returns:
+    --------
+    results - dict. 'environment' from get_environment() and 'scales'
+              with the timings for each scale.
+    """
+    data_dir = os.path.join(repo_dir, 'data_descriptive')
+    table = read_stats_dataset(os.path.join(data_dir, stats_dataset_dir))
+    df_stroke_team = pd.read_csv(
+        os.path.join(data_dir, locations_file), index_col=False)
+
+    results = {'environment': get_environment(), 'scales': {}}
+    for scale in scales:
+        table_scaled = scale_stats_table(table, scale)
+        df_scaled = scale_stroke_team_locations(df_stroke_team, scale)
+        scale_results = {
+            'teams': len(df_scaled),
+            'functions': benchmark_functions(
+                table_scaled, df_scaled, n_highlighted, repeats)
+            }
+        if run_app:
+            n_region_teams = int(
+                (df_scaled['RGN11NM'] == benchmark_region).sum())
+            with tempfile.TemporaryDirectory() as out_dir:
+                scaled_data_dir = write_scaled_data_dir(
+                    repo_dir, out_dir, table_scaled, df_scaled)
+                scale_results['app'] = benchmark_app(
+                    os.path.join(repo_dir, page_file), scaled_data_dir,
+                    n_region_teams, n_highlighted, repeats
+                    )
+        results['scales'][str(scale)] = scale_results
+        print(f'Finished {scale}x ({len(df_scaled)} teams).')
+    return results
+
+
+def main():
+    """
+    Time the demo page and its functions at several numbers of teams.
+    """
+    import argparse
+
+    import streamlit.config
+    import streamlit.logger
+    # Import the page's modules first so that their loggers exist:
+    import utilities_descriptive.container_plots  # noqa: F401
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--output', default='benchmark_results.json',
+        help='Where to write the results .json file.')
+    parser.add_argument(
+        '--scales', type=int, nargs='+', default=default_scales,
+        help='Numbers of copies of the stroke teams to time.')
+    parser.add_argument(
+        '--repeats', type=int, default=default_repeats,
+        help='Number of times to repeat each timing.')
+    parser.add_argument(
+        '--highlighted', type=int, default=default_highlighted,
+        help='Number of teams to highlight.')
+    parser.add_argument(
+        '--no-app', action='store_true',
+        help='Only time the functions, not the whole page.')
+    parser.add_argument(
+        '--compare',
+        help='Earlier results .json file to compare against.')
+    args = parser.parse_args()
+
+    # Running the plot functions outside of an app makes streamlit
+    # warn on every call, so hide those warnings. (Set the config
+    # option so that streamlit doesn't reset the level later.)
+    streamlit.config.set_option('logger.level', 'error')
+    streamlit.logger.set_log_level('error')
+
+    repo_dir = os.path.abspath('.')
+    # Make sure the page can import the utilities from any folder:
+    if repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+
+    results = run_benchmarks(
+        repo_dir, args.scales, args.repeats, args.highlighted,
+        run_app=not args.no_app
+        )
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}.')
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        compare_results(old, results)
+
+
+if __name__ == '__main__':
+    main()
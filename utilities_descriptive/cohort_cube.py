@@ -0,0 +1,431 @@
+"""
+Descriptive stats for any combination of patient filters.
+
+summary_stats.csv and summary_stats_4hr.csv hold the stats for two
+fixed groups of patients. The cohort cube holds the accumulators
+from aggregation.py for every stroke team, year and "cohort cell"
+instead. A cell is one combination of the True/False fields in
+cohort_dimensions (e.g. arrived within 4hr, infarction) and an age
+band. Picking a set of cells and adding up their accumulators gives
+the stats for any filter on those fields without the patient data:
+
++ means from the sums and counts of non-missing values,
++ medians from the exact histograms.
+
+The pipeline writes the cube to data_descriptive/cohort_cube.npz
+next to the stats files. The app loads it once into a CohortCube
+and turns each filter picked by the user into a StatsCube.
+
+The cube is kept sparse: there's only one row for each team, year
+and cell (and value, for the histograms) that has any patients.
+The rows are sorted so that adding up the selected cells only needs
+running sums over neighbouring rows rather than a full groupby.
+
+The cube holds exact patient counts for small groups of patients,
+e.g. one team, year, age band and type of stroke. Check that these
+are fine to share before publishing the file with the app. The app
+still works without it, but then only has the 4hr toggle.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from utilities_descriptive.aggregation import \
+    get_cell_dimensions, get_group_order, mean_fields, median_fields, \
+    min_team_count, sum_fields, summary_stats_dict
+from utilities_descriptive.fixed_params import \
+    age_band_labels, cohort_dimensions, get_all_years_str
+from utilities_descriptive.stats_cube import StatsCube
+
+
+# Fields in the totals arrays, in order:
+total_fields = mean_fields + sum_fields
+# Metrics in the StatsCube, in the same order as the stats files:
+metrics = [k for k, v in summary_stats_dict.items() if v != 'none']
+
+
+def write_cohort_cube(cube_stats, df_stroke_team, stroke_teams, path):
+    """
+    Save the accumulators for the app.
+
+    Inputs:
+    -------
+    cube_stats     - dict. Output of accumulate_cohort_cube() for
+                     every year.
+    df_stroke_team - pd.DataFrame. Team locations with columns
+                     'Stroke Team' and 'RGN11NM' (region name).
+                     Only patients at these teams are included.
+    stroke_teams   - list. Teams to give their own results.
+    path           - str. Path to the .npz file to write.
+    """
+    teams = np.array(df_stroke_team['Stroke Team'], dtype=str)
+    team_codes = {t: i for i, t in enumerate(teams)}
+    years = np.array(sorted(set(
+        cube_stats['totals'].index.get_level_values(1))), dtype=int)
+    year_codes = {y: i for i, y in enumerate(years)}
+
+    def get_codes(index):
+        # Teams that aren't in the locations file are left out:
+        team = index.get_level_values(0).map(team_codes)
+        keep = ~pd.isna(team)
+        codes = {
+            'team': team[keep].astype(np.int32).to_numpy(),
+            'year': index.get_level_values(1)[keep].map(
+                year_codes).to_numpy().astype(np.int16),
+            'cell': index.get_level_values(2)[keep].to_numpy().astype(
+                np.int16)
+            }
+        return codes, np.asarray(keep)
+
+    arrays = {
+        'teams': teams,
+        'team_regions': np.array(df_stroke_team['RGN11NM'], dtype=str),
+        'stroke_teams': np.array(stroke_teams, dtype=str),
+        'years': years
+        }
+
+    totals = cube_stats['totals']
+    codes, keep = get_codes(totals.index)
+    # Sort the rows by team, year and cell:
+    order = np.lexsort((codes['cell'], codes['year'], codes['team']))
+    for name, values in codes.items():
+        arrays[f'totals_{name}'] = values[order]
+    arrays['totals_sum'] = np.stack(
+        [totals[('sum', f)].to_numpy(dtype=float)[keep][order]
+         for f in total_fields], axis=1)
+    arrays['totals_n'] = np.stack(
+        [totals[('n', f)].to_numpy(dtype=float)[keep][order]
+         for f in mean_fields], axis=1)
+
+    for field in median_fields:
+        hist = cube_stats['histograms'][field]
+        codes, keep = get_codes(hist.index)
+        values = hist.index.get_level_values(3).to_numpy(dtype=float)[keep]
+        # Store each value as its position in the sorted list:
+        value_list, value_codes = np.unique(values, return_inverse=True)
+        # Sort the rows by team, year, value and cell:
+        order = np.lexsort(
+            (codes['cell'], value_codes, codes['year'], codes['team']))
+        for name, values in codes.items():
+            arrays[f'{field}_{name}'] = values[order]
+        arrays[f'{field}_value'] = value_codes[order].astype(np.int32)
+        arrays[f'{field}_values'] = value_list
+        arrays[f'{field}_patients'] = hist.to_numpy()[keep][order]
+
+    # Write to a temporary file first so that the app never reads a
+    # half-written cube:
+    temp_path = path + '.tmp.npz'
+    np.savez_compressed(temp_path, **arrays)
+    os.replace(temp_path, path)
+
+
+def segment_medians(segments, values, patients, n_segments):
+    """
+    Find the median of each segment of a sorted histogram.
+
+    This matches median_from_histogram() in aggregation.py.
+
+    Inputs:
+    -------
+    segments   - np.ndarray. Segment number of each row, sorted, with
+                 the values sorted within each segment.
+    values     - np.ndarray. Value of each row.
+    patients   - np.ndarray. Number of patients with each value.
+    n_segments - int. Number of segments.
+
+    Returns:
+    --------
+    medians - np.ndarray. One median per segment, NaN for segments
+              with no patients.
+    """
+    cumulative = np.cumsum(patients)
+    total = np.bincount(
+        segments, weights=patients, minlength=n_segments).astype(np.int64)
+    start = np.cumsum(total) - total
+    medians = np.full(n_segments, np.NaN)
+    has_data = total > 0
+    if not np.any(has_data):
+        return medians
+
+    # The k-th value (counting from zero) is the first value whose
+    # cumulative count is more than k.
+    def value_at(k):
+        rows = np.searchsorted(cumulative, start + k, side='right')
+        return values[np.minimum(rows, len(values) - 1)]
+
+    lower = value_at((total - 1) // 2)
+    upper = value_at(total // 2)
+    medians[has_data] = ((lower + upper) / 2)[has_data]
+    return medians
+
+
+def sum_runs(keys, weights):
+    """
+    Add up the weights of neighbouring rows with the same key.
+
+    Inputs:
+    -------
+    keys    - np.ndarray. Sorted keys, one per row.
+    weights - np.ndarray. 1D or 2D with one row per key.
+
+    Returns:
+    --------
+    keys    - np.ndarray. Each key once.
+    weights - np.ndarray. Summed weights for each key.
+    """
+    if len(keys) == 0:
+        return keys, weights
+    starts = np.flatnonzero(
+        np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.add.reduceat(weights, starts, axis=0)
+
+
+class CohortCube:
+    """
+    Accumulators for every team, year and cohort cell.
+
+    Attributes:
+    -----------
+    teams        - np.ndarray. Every team in the locations file.
+    years        - np.ndarray. Years in the data (int).
+    groups       - list. National group, then regions, then the
+                   teams that get their own results.
+    year_labels  - list. "All years" label then each year (str).
+    cell_dimensions - dict. Output of get_cell_dimensions() for
+                   every possible cell number.
+    exists       - np.ndarray. Bool (groups, year_labels). True for
+                   the groups and years that are in the stats files.
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.teams = arrays['teams']
+        self.years = arrays['years']
+        team_regions = arrays['team_regions']
+        regions = sorted(set(team_regions))
+
+        n_cells = 2 ** len(cohort_dimensions) * len(age_band_labels)
+        self.cell_dimensions = get_cell_dimensions(np.arange(n_cells))
+
+        # The national group, regions and teams with their own stats:
+        self.groups = get_group_order(
+            pd.DataFrame({'RGN11NM': team_regions}),
+            list(arrays['stroke_teams'])
+            )
+        self.year_labels = (
+            [get_all_years_str(self.years)] +
+            [str(y) for y in self.years])
+
+        # Which group each team adds to. Every team adds to the
+        # national group (0) and its region:
+        region_codes = {r: i + 1 for i, r in enumerate(regions)}
+        self.n_area_groups = 1 + len(regions)
+        self.team_area_group = np.array(
+            [region_codes[r] for r in team_regions], dtype=np.int64)
+        # Position of each team in the groups list, -1 for none:
+        group_codes = {g: i for i, g in enumerate(self.groups)}
+        self.team_own_group = np.array(
+            [group_codes.get(t, -1) for t in self.teams], dtype=np.int64)
+
+        # Keep the same groups and years as the stats files, which
+        # only include those with enough patients in the full data:
+        counts = self._sum_totals(np.ones(n_cells, dtype=bool))[
+            :, :, total_fields.index('count')]
+        self.exists = counts > min_team_count
+
+    def _sum_totals(self, cells_selected):
+        """
+        Add up the totals in the selected cells for every group.
+
+        Returns an array with shape (groups, year_labels, fields).
+        """
+        a = self.arrays
+        n_teams = len(self.teams)
+        n_years = len(self.years)
+        keep = cells_selected[a['totals_cell']]
+        # The rows are sorted by team and year so the cells for each
+        # team and year are next to each other:
+        keys, weights = sum_runs(
+            (a['totals_team'][keep].astype(np.int64) * n_years +
+             a['totals_year'][keep]),
+            np.concatenate(
+                [a['totals_sum'][keep], a['totals_n'][keep]], axis=1)
+            )
+        team_totals = np.zeros((n_teams * n_years, weights.shape[1]))
+        team_totals[keys] = weights
+        team_totals = team_totals.reshape(n_teams, n_years, -1)
+
+        group_totals = np.zeros(
+            (len(self.groups), n_years + 1, team_totals.shape[2]))
+        # National and regional groups:
+        area_totals = np.zeros((self.n_area_groups,) + team_totals.shape[1:])
+        np.add.at(area_totals, self.team_area_group, team_totals)
+        area_totals[0] = team_totals.sum(axis=0)
+        group_totals[:self.n_area_groups, 1:] = area_totals
+        # Teams with their own results:
+        own = self.team_own_group >= 0
+        group_totals[self.team_own_group[own], 1:] = team_totals[own]
+        # All years:
+        group_totals[:, 0] = group_totals[:, 1:].sum(axis=1)
+        return group_totals
+
+    def _medians(self, field, cells_selected):
+        """
+        Find the medians in the selected cells for every group.
+
+        Returns an array with shape (groups, year_labels).
+        """
+        a = self.arrays
+        n_years = len(self.years)
+        n_year_labels = n_years + 1
+        values = a[f'{field}_values']
+        n_values = len(values)
+        keep = cells_selected[a[f'{field}_cell']]
+        team = a[f'{field}_team'][keep].astype(np.int64)
+        year = a[f'{field}_year'][keep].astype(np.int64)
+        value = a[f'{field}_value'][keep].astype(np.int64)
+        patients = a[f'{field}_patients'][keep]
+
+        # Team, year and value, adding up the cells:
+        keys, patients = sum_runs(
+            (team * n_years + year) * n_values + value, patients)
+        team_year, value = np.divmod(keys, n_values)
+        team, year = np.divmod(team_year, n_years)
+
+        # One median per group and year label, flattened:
+        medians = np.full(len(self.groups) * n_year_labels, np.NaN)
+
+        # National and regional groups. There are only a few of these
+        # so one dense histogram each is small enough:
+        n_area_bins = self.n_area_groups * n_year_labels * n_values
+        area_hist = np.zeros(n_area_bins)
+        for area_group in [np.zeros_like(team), self.team_area_group[team]]:
+            for year_label in [np.zeros_like(year), year + 1]:
+                area_hist += np.bincount(
+                    (area_group * n_year_labels + year_label) * n_values +
+                    value,
+                    weights=patients, minlength=n_area_bins
+                    )
+        present = np.flatnonzero(area_hist)
+        _fill_medians(
+            medians, present // n_values, values[present % n_values],
+            area_hist[present]
+            )
+
+        # Teams with their own results, one year at a time:
+        own_group = self.team_own_group[team]
+        own = own_group >= 0
+        _fill_medians(
+            medians, own_group[own] * n_year_labels + year[own] + 1,
+            values[value[own]], patients[own]
+            )
+
+        # And for all years, re-sorting by team and then value:
+        keys, patients_all = sum_runs(
+            *_sort_by(team[own] * n_values + value[own], patients[own]))
+        team_all, value_all = np.divmod(keys, n_values)
+        _fill_medians(
+            medians, self.team_own_group[team_all] * n_year_labels,
+            values[value_all], patients_all
+            )
+        return medians.reshape(len(self.groups), n_year_labels)
+
+    def stats_cube(self, cohort_filter, cohort):
+        """
+        Work out the stats for one filter.
+
+        Inputs:
+        -------
+        cohort_filter - dict. See get_cohort_label() in
+                        fixed_params.py.
+        cohort        - str. Name for the cohort in the StatsCube.
+
+        Returns:
+        --------
+        stats_cube - StatsCube. The stats with one cohort. The teams
+                     and years are the same as in the stats files,
+                     but a team and year with no patients left after
+                     filtering is marked as missing.
+        """
+        cells_selected = np.ones(len(self.cell_dimensions['age_band']),
+                                 dtype=bool)
+        for field in cohort_dimensions:
+            if cohort_filter.get(field, False):
+                cells_selected &= self.cell_dimensions[field]
+        age_bands = [age_band_labels.index(b) for b in
+                     cohort_filter.get('age_bands', age_band_labels)]
+        cells_selected &= np.isin(self.cell_dimensions['age_band'],
+                                  age_bands)
+
+        totals = self._sum_totals(cells_selected)
+        sums = totals[:, :, :len(total_fields)]
+        ns = totals[:, :, len(total_fields):]
+        values = np.full(
+            (len(self.groups), len(self.year_labels), len(metrics)),
+            np.NaN
+            )
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for m, metric in enumerate(metrics):
+                how = summary_stats_dict[metric]
+                if how == 'mean':
+                    f = mean_fields.index(metric)
+                    values[:, :, m] = sums[:, :, total_fields.index(metric)
+                                           ] / ns[:, :, f]
+                elif how == 'median':
+                    values[:, :, m] = self._medians(metric, cells_selected)
+                elif how == 'sum':
+                    values[:, :, m] = sums[:, :, total_fields.index(metric)]
+        # Round in the same way as the stats files:
+        values = np.round(values, 3)
+
+        # Only keep the groups and years that are in the stats files:
+        team_rows = np.flatnonzero(self.exists.any(axis=1))
+        year_cols = np.flatnonzero(self.exists.any(axis=0))
+        values = values[team_rows][:, year_cols]
+        # ... and of those, only the ones with patients in this filter:
+        counts = sums[:, :, total_fields.index('count')]
+        exists = (self.exists & (counts > 0))[team_rows][:, year_cols]
+        values[~exists] = np.NaN
+        return StatsCube(
+            values[:, :, :, np.newaxis],
+            exists[:, :, np.newaxis],
+            [self.groups[i] for i in team_rows],
+            [self.year_labels[i] for i in year_cols],
+            metrics,
+            [cohort]
+            )
+
+
+def _sort_by(keys, weights):
+    order = np.argsort(keys, kind='stable')
+    return keys[order], weights[order]
+
+
+def _fill_medians(medians, segments, values, patients):
+    # Fill in the medians for the given segments of a flat array.
+    # The values must be sorted within each segment. The segments are
+    # sorted here, keeping the order of the values.
+    if len(segments) == 0:
+        return
+    segments, order = _sort_by(segments, np.arange(len(segments)))
+    found = segment_medians(
+        segments, values[order], patients[order], len(medians))
+    has_data = np.bincount(segments, minlength=len(medians)) > 0
+    medians[has_data] = found[has_data]
+
+
+def read_cohort_cube(path):
+    """
+    Load the cohort cube written by write_cohort_cube().
+
+    Inputs:
+    -------
+    path - str. Path to the .npz file.
+
+    Returns:
+    --------
+    cohort_cube - CohortCube.
+    """
+    with np.load(path) as f:
+        arrays = {name: f[name] for name in f.files}
+    return CohortCube(arrays)
@@ -0,0 +1,154 @@
+"""
+Confidence intervals for the descriptive stats.
+
+The intervals are worked out from the same accumulators as the stats
+in aggregation.py, so there's no need to go back to the patient data
+and every group is done at once with array maths:
+
++ proportions (means of True/False features) use the Wilson score
+  interval from the number of patients and the number of Trues.
++ other means use the Student t interval from the sum, the sum of
+  squares and the number of non-missing values.
++ medians use the percentile bootstrap interval, found exactly from
+  the histograms instead of by resampling. When n patients are drawn
+  with replacement from a histogram, the k-th smallest value drawn
+  is the k-th smallest of n uniform random numbers put through the
+  inverse of the histogram's cumulative distribution. The k-th
+  smallest of n uniform random numbers follows a Beta(k, n + 1 - k)
+  distribution, so the bootstrap percentiles of the median are the
+  Beta percentiles put through the same inverse. This gives the
+  interval that resampling would give with infinitely many resamples,
+  and the same numbers every time it's run.
+
+scipy.special is imported inside the functions that use it because
+the app imports this module for interval_names() and shouldn't have
+to wait for scipy.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Coverage of the intervals:
+confidence_level = 0.95
+
+
+def interval_names(field):
+    """
+    Names of the lower and upper limits of a feature's interval.
+
+    Inputs:
+    -------
+    field - str. Feature name, e.g. 'age'.
+
+    Returns:
+    --------
+    names - tuple. (lower name, upper name), e.g.
+            ('age_lower', 'age_upper').
+    """
+    return f'{field}_lower', f'{field}_upper'
+
+
+def wilson_interval(successes, n, level=confidence_level):
+    """
+    Wilson score interval for proportions.
+
+    Inputs:
+    -------
+    successes - np.ndarray. Number of True values in each group.
+    n         - np.ndarray. Number of non-missing values in each group.
+    level     - float. Coverage of the interval.
+
+    Returns:
+    --------
+    lower, upper - np.ndarray. Limits for each group. NaN for groups
+                   with no values.
+    """
+    from scipy.special import ndtri
+
+    successes = np.asarray(successes, dtype=float)
+    n = np.asarray(n, dtype=float)
+    z = ndtri(0.5 + level / 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = successes / n
+        denominator = 1 + z**2 / n
+        centre = (p + z**2 / (2 * n)) / denominator
+        half_width = z * np.sqrt(
+            p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return centre - half_width, centre + half_width
+
+
+def mean_interval(total, total_of_squares, n, level=confidence_level):
+    """
+    Student t interval for means.
+
+    Inputs:
+    -------
+    total            - np.ndarray. Sum of the values in each group.
+    total_of_squares - np.ndarray. Sum of the squared values.
+    n                - np.ndarray. Number of non-missing values.
+    level            - float. Coverage of the interval.
+
+    Returns:
+    --------
+    lower, upper - np.ndarray. Limits for each group. NaN for groups
+                   with fewer than two values.
+    """
+    from scipy.special import stdtrit
+
+    total = np.asarray(total, dtype=float)
+    total_of_squares = np.asarray(total_of_squares, dtype=float)
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        # Rounding can leave a tiny negative variance when every
+        # value is the same:
+        variance = np.maximum(
+            (total_of_squares - total * mean) / (n - 1), 0.0)
+        variance[n < 2] = np.NaN
+        t = stdtrit(np.maximum(n - 1, 1), 0.5 + level / 2)
+        half_width = t * np.sqrt(variance / n)
+    return mean - half_width, mean + half_width
+
+
+def median_interval_from_histogram(hist, level=confidence_level):
+    """
+    Exact percentile bootstrap interval for medians from histograms.
+
+    For an even number of values the median is halfway between the
+    two middle values. The lower limit then comes from the lower of
+    the two and the upper limit from the upper one, so the interval
+    is a little wider than resampling would give.
+
+    Inputs:
+    -------
+    hist  - pd.Series. Counts indexed by (group levels..., value),
+            sorted so that values increase within each group.
+    level - float. Coverage of the interval.
+
+    Returns:
+    --------
+    lower, upper - pd.Series. Limits for each group.
+    """
+    from scipy.special import betaincinv
+
+    hist = hist[hist > 0]
+    levels = list(range(hist.index.nlevels - 1))
+    values = hist.index.get_level_values(-1).to_numpy(dtype=float)
+    groups = hist.index.droplevel(-1)
+    grouped = hist.groupby(level=levels, sort=False)
+    cumulative = grouped.cumsum().to_numpy()
+    total = grouped.transform('sum').to_numpy()
+
+    # The value in the bootstrap samples at percentile q of the k-th
+    # smallest value (counting from one) is the first value whose
+    # cumulative share of patients reaches that Beta percentile.
+    def value_at(k, q):
+        share = betaincinv(k, total + 1 - k, q)
+        mask = cumulative >= share * total
+        return pd.Series(values[mask], index=groups[mask]).groupby(
+            level=levels, sort=True).first()
+
+    alpha = (1 - level) / 2
+    lower = value_at((total + 1) // 2, alpha)
+    upper = value_at(total // 2 + 1, 1 - alpha)
+    return lower, upper
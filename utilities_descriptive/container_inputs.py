@@ -5,49 +5,44 @@ All of the content for the Inputs section.
 import streamlit as st
 import numpy as np
 
+from utilities_descriptive.fixed_params import age_band_labels
 
-def inputs_region_choice(df_stroke_team, existing_regions=[]):
+
+def inputs_region_choice(team_index, existing_regions=[]):
     """
     Take user inputs for which regions to consider.
 
-    The function finds all of the available regions in the main stats
-    dataframe. Each region is given a checkbox so that the user can
-    select it independently of the others. All of the selections are
-    returned in one list.
+    The function finds all of the available regions in the team
+    lookups. All of the regions are options in one multiselect box
+    and all of the selections are returned in one list.
 
     Inputs:
     -------
-    df_stroke_team - pd.DataFrame. The descriptive statistics dataframe
-                     that contains a column 'RGN11NM' of region names.
-                     This name is from the Office for National
-                     Statistics field: REGION / 2011 / NAME.
-    containers     - list. A list of containers to place the multiple
-                     select boxes into. If there are fewer containers
-                     in the list than there are select boxes to draw,
-                     then subsequent boxes are drawn starting from the
-                     beginning of the list again.
+    team_index       - TeamIndex. Lookups for the stroke teams. The
+                       region names are from the Office for National
+                       Statistics field: REGION / 2011 / NAME.
+    existing_regions - list. Regions to select by default.
 
     Returns:
     --------
     regions_selected - list. Contains one string per region selected
                        by the user.
     """
-    # List of regions in the dataframe:
-    region_list = sorted(list(set(
-        df_stroke_team['RGN11NM'].squeeze().values
-        )))
+    # List of regions (already sorted):
+    region_list = team_index.regions
 
     regions_selected = st.multiselect(
         'Select region(s):',
         options=region_list,
-        default=existing_regions
+        default=existing_regions,
+        key='region_input_ds'
     )
 
     return regions_selected
 
 
 def input_stroke_teams_to_highlight(
-        df_stroke_team,
+        team_index,
         regions_selected,
         all_teams_str,
         years_selected,
@@ -63,9 +58,7 @@ def input_stroke_teams_to_highlight(
 
     Inputs:
     -------
-    df_stroke_team   - pd.DataFrame. The hospital locations data.
-                       Must contain columns for 'Stroke Team' and
-                       'RGN11NM' (region name).
+    team_index       - TeamIndex. Lookups for the stroke teams.
     regions_selected - list. Names of regions selected by the user.
     all_teams_str    - str. Name of the "all teams" group in the
                        descriptive stats dataframe.
@@ -81,13 +74,9 @@ def input_stroke_teams_to_highlight(
                                 year combination selected by the user.
                                 e.g. "All E+W (2016)".
     """
-    # Create the list of stroke teams in the selected regions.
-    # Pull out any row of the dataframe that contains any of the
-    # selected region names in any of its columns.
-    stroke_team_list = (
-        df_stroke_team['Stroke Team'][
-            df_stroke_team.isin(regions_selected).any(axis=1)]
-    )
+    # Create the list of stroke teams in the selected regions
+    # (in alphabetical order like the team locations data):
+    stroke_team_list = team_index.teams_in_regions(regions_selected)
     # Add on the "all of this region" teams:
     for region in regions_selected:
         stroke_team_list = np.append(f'All {region}', stroke_team_list)
@@ -127,3 +116,79 @@ def input_stroke_teams_to_highlight(
         all_stroke_teams_selected_without_year,
         stroke_teams_selected
     )
+
+
+def input_cohort_filters():
+    """
+    Take user inputs for which patients to include in the stats.
+
+    These are only used when the cohort cube exists. Otherwise the
+    page only shows the 4hr toggle.
+
+    Returns:
+    --------
+    cohort_filter - dict. Keys are the fields in cohort_dimensions
+                    with True to keep only patients where the field is
+                    True, and 'age_bands' with a list of age band
+                    labels to keep.
+    """
+    cols_toggles = st.columns(2)
+    with cols_toggles[0]:
+        arrive_in_4_hours = st.toggle(
+            'Limit to arrival within 4hr', key='arrive_in_4hr_ds')
+        onset_known = st.toggle('Limit to known onset time')
+    with cols_toggles[1]:
+        precise_onset_known = st.toggle('Limit to precise onset time')
+        infarction = st.toggle('Limit to infarction')
+    age_bands = st.multiselect(
+        'Limit to age band(s):',
+        options=age_band_labels,
+        default=age_band_labels
+        )
+    if len(age_bands) == 0:
+        # Don't filter out every patient:
+        age_bands = age_band_labels
+
+    return {
+        'arrive_in_4_hours': arrive_in_4_hours,
+        'onset_known': onset_known,
+        'precise_onset_known': precise_onset_known,
+        'infarction': infarction,
+        'age_bands': age_bands
+        }
+
+
+def input_map_shading(metric_display_names, year_options):
+    """
+    Take user inputs for shading the map by one feature.
+
+    Inputs:
+    -------
+    metric_display_names - dict. Feature names and the names to show
+                           for them.
+    year_options         - list. Year labels, starting with all years
+                           combined.
+
+    Returns:
+    --------
+    feature         - str or None. Name of the feature to shade by,
+                      or None for no shading.
+    feature_display - str. Name to show for the feature.
+    year            - str. Year label to shade with.
+    """
+    inverse_names = dict(zip(
+        metric_display_names.values(), metric_display_names.keys()))
+    cols = st.columns(2)
+    with cols[0]:
+        feature_display = st.selectbox(
+            'Shade the map by',
+            options=['None'] + list(metric_display_names.values())
+            )
+    with cols[1]:
+        year = st.selectbox(
+            'Year to shade with',
+            options=year_options,
+            disabled=(feature_display == 'None')
+            )
+    feature = inverse_names.get(feature_display)
+    return feature, feature_display, year
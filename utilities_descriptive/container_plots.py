@@ -1,14 +1,16 @@
 """
 Plots for the descriptive stats demo.
+
+plotly is only imported inside the functions that make figures, so
+importing this module is quick and a new copy of the app doesn't
+wait for plotly before it can start drawing the page.
 """
+import collections
+import functools
+import os
+
 import streamlit as st
-import plotly.graph_objs as go
-import geojson
 import numpy as np
-import pandas as pd
-from scipy.stats import linregress
-# For clickable plotly events:
-# from streamlit_plotly_events import plotly_events
 
 # Add an extra bit to the path if we need to.
 # Try importing something as though we're running this from the same
@@ -24,87 +26,93 @@ except ModuleNotFoundError:
     sys.path.append('./streamlit_descriptive_stats/')
     # The following should work now:
     from utilities_descriptive.fixed_params import page_setup
-try:
-    test_file = pd.read_csv(
-        './data_descriptive/stroke_teams.csv',
-        index_col='stroke_team'
-        )
-    dir = './'
-except FileNotFoundError:
-    # If the import fails, add the landing page directory to path.
-    # Assume that the script is being run from the directory above
-    # the landing page directory, which is called
-    # stroke_outcome_app.
-    dir = 'streamlit_descriptive_stats/'
-
-
-def plot_geography_pins(
-        df_stroke_team,
-        stroke_teams_selected,
-        team_colours_dict
-        ):
+from utilities_descriptive.confidence_intervals import interval_names
+from utilities_descriptive.data_loading import load_region_map
+from utilities_descriptive.fixed_params import app_dir
+from utilities_descriptive.plot_utils import add_legend_proxies
+from utilities_descriptive.geography import region_static_file
+
+
+# Key of the map in the session state. Its value is the last
+# selection made on the map:
+map_selection_key = 'map_selection_ds'
+
+# Result of fit_line(), with the same names as from linregress():
+LineFit = collections.namedtuple('LineFit', ['slope', 'intercept'])
+
+# Values to shade the map with, from get_map_shading():
+MapShading = collections.namedtuple(
+    'MapShading', ['title', 'regions', 'region_values', 'team_values'])
+
+# Address of the region outlines when streamlit serves the static
+# folder. It's relative, so it still works when the app isn't at the
+# top of its website:
+region_geojson_url = f'app/static/{region_static_file}'
+
+# Colours for the map shading:
+map_colour_scale = 'Blues'
+
+# Plotly options for each plot.
+# Remove some buttons from the mode bar (top corner on hover):
+map_config = {
+    'modeBarButtonsToRemove': ['lasso2d', 'select2d'],
+}
+violin_config = {
+    'modeBarButtonsToRemove': ['lasso2d', 'select2d'],
+}
+scatter_config = {
+    'displayModeBar': False
+    # 'modeBarButtonsToRemove': ['lasso2d', 'select2d'],
+}
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def create_base_map(df_stroke_team, region_map_path, geojson_url=None):
     """
-    Plot a map of England and Wales with the stroke teams marked.
+    Create the parts of the map that are the same for every user.
 
-    This draws a shape for each region from a geojson that was created
-    by combining all super-generalised LSOA shapes in each region.
-    The markers are drawn using latitude and longitude coordinates that
-    were generated from the stroke teams' postcodes. Most teams get a
-    generic marker, but teams in the input list get their own colour.
+    This is the region outlines and a marker for every stroke team.
+    The figure is cached and shared between sessions, so copy it
+    before adding anything to it.
 
     Inputs:
     -------
-    df_stroke_team        - pd.DataFrame. Dataframe of team locations.
-                            Must contain columns 'lat', 'long', and
-                            'Stroke Team' for marker positions/labels.
-    stroke_teams_selected - list. List of stroke teams to highlight.
-    team_colours_dict     - dict. Keys are stroke teams, values are
-                            colours to plot them in.
+    df_stroke_team  - pd.DataFrame. Dataframe of team locations.
+                      Must contain columns 'lat', 'long', and
+                      'Stroke Team' for marker positions/labels.
+    region_map_path - str. Path to the simplified region outlines
+                      in the static folder, made by geography.py.
+    geojson_url     - str or None. Address that the browser can
+                      download the outlines from. If this is None,
+                      the outlines are put in the figure itself.
+
+    Returns:
+    --------
+    fig - go.Figure. The base map.
     """
-    # Import geojson data:
-    geojson_file = 'regions_EW.geojson'
-    with open(dir + './data_descriptive/region_geojson/' + geojson_file) as f:
-        geojson_ew = geojson.load(f)
-
-    # Find extent of this geojson data.
-    # This will be used later to set the plot's axis limits.
-    coords = np.array(list(geojson.utils.coords(geojson_ew)))
-    extent = [
-        coords[:, 0].min(),
-        coords[:, 0].max(),
-        coords[:, 1].min(),
-        coords[:, 1].max()
-    ]
-
-    # Get the names of the regions out of the geojson:
-    region_list = []
-    for feature in geojson_ew['features']:
-        region = feature['properties']['RGN11NM']
-        region_list.append(region)
-
-    # Create a dummy dataframe of region names and some value for colours.
-    df_regions = pd.DataFrame(region_list, columns=['RGN11NM'])
-    df_regions['v'] = [0] * len(df_regions)  # Same value, same colour.
+    import plotly.graph_objs as go
+
+    # Import geojson data (cached after the first read).
+    # The file also contains the extent of the regions, which is used
+    # later to set the plot's axis limits, and the region names.
+    region_map = load_region_map(region_map_path)
+    geojson_ew = region_map['geojson']
+    extent = region_map['extent']
+    region_list = region_map['regions']
 
     # Plot:
     fig = go.Figure()
-    # Sneakily make a slightly taller figure when there are more
-    # highlighted teams selected. This is because the legend gets
-    # taller and will start reducing the size of the map axes
-    # unless more room is provided.
-    fig_height = 500 + 20*len([t for t in stroke_teams_selected
-                             if t[:4] != 'All '])
     fig.update_layout(
         width=500,
-        height=fig_height,
+        height=500,
         margin_l=0, margin_r=0, margin_t=0, margin_b=0
         )
 
     # Add region polygons:
     fig.add_trace(go.Choropleth(
-        geojson=geojson_ew,
-        locations=df_regions['RGN11NM'],
-        z=df_regions['v'],
+        geojson=geojson_ew if geojson_url is None else geojson_url,
+        locations=region_list,
+        z=[0] * len(region_list),  # Same value, same colour.
         featureidkey='properties.RGN11NM',
         colorscale=[
             [0.0, "rgba(0, 0, 0, 0)"],
@@ -116,47 +124,21 @@ def plot_geography_pins(
     # The custom colour scale goes from transparent to transparent.
     # All of the plotted shapes will have no colour.
 
-    # Add scatter markers for all non-selected hospitals:
-    # Pull out any row of the dataframe that contains any of the
-    # selected stroke team names in any of its columns.
-    df_most_teams = (
-        df_stroke_team[
-            ~df_stroke_team.isin(stroke_teams_selected).any(axis=1)]
-    )
+    # Add scatter markers for all hospitals.
+    # Highlighted teams are drawn on top of these later.
     fig.add_trace(go.Scattergeo(
-        lon=df_most_teams['long'],
-        lat=df_most_teams['lat'],
-        customdata=np.stack([df_most_teams['Stroke Team']], axis=-1),
+        lon=df_stroke_team['long'],
+        lat=df_stroke_team['lat'],
+        customdata=np.stack([df_stroke_team['Stroke Team']], axis=-1),
         mode='markers',
         marker_color='Firebrick',
         marker_size=8,
         marker_symbol='cross',
         # showlegend=False
-        name='Stroke teams'
+        name='Stroke teams',
+        hovertemplate='%{customdata[0]}<extra></extra>'
     ))
 
-    # Add scatter markers for the selected hospitals.
-    # Remove any of the "all teams" or "all region" data:
-    stroke_teams_highlighted = [t for t in stroke_teams_selected
-                                if t[:4] != 'All ']
-    for stroke_team in stroke_teams_highlighted:
-        colour = team_colours_dict[stroke_team]
-        df_this_team = (
-            df_stroke_team[df_stroke_team['Stroke Team'] == stroke_team]
-        )
-        fig.add_trace(go.Scattergeo(
-            lon=df_this_team['long'],
-            lat=df_this_team['lat'],
-            customdata=np.stack([df_this_team['Stroke Team']], axis=-1),
-            mode='markers',
-            marker_color=colour,
-            marker_line_color='black',
-            marker_line_width=1.0,
-            marker_size=10,
-            # showlegend=False
-            name=stroke_team
-        ))
-
     # Update geojson projection.
     # Projection options:
     #   august  eckert1  fahey  times  van der grinten
@@ -172,128 +154,388 @@ def plot_geography_pins(
     )
     # fig.update_geos(fitbounds="locations", visible=False)
 
-    # Update hover info for scatter points:
-    fig.update_traces(
-        hovertemplate='%{customdata[0]}<extra></extra>',
-        selector=dict(type='scattergeo')
-    )
     # Move legend:
     fig.update_layout(legend=dict(x=0, y=0, yanchor='top'))
 
     # Add transparent background:
     fig.update_layout(geo=dict(bgcolor='rgba(0,0,0,0)'))
+    return fig
+
+
+def plot_geography_pins(
+        df_stroke_team,
+        team_index,
+        stroke_teams_selected,
+        team_colours_dict,
+        shading=None
+        ):
+    """
+    Plot a map of England and Wales with the stroke teams marked.
+
+    This draws a shape for each region from a geojson that was created
+    by combining all super-generalised LSOA shapes in each region and
+    then simplifying the outlines further (see geography.py).
+    The markers are drawn using latitude and longitude coordinates that
+    were generated from the stroke teams' postcodes. Most teams get a
+    generic marker, but teams in the input list get their own colour.
+
+    The regions and generic markers come from a cached base map,
+    so only the highlighted teams are added on each rerun.
+
+    Clicking a team's marker highlights it, or stops highlighting it
+    if it already was. The click is handled in callback_geography()
+    before the next rerun starts.
 
-    # Remove some buttons from the mode bar (top corner on hover).
-    plotly_config = {
-        'modeBarButtonsToRemove': ['lasso2d', 'select2d'],
-    }
-    st.plotly_chart(fig, config=plotly_config)
-    # Write the plot to streamlit, and store the details of the last
-    # marker that was clicked:
-    # selected_marker = plotly_events(
-    #     fig, click_event=True, #key='waterfall_combo',
-    #     override_height=fig_height, override_width='100%')
-    # callback_geography(
-    #     selected_marker,
-    #     stroke_teams_selected,
-    #     stroke_teams_highlighted,
-    #     df_stroke_team['Stroke Team'].squeeze()
-    #     )
-    # st.caption('Locations of the stroke teams.')
-
-
-def callback_geography(
-        selected_bar,
+    The regions and teams can also be shaded by one feature. When
+    streamlit serves the static folder, the figure only has the
+    address of the region outlines, so the browser downloads them
+    once and each rerun only sends the new values.
+
+    Inputs:
+    -------
+    df_stroke_team        - pd.DataFrame. Dataframe of team locations.
+                            Must contain columns 'lat', 'long', and
+                            'Stroke Team' for marker positions/labels.
+    team_index            - TeamIndex. Lookups for the stroke teams.
+    stroke_teams_selected - list. List of stroke teams to highlight.
+    team_colours_dict     - dict. Keys are stroke teams, values are
+                            colours to plot them in.
+    shading               - MapShading or None. Output of
+                            get_map_shading(), or None for no shading.
+    """
+    base_fig = create_base_map(
+        df_stroke_team,
+        os.path.join(app_dir, 'static', region_static_file),
+        get_region_geojson_url()
+        )
+    fig = create_geography_figure(
+        base_fig,
+        df_stroke_team,
+        team_index,
         stroke_teams_selected,
-        stroke_teams_highlighted,
-        stroke_teams_all
+        team_colours_dict,
+        shading
+        )
+    st.plotly_chart(
+        fig,
+        config=map_config,
+        key=map_selection_key,
+        on_select=functools.partial(callback_geography, team_index),
+        # Only single clicks, no box or lasso selections:
+        selection_mode='points'
+        )
+    st.caption('Click on a stroke team to highlight it or to remove it.')
+
+
+def create_geography_figure(
+        base_fig,
+        df_stroke_team,
+        team_index,
+        stroke_teams_selected,
+        team_colours_dict,
+        shading=None
         ):
     """
-    # When the script is re-run, this value of selected bar doesn't
-    # change. So if the script is re-run for another reason such as
-    # a streamlit input widget being changed, then the selected bar
-    # is remembered and it looks indistinguishable from the user
-    # clicking the bar again. To make sure we only make updates if
-    # the user actually clicked the bar, compare the current returned
-    # bar details with the details of the last bar *before* it was
-    # changed.
-    # When moved to or from the highlighted list, the bar is drawn
-    # as part of a different trace and so its details such as
-    # curveNumber change.
-    # When the user clicks on the same bar twice in a row, we do want
-    # the bar to change. For example, a non-highlighted bar might have
-    # curveNumber=0, then when clicked changes to curveNumber=1.
-    # When clicked again, the last_changed_bar has curveNumber=0,
-    # but selected_bar has curveNumber=1. The bar details have changed
-    # and so the following loop still happens despite x and y being
-    # the same.
+    Add the highlighted stroke teams to a copy of the base map.
+
+    Inputs:
+    -------
+    base_fig              - go.Figure. Output of create_base_map().
+    df_stroke_team        - pd.DataFrame. Dataframe of team locations.
+    team_index            - TeamIndex. Lookups for the stroke teams.
+    stroke_teams_selected - list. List of stroke teams to highlight.
+    team_colours_dict     - dict. Keys are stroke teams, values are
+                            colours to plot them in.
+    shading               - MapShading or None. Output of
+                            get_map_shading(), or None for no shading.
+
+    Returns:
+    --------
+    fig - go.Figure. The map.
     """
-    try:
-        # Pull the details out of the last bar that was changed
-        # (moved to or from the "highlighted" list due to being
-        # clicked on) out of the session state:
-        last_changed_bar = st.session_state['last_changed_marker_ds']
-    except KeyError:
-        # Invent some nonsense. It doesn't matter whether it matches
-        # the default value of selected_bar before anything is clicked.
-        last_changed_bar = [0]
-
-    if selected_bar != last_changed_bar:
-        # If the selected bar doesn't match the last changed bar,
-        # then we need to update the graph and store the latest
-        # clicked bar.
-        try:
-            # If a bar has been clicked, then the following line
-            # will not throw up an IndexError:
-            c = selected_bar[0]['curveNumber']
-            p = selected_bar[0]['pointIndex']
-
-            # List of all non-highlighted teams:
-            stroke_teams_not_highlighted = [
-                t for t in stroke_teams_all
-                if t not in stroke_teams_selected
-                ]
-            if c > 1:
-                # This is a highlighted team.
-                team_selected = stroke_teams_highlighted[c - 2]
-            else:
-                team_selected = stroke_teams_not_highlighted[p]
-
-            # Check if the newly-selected team is already in the list.
-            if team_selected in stroke_teams_selected:
-                # Remove this team from the list.
-                stroke_teams_selected.remove(team_selected)
-            else:
-                # Add the newly-selected team to the list.
-                stroke_teams_selected.append(team_selected)
-            # Add this new list to the session state so that
-            # streamlit can access it immediately on the next re-run.
-            st.session_state['highlighted_teams_with_click_ds'] = \
-                (stroke_teams_selected)
-
-            # Keep a copy of the bar that we've just changed,
-            # and put it in the session state so that we can still
-            # access it once the script is re-run:
-            st.session_state['last_changed_marker_ds'] = selected_bar.copy()
-
-            # Re-run the script to get immediate feedback in the
-            # multiselect input widget and the graph colours:
-            st.rerun()
-
-        except IndexError:
-            # Nothing has been clicked yet, so don't change anything.
-            pass
+    import plotly.graph_objs as go
+
+    # Copy the shared figure so that it isn't changed for everyone:
+    fig = go.Figure(base_fig)
+
+    # Sneakily make a slightly taller figure when there are more
+    # highlighted teams selected. This is because the legend gets
+    # taller and will start reducing the size of the map axes
+    # unless more room is provided.
+    fig_height = 500 + 20*len([t for t in stroke_teams_selected
+                             if t[:4] != 'All '])
+    fig.update_layout(height=fig_height)
+
+    if shading is not None:
+        # Drawn under the highlighted teams:
+        add_map_shading(fig, df_stroke_team, shading)
+
+    # Add scatter markers for the selected hospitals.
+    # Remove any of the "all teams" or "all region" data:
+    stroke_teams_highlighted = [t for t in stroke_teams_selected
+                                if t[:4] != 'All ']
+    # Rows of the locations data for these teams:
+    rows = [team_index.location_row[t] for t in stroke_teams_highlighted]
+    df_highlighted = df_stroke_team.iloc[rows]
+    # Draw all of the highlighted teams in one trace...
+    fig.add_trace(go.Scattergeo(
+        lon=df_highlighted['long'],
+        lat=df_highlighted['lat'],
+        customdata=np.stack([df_highlighted['Stroke Team']], axis=-1),
+        mode='markers',
+        marker_color=[team_colours_dict[t] for t in stroke_teams_highlighted],
+        marker_line_color='black',
+        marker_line_width=1.0,
+        marker_size=10,
+        showlegend=False,
+        hovertemplate='%{customdata[0]}<extra></extra>'
+    ))
+    # ... and give each one its own legend entry:
+    add_legend_proxies(
+        fig, 'scattergeo', stroke_teams_highlighted, team_colours_dict,
+        lon=[None], lat=[None],
+        marker_line_color='black',
+        marker_line_width=1.0,
+        marker_size=10
+        )
+    return fig
+
+
+def get_region_geojson_url():
+    """
+    Find out whether the browser can download the region outlines.
+
+    Returns:
+    --------
+    url - str or None. Address of the outlines in the static folder,
+          or None if streamlit isn't serving that folder or the file
+          hasn't been made (see geography.py).
+    """
+    path = os.path.join(app_dir, 'static', region_static_file)
+    if st.get_option('server.enableStaticServing') and os.path.isfile(path):
+        return region_geojson_url
+    return None
+
+
+def get_map_shading(stats_cube, team_index, cohort, feature, title, year):
+    """
+    Look up the values to shade the map with.
+
+    Inputs:
+    -------
+    stats_cube - StatsCube. The stats for every cohort.
+    team_index - TeamIndex. Lookups for the stroke teams.
+    cohort     - str. Name of the cohort.
+    feature    - str. Feature name, e.g. 'age'.
+    title      - str. Name of the feature to show on the colour bar.
+    year       - str. Year label.
+
+    Returns:
+    --------
+    shading - MapShading. The regions use their "All (region)" values
+              and the teams use their own. Values are NaN where there
+              are no stats.
+    """
+    regions = team_index.regions
+    region_values = stats_cube.lookup(
+        feature, [f'All {region}' for region in regions],
+        [year] * len(regions), cohort)
+    team_values = stats_cube.lookup(
+        feature, team_index.teams, [year] * len(team_index.teams), cohort)
+    return MapShading(title, regions, region_values, team_values)
+
+
+def add_map_shading(fig, df_stroke_team, shading):
+    """
+    Shade the regions and colour the team markers by one feature.
+
+    The regions and teams share one colour scale, so a team's colour
+    can be compared with its region's. Only the values are added to
+    the region outlines trace, so the outlines themselves are the same
+    as in the base map. Teams with no value keep their plain marker.
+
+    Inputs:
+    -------
+    fig            - go.Figure. Copy of the base map to change.
+    df_stroke_team - pd.DataFrame. Dataframe of team locations, in the
+                     same order as the team values.
+    shading        - MapShading. Output of get_map_shading().
+    """
+    import plotly.graph_objs as go
+
+    values = np.concatenate([shading.region_values, shading.team_values])
+    if np.all(np.isnan(values)):
+        # Nothing to shade.
+        return
+
+    fig.update_traces(
+        selector=dict(type='choropleth'),
+        locations=shading.regions,
+        # JSON has no NaN, so regions without values are left blank:
+        z=[None if np.isnan(v) else v for v in shading.region_values],
+        coloraxis='coloraxis',
+        marker_opacity=0.7,
+        hoverinfo=None,
+        hovertemplate='All %{location}: %{z:,.3~f}<extra></extra>'
+        )
+
+    has_value = ~np.isnan(shading.team_values)
+    df_teams = df_stroke_team[has_value]
+    fig.add_trace(go.Scattergeo(
+        lon=df_teams['long'],
+        lat=df_teams['lat'],
+        # The team name is first, as in the other traces, so that
+        # clicks on these markers work in the same way:
+        customdata=np.stack([df_teams['Stroke Team']], axis=-1),
+        mode='markers',
+        marker_color=shading.team_values[has_value],
+        marker_coloraxis='coloraxis',
+        marker_line_color='black',
+        marker_line_width=0.5,
+        marker_size=9,
+        showlegend=False,
+        hovertemplate=(
+            '%{customdata[0]}: %{marker.color:,.3~f}<extra></extra>')
+    ))
+
+    fig.update_layout(coloraxis=dict(
+        colorscale=map_colour_scale,
+        cmin=float(np.nanmin(values)),
+        cmax=float(np.nanmax(values)),
+        # Above the map so that it doesn't take up any of its width:
+        colorbar=dict(
+            title=dict(text=shading.title, side='top'),
+            orientation='h',
+            x=0.5,
+            y=1.0,
+            yanchor='bottom',
+            len=0.8,
+            thickness=10
+            )
+        ))
+    # Make room for the colour bar:
+    fig.update_layout(margin_t=60, height=fig.layout.height + 60)
+
+
+def callback_geography(team_index):
+    """
+    Add or remove the clicked team from the highlighted teams.
+
+    This runs when the selection on the map changes, before the
+    rerun that it starts, so the new teams are used everywhere on
+    the page in that same rerun.
+
+    Every marker has its team name in its customdata, so the team is
+    looked up by name whichever trace the marker is in. The map's
+    element changes whenever the highlighted teams change, which
+    clears its selection, so clicking the same marker again
+    counts as a new click.
+
+    Inputs:
+    -------
+    team_index - TeamIndex. Lookups for the stroke teams.
+    """
+    points = st.session_state[map_selection_key]['selection']['points']
+    # The team names of the clicked markers, without repeats:
+    teams_clicked = list(dict.fromkeys(
+        point['customdata'][0] for point in points
+        if len(point.get('customdata', [])) > 0
+        ))
+
+    teams_selected = list(st.session_state.get(
+        'highlighted_teams_with_click_ds', []))
+    selected_set = set(teams_selected)
+    for team in teams_clicked:
+        if team not in team_index.location_row:
+            # Not one of the team markers.
+            continue
+        if team in selected_set:
+            # Remove this team from the list.
+            selected_set.remove(team)
+        else:
+            # Add the newly-selected team to the list.
+            selected_set.add(team)
+            teams_selected.append(team)
+    teams_selected = [t for t in teams_selected if t in selected_set]
+
+    # The page picks the teams up from here...
+    st.session_state['highlighted_teams_with_click_ds'] = teams_selected
+    # ... and the multiselect widget keeps its own value until it's
+    # reset, so reset it to show the new teams:
+    if 'team_input_ds' in st.session_state:
+        del st.session_state['team_input_ds']
+
+
+def fit_line(x, y):
+    """
+    Least squares line of best fit.
+
+    This uses the same sums as scipy.stats.linregress() without
+    having to import scipy.stats, which is slow.
+
+    Inputs:
+    -------
+    x - np.ndarray. x values.
+    y - np.ndarray. y values.
+
+    Returns:
+    --------
+    lobf - LineFit. Named tuple with the slope and intercept.
+    """
+    x_mean = np.mean(x)
+    y_mean = np.mean(y)
+    ssxm, ssxym, _, _ = np.cov(x, y, bias=1).flat
+    slope = ssxym / ssxm
+    return LineFit(slope, y_mean - slope * x_mean)
+
+
+def get_error_bars(interval_cube, cohort, feature, teams, years, values):
+    """
+    Make plotly error bars from the confidence intervals.
+
+    Inputs:
+    -------
+    interval_cube - StatsCube or None. Output of load_interval_cube().
+    cohort        - str. Which cohort of patients to show.
+    feature       - str. Name of the feature.
+    teams         - list. Team of each point.
+    years         - list. Year label of each point.
+    values        - np.ndarray. Value of each point.
+
+    Returns:
+    --------
+    error_bars - dict or None. Properties for error_x or error_y, or
+                 None if there are no intervals for this feature.
+    """
+    if interval_cube is None:
+        return None
+    lower_name, upper_name = interval_names(feature)
+    lower = interval_cube.lookup(lower_name, teams, years, cohort)
+    upper = interval_cube.lookup(upper_name, teams, years, cohort)
+    if np.all(np.isnan(lower)):
+        return None
+    return dict(
+        type='data',
+        symmetric=False,
+        array=upper - values,
+        arrayminus=values - lower,
+        color='black',
+        thickness=1.0,
+        width=3
+        )
 
 
 def plot_violins(
-        summary_stats_df,
+        stats_cube,
+        cohort,
         feature,
         feature_display_name,
         year_options,
         stroke_teams_selected,
         all_years_str,
         all_teams_str,
-        team_colours_dict
+        team_colours_dict,
+        interval_cube=None
         ):
     """
     Plot violins of this feature in each year.
@@ -304,7 +546,9 @@ def plot_violins(
 
     Inputs:
     -------
-    summary_stats_df      - pd.DataFrame. Descriptive stats dataframe.
+    stats_cube            - StatsCube. Descriptive stats for all teams.
+    cohort                - str. Which cohort of patients to show,
+                            e.g. 'all' or '4hr'.
     feature               - str. Name of the row of data to plot.
     feature_display_name  - str. How to print the feature name.
     year_options          - list. One string per year in the dataframe.
@@ -315,7 +559,48 @@ def plot_violins(
                             e.g. "all E+W".
     team_colours_dict     - dict. Keys are stroke teams, values are
                             colours to plot them in.
+    interval_cube         - StatsCube or None. Confidence intervals
+                            to draw as error bars on the teams.
     """
+    fig = create_violin_figure(
+        stats_cube,
+        cohort,
+        feature,
+        feature_display_name,
+        year_options,
+        stroke_teams_selected,
+        all_years_str,
+        all_teams_str,
+        team_colours_dict,
+        interval_cube
+        )
+    st.plotly_chart(fig, config=violin_config)
+
+
+def create_violin_figure(
+        stats_cube,
+        cohort,
+        feature,
+        feature_display_name,
+        year_options,
+        stroke_teams_selected,
+        all_years_str,
+        all_teams_str,
+        team_colours_dict,
+        interval_cube=None
+        ):
+    """
+    Make the violins figure for plot_violins().
+
+    This doesn't need streamlit, so it's also used for the reports
+    in reports.py. The inputs are the same as plot_violins().
+
+    Returns:
+    --------
+    fig - go.Figure. The violins.
+    """
+    import plotly.graph_objs as go
+
     fig = go.Figure()
 
     fig.update_layout(
@@ -324,10 +609,12 @@ def plot_violins(
         # margin_l=0, margin_r=0, margin_t=0, margin_b=0
         )
 
-    # Rename the dataframe to keep code short:
-    s = summary_stats_df.T
+    # View of this feature with shape (teams, years):
+    feature_vals = stats_cube.metric_values(feature, cohort)
+    # Position of each year in the stats cube:
+    year_inds = [stats_cube.year_index[year] for year in year_options]
     # Remove "all teams" and "all of this region" data:
-    s = s[~s.stroke_team.str.startswith(('All '))]
+    s = feature_vals[stats_cube.individual_teams]
 
     for y, year in enumerate(year_options):
         # Plot violins in grey except for the "all years" violin,
@@ -337,10 +624,12 @@ def plot_violins(
         else:
             colour = 'Grey'
 
-        # Include "to numeric" in case some of the numbers
-        # are secretly strings (despite my best efforts).
-        violin_vals = pd.to_numeric(s[feature][s['year'] == year])
-        # x_vals = [y]
+        # Only keep teams with data in this year:
+        violin_vals = s[:, year_inds[y]]
+        violin_vals = violin_vals[~np.isnan(violin_vals)]
+        if violin_vals.size == 0:
+            # A narrow cohort filter can leave no teams with data.
+            continue
 
         # Draw a violin for this data:
         fig.add_trace(go.Violin(
@@ -357,7 +646,8 @@ def plot_violins(
         # with vertical line connecting them:
         fig.add_trace(go.Scatter(
             x=[y]*3,
-            y=[violin_vals.min(), violin_vals.max(), violin_vals.median()],
+            y=[violin_vals.min(), violin_vals.max(),
+               np.median(violin_vals)],
             line_color='black',
             marker=dict(size=20, symbol='line-ew-open'),
             # name='Final Probability',
@@ -375,7 +665,7 @@ def plot_violins(
     y_gap = 0.025
     y_max = 0.15
     # Where to scatter the team markers:
-    y_offsets_scatter = []
+    y_offsets_scatter = np.array([])
     while len(y_offsets_scatter) < len(set(stroke_teams_selected)):
         y_extra = np.arange(y_gap, y_max, y_gap)
         y_extra = np.stack((
@@ -384,30 +674,58 @@ def plot_violins(
         y_offsets_scatter = np.append(y_offsets_scatter, y_extra)
         y_gap = 0.5 * y_gap
 
-    for i, stroke_team in enumerate(set(stroke_teams_selected)):
-        if stroke_team != all_teams_str:
-            scatter_vals = s[(
-                (s['stroke_team'] == stroke_team)
-                )]
-            # Just in case the years are out of order:
-            x_vals = []
-            for year in year_options:
-                inds = np.where(scatter_vals['year'] == year)[0]
-                if len(inds) > 0:
-                    x_vals.append(inds[0])
-                else:
-                    x_vals.append(np.NaN)
-            x_vals = np.array(x_vals) + y_offsets_scatter[i]
-            fig.add_trace(go.Scatter(
-                x=x_vals,
-                y=scatter_vals[feature],
-                mode='markers',
-                name=stroke_team,
-                marker_color=team_colours_dict[stroke_team],
-                marker_line_color='black',
-                marker_line_width=1.0,
-                hovertemplate='%{y}'
-            ))
+    # Unique teams in the order they were selected:
+    stroke_teams_highlighted = [
+        t for t in dict.fromkeys(stroke_teams_selected)
+        if t != all_teams_str
+        ]
+    # Every team's values in the same order as year_options.
+    # Years with no data for this team are NaN and so
+    # are left off the plot.
+    scatter_vals = np.full(
+        (len(stroke_teams_highlighted), len(year_options)), np.NaN)
+    for i, stroke_team in enumerate(stroke_teams_highlighted):
+        t = stats_cube.team_index.get(stroke_team)
+        if t is not None:
+            scatter_vals[i] = feature_vals[t, year_inds]
+    # Each team gets its own offset from the centre of every violin:
+    x_vals = (
+        np.arange(len(year_options))[np.newaxis, :] +
+        y_offsets_scatter[:len(stroke_teams_highlighted), np.newaxis]
+        )
+    # Team names and colours for every point:
+    team_names = np.repeat(stroke_teams_highlighted, len(year_options))
+    team_colours = np.repeat(
+        [team_colours_dict[t] for t in stroke_teams_highlighted],
+        len(year_options)
+        )
+    # Only send the points with data:
+    mask = ~np.isnan(scatter_vals.ravel())
+    error_y = get_error_bars(
+        interval_cube, cohort, feature, team_names[mask],
+        np.tile(year_options, len(stroke_teams_highlighted))[mask],
+        scatter_vals.ravel()[mask]
+        )
+    # Draw all of the highlighted teams in one trace...
+    fig.add_trace(go.Scatter(
+        x=x_vals.ravel()[mask],
+        y=scatter_vals.ravel()[mask],
+        error_y=error_y,
+        mode='markers',
+        marker_color=team_colours[mask],
+        marker_line_color='black',
+        marker_line_width=1.0,
+        customdata=np.stack([team_names[mask]], axis=-1),
+        hovertemplate='%{y}<extra>%{customdata[0]}</extra>',
+        showlegend=False
+    ))
+    # ... and give each one its own legend entry:
+    add_legend_proxies(
+        fig, 'scatter', stroke_teams_highlighted, team_colours_dict,
+        x=[None], y=[None],
+        marker_line_color='black',
+        marker_line_width=1.0
+        )
 
     fig.update_layout(yaxis_title=feature_display_name)
     fig.update_layout(
@@ -425,11 +743,7 @@ def plot_violins(
         x=0.9,
         # itemwidth=50
     ))
-
-    plotly_config = {
-        'modeBarButtonsToRemove': ['lasso2d', 'select2d'],
-    }
-    st.plotly_chart(fig, config=plotly_config)
+    return fig
 
 
 def scatter_fields(
@@ -437,46 +751,103 @@ def scatter_fields(
         y_feature_name,
         c_feature_name,
         year_restriction,
-        df,
+        stats_cube,
+        cohort,
         stroke_teams_selected,
         team_colours_dict,
         x_feature_display_name,
         y_feature_display_name,
         c_feature_display_name,
+        interval_cube=None
         ):
     """
     Scatter selected descriptive stats data for all teams.
 
     Inputs:
     -------
-    x_feature_name         - str. df column for x-axis data.
-    y_feature_name         - str. df column for y-axis data.
-    c_feature_name         - str. df column for colour data.
+    x_feature_name         - str. Feature for x-axis data.
+    y_feature_name         - str. Feature for y-axis data.
+    c_feature_name         - str. Feature for colour data.
     year_restriction       - str. Which years of data to use.
-    df                     - pd.DataFrame. Descriptive stats data.
+    stats_cube             - StatsCube. Descriptive stats data.
+    cohort                 - str. Which cohort of patients to show,
+                             e.g. 'all' or '4hr'.
     stroke_teams_selected  - list. Names of stroke teams to highlight.
     team_colours_dict      - dict. Colours for highlighted teams.
     x_feature_display_name - str. x-axis label.
     y_feature_display_name - str. y-axis label.
     c_feature_display_name - str. Colour axis label.
+    interval_cube          - StatsCube or None. Confidence intervals
+                             to draw as error bars on the highlighted
+                             teams.
     """
-    df = df.T
-
-    # Mask by selected year:
-    df = df[df['year'] == year_restriction]
-
-    # Remove "All teams" fields:
-    # Pull out any row of the dataframe that contains any of the
-    # selected stroke team names in any of its columns.
-    stroke_teams_named_all = [t for t in set(df['stroke_team'])
-                              if t[:4] == 'All ']
-    df = df[~df.isin(stroke_teams_named_all).any(axis=1)]
-
-    # Create the line of best fit:
-    lobf = linregress(
-        list(df[x_feature_name].astype(float).values),
-        list(df[y_feature_name].astype(float).values)
+    fig = create_scatter_figure(
+        x_feature_name,
+        y_feature_name,
+        c_feature_name,
+        year_restriction,
+        stats_cube,
+        cohort,
+        stroke_teams_selected,
+        team_colours_dict,
+        x_feature_display_name,
+        y_feature_display_name,
+        c_feature_display_name,
+        interval_cube
         )
+    st.plotly_chart(fig, config=scatter_config)
+
+
+def create_scatter_figure(
+        x_feature_name,
+        y_feature_name,
+        c_feature_name,
+        year_restriction,
+        stats_cube,
+        cohort,
+        stroke_teams_selected,
+        team_colours_dict,
+        x_feature_display_name,
+        y_feature_display_name,
+        c_feature_display_name,
+        interval_cube=None
+        ):
+    """
+    Make the scatter figure for scatter_fields().
+
+    This doesn't need streamlit, so it's also used for the reports
+    in reports.py. The inputs are the same as scatter_fields().
+
+    Returns:
+    --------
+    fig - go.Figure. The scatter plot.
+    """
+    import plotly.graph_objs as go
+
+    # Views of every feature for every team in the selected year:
+    year_vals, year_exists = stats_cube.year_values(year_restriction, cohort)
+
+    # Remove "All teams" fields and teams with no data in this year:
+    teams = stats_cube.individual_teams
+    mask_teams = year_exists[teams]
+    stroke_team_names = stats_cube.teams[teams][mask_teams]
+    x_vals = year_vals[teams, stats_cube.metric_index[x_feature_name]]
+    x_vals = x_vals[mask_teams]
+    y_vals = year_vals[teams, stats_cube.metric_index[y_feature_name]]
+    y_vals = y_vals[mask_teams]
+
+    # Create the line of best fit. Filters from the cohort cube can
+    # leave some teams with no value for a feature, so only fit the
+    # teams with both values. Leave the line out if there aren't
+    # enough of them for a line:
+    has_pair = ~np.isnan(x_vals) & ~np.isnan(y_vals)
+    x_fit = x_vals[has_pair]
+    lobf = None
+    if len(x_fit) >= 2:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lobf = fit_line(x_fit, y_vals[has_pair])
+        if not (np.isfinite(lobf.slope) and np.isfinite(lobf.intercept)):
+            lobf = None
 
     fig = go.Figure()
 
@@ -493,30 +864,31 @@ def scatter_fields(
         margin_l=0, margin_r=0, margin_t=0, margin_b=0
         )
 
-    # Create the legend label for the line of best fit.
-    # Round numbers to 3 significant figures and then convert
-    # large (>=1000) numbers back from general string format to
-    # float to avoid printing scientific notation (e.g. 4.01e+3).
-    lobf_int = (
-        f'{lobf.intercept:.3g}' if abs(lobf.intercept) < 1000
-        else int(float(f'{lobf.intercept:.3g}'))
-    )
-    lobf_slope = (
-        f'{lobf.slope:.3g}' if abs(lobf.slope) < 1000
-        else int(float(f'{lobf.slope:.3g}'))
-    )
-    lobf_name = (
-        f'{lobf_int} + ' +
-        f'({x_feature_display_name}) × ({lobf_slope})'
+    if lobf is not None:
+        # Create the legend label for the line of best fit.
+        # Round numbers to 3 significant figures and then convert
+        # large (>=1000) numbers back from general string format to
+        # float to avoid printing scientific notation (e.g. 4.01e+3).
+        lobf_int = (
+            f'{lobf.intercept:.3g}' if abs(lobf.intercept) < 1000
+            else int(float(f'{lobf.intercept:.3g}'))
         )
-    # Plot the line of best fit:
-    fig.add_trace(go.Scatter(
-        x=df[x_feature_name],
-        y=lobf.intercept + lobf.slope * df[x_feature_name].astype(float),
-        name=lobf_name,
-        hoverinfo='skip',
-        marker_color='silver'
-    ))
+        lobf_slope = (
+            f'{lobf.slope:.3g}' if abs(lobf.slope) < 1000
+            else int(float(f'{lobf.slope:.3g}'))
+        )
+        lobf_name = (
+            f'{lobf_int} + ' +
+            f'({x_feature_display_name}) × ({lobf_slope})'
+            )
+        # Plot the line of best fit:
+        fig.add_trace(go.Scatter(
+            x=x_fit,
+            y=lobf.intercept + lobf.slope * x_fit,
+            name=lobf_name,
+            hoverinfo='skip',
+            marker_color='silver'
+        ))
 
     # Plot highlighted teams:
     # Remove any of the "all teams" or "all region" data:
@@ -527,40 +899,71 @@ def scatter_fields(
         if (t[:4] != 'All ' and t not in a):
             a.append(t)
     stroke_teams_selected = a
-    for stroke_team in stroke_teams_selected:
-        mask_team = df['stroke_team'] == stroke_team
-        fig.add_trace(go.Scatter(
-            x=df[x_feature_name][mask_team],
-            y=df[y_feature_name][mask_team],
-            mode='markers',
-            name=df['stroke_team'][mask_team].squeeze(),
-            text=[df['stroke_team'][mask_team].squeeze()],
-            marker_color='rgba(0, 0, 0, 0)',
-            marker_line_color=team_colours_dict[stroke_team],
-            marker_size=10,
-            marker_line_width=2.5,
-            marker_symbol='square',
-            # hovertemplate='(%{x}, %{y})<extra>%{text}</extra>'
-            hoverinfo='skip'
-        ))
+    # Positions of the teams with data in this year:
+    team_inds = [stats_cube.team_index.get(t) for t in stroke_teams_selected]
+    teams_with_data = [
+        (team, t) for team, t in zip(stroke_teams_selected, team_inds)
+        if t is not None and year_exists[t]
+        ]
+    t_inds = [t for team, t in teams_with_data]
+    highlighted_x = year_vals[t_inds, stats_cube.metric_index[x_feature_name]]
+    highlighted_y = year_vals[t_inds, stats_cube.metric_index[y_feature_name]]
+    highlighted_teams = [team for team, t in teams_with_data]
+    highlighted_years = [year_restriction] * len(highlighted_teams)
+    # Draw all of the highlighted teams in one trace...
+    fig.add_trace(go.Scatter(
+        x=highlighted_x,
+        y=highlighted_y,
+        error_x=get_error_bars(
+            interval_cube, cohort, x_feature_name, highlighted_teams,
+            highlighted_years, highlighted_x
+            ),
+        error_y=get_error_bars(
+            interval_cube, cohort, y_feature_name, highlighted_teams,
+            highlighted_years, highlighted_y
+            ),
+        mode='markers',
+        text=highlighted_teams,
+        marker_color='rgba(0, 0, 0, 0)',
+        marker_line_color=[
+            team_colours_dict[team] for team, t in teams_with_data],
+        marker_size=10,
+        marker_line_width=2.5,
+        marker_symbol='square',
+        showlegend=False,
+        # hovertemplate='(%{x}, %{y})<extra>%{text}</extra>'
+        hoverinfo='skip'
+    ))
+    # ... and give each one its own legend entry:
+    add_legend_proxies(
+        fig, 'scatter', stroke_teams_selected, team_colours_dict,
+        colour_property='marker_line_color',
+        x=[None], y=[None],
+        marker_color='rgba(0, 0, 0, 0)',
+        marker_size=10,
+        marker_line_width=2.5,
+        marker_symbol='square'
+        )
 
     # Plot all teams that are not highlighted:
     if c_feature_display_name != 'None':
         # Colour teams by third value
+        c_vals = year_vals[teams, stats_cube.metric_index[c_feature_name]]
+        c_vals = c_vals[mask_teams]
         fig.add_trace(go.Scatter(
-            x=df[x_feature_name],
-            y=df[y_feature_name],
-            marker_color=df[c_feature_name].astype(float),
+            x=x_vals,
+            y=y_vals,
+            marker_color=c_vals,
             marker_showscale=True,
             marker_colorbar_title_text=c_feature_display_name,
             marker_colorbar_title_side='right',
             mode='markers',
-            text=df['stroke_team'],
+            text=stroke_team_names,
             name='Stroke teams',
             # marker_color='grey',
             marker_line_color='black',
             marker_line_width=1.0,
-            customdata=np.stack([df[c_feature_name].astype(float)], axis=-1),
+            customdata=np.stack([c_vals], axis=-1),
             hovertemplate=(
                 '(%{x}, %{y})<br>' + c_feature_display_name +
                 ': %{customdata[0]}<extra>%{text}</extra>'
@@ -570,10 +973,10 @@ def scatter_fields(
     else:
         # Show all teams in grey.
         fig.add_trace(go.Scatter(
-            x=df[x_feature_name],
-            y=df[y_feature_name],
+            x=x_vals,
+            y=y_vals,
             mode='markers',
-            text=df['stroke_team'],
+            text=stroke_team_names,
             name='Stroke teams',
             marker_color='grey',
             marker_line_color='black',
@@ -596,8 +999,4 @@ def scatter_fields(
             x=1.3,
             # itemwidth=50
         ))
-    plotly_config = {
-        'displayModeBar': False
-        # 'modeBarButtonsToRemove': ['lasso2d', 'select2d'],
-    }
-    st.plotly_chart(fig, config=plotly_config)
+    return fig
@@ -1,29 +1,132 @@
 """
 All of the content for the Results section.
+
+The results table is drawn as HTML made here rather than with a
+pandas Styler. The numbers are formatted a whole block of rows at a
+time from the format in metric_formats, and the finished HTML is
+cached on the columns, colours, cohort and data files. Changing
+another part of the page (e.g. the violin feature) then reuses the
+same HTML instead of formatting and styling the table again.
 """
+import html
+
+import numpy as np
 import streamlit as st
 
+from utilities_descriptive.confidence_intervals import interval_names
+
+
+# How to format each row of the results table.
+# Values are (printf-style format, number to multiply by).
+percentage_format = ('%.1f%%', 100.0)
+integer_format = ('%.0f', 1.0)
+float_format = ('%.2f', 1.0)
+metric_formats = {
+    'count': integer_format,
+    'age': float_format,
+    'male': percentage_format,
+    'infarction': percentage_format,
+    'stroke_severity': float_format,
+    'afib_anticoagulant': percentage_format,
+    'prior_disability': float_format,
+    'prestroke_mrs_0-2': percentage_format,
+    'onset_known': percentage_format,
+    'precise_onset_known': percentage_format,
+    'onset_during_sleep': percentage_format,
+    'onset_to_arrival_time': integer_format,
+    'arrive_in_4_hours': percentage_format,
+    'arrival_to_scan_time': integer_format,
+    'thrombolysis': percentage_format,
+    'scan_to_thrombolysis_time': integer_format,
+    'death': percentage_format,
+    'discharge_disability': float_format,
+    'increased_disability_due_to_stroke': float_format,
+    'mrs_5-6': percentage_format,
+    'mrs_0-2': percentage_format
+}
+
+# Label of each row of the results table, in the order shown:
+metric_display_names = {
+    'count': 'Count',
+    'age': 'Average age',
+    'male': 'Male',
+    'infarction': 'Infarction',
+    'stroke_severity': 'Stroke severity',
+    'afib_anticoagulant': 'AF anticoagulants',
+    'prior_disability': 'Average pre-stroke disability',
+    'prestroke_mrs_0-2': 'Pre-stroke mRS 0-2',
+    'onset_known': 'Onset known',
+    'precise_onset_known': 'Precise onset known',
+    'onset_during_sleep': 'Onset during sleep',
+    'onset_to_arrival_time': 'Onset-to-arrival time (minutes)',
+    'arrive_in_4_hours': 'Arrive within 4 hours',
+    'arrival_to_scan_time': 'Arrival-to-scan time (minutes)',
+    'thrombolysis': 'Thrombolysis',
+    'scan_to_thrombolysis_time': 'Scan-to-thrombolysis time (minutes)',
+    'death': 'Death',
+    'discharge_disability': 'Average discharge disability',
+    'increased_disability_due_to_stroke':
+        'Increased disability due to stroke',
+    'mrs_5-6': 'Discharge disability 5-6',
+    'mrs_0-2': 'Discharge disability 0-2'
+}
+
+# Label added to the confidence interval columns:
+interval_column_suffix = ' 95% CI'
+
+# Styles for the table. The colours of the headers are set on each
+# header cell.
+table_css = """
+<style>
+table.results-table {
+    border-collapse: collapse;
+    font-size: 0.9rem;
+    margin-bottom: 1rem;
+}
+table.results-table th, table.results-table td {
+    border-bottom: 1px solid rgba(49, 51, 63, 0.1);
+    padding: 0.25rem 0.5rem;
+}
+table.results-table td {
+    text-align: right;
+}
+table.results-table tbody th {
+    font-weight: normal;
+    text-align: left;
+}
+table.results-table tr:hover {
+    background-color: #ffffb388;
+}
+</style>
+"""
+
 
 def check_teams_in_stats_df(
         summary_stats_df,
         stroke_teams_selected,
+        team_index,
+        cohort,
         container_warnings
         ):
     """
     Remove any selected teams and years that aren't in the data.
 
-    If all of the selected teams and years exist in the descriptive
-    stats dataframe, then return a shorter dataframe of just those
-    teams and years. If some of them are missing, then check each
-    team and year combo in turn to root out the missing ones.
-    Return a dataframe of only the combos that exist and print a
-    warning message about those that don't.
+    The team lookups already know which team and year combos have
+    stats, so the missing ones are found in one go. Return a
+    dataframe of only the combos that exist and print a warning
+    message about those that don't.
 
     Inputs:
     -------
     summary_stats_df      - pd.DataFrame. The descriptive stats data.
     stroke_teams_selected - list. One string per team and year combo
                             selected by the user.
+    team_index            - TeamIndex. Lookups for the stroke teams.
+    cohort                - str or None. Which cohort the stats are
+                            for, e.g. 'all' or '4hr'. None for stats
+                            that aren't in the team lookups, e.g. from
+                            a cohort cube filter. Then the columns of
+                            summary_stats_df are the combos that exist.
     container_warnings    - streamlit container. Where to print any
                             warnings about missing data.
 
@@ -33,95 +136,189 @@ def check_teams_in_stats_df(
                  dataframe that covers only the selected team and
                  year combinations.
     """
-    try:
+    if cohort is None:
+        existing = set(summary_stats_df.columns)
+        missing_teams = [
+            t for t in stroke_teams_selected if t not in existing]
+    else:
+        missing_teams = team_index.missing_labels(
+            stroke_teams_selected, cohort)
+    if len(missing_teams) == 0:
         # Smaller dataframe of only selected teams:
-        df_to_show = summary_stats_df[stroke_teams_selected]
-    except KeyError:
-        # Remove teams that aren't in the dataframe.
-        # Keep the valid ones in here:
-        reduced_teams_to_show = []
-        # Keep the invalid ones in here:
-        missing_teams = []
-        # Set up for printing a nice warning message:
-        show_warning = False
-        warning_str = 'There is no data for '
-
-        # Sort the teams into the valid and invalid lists:
-        for team in stroke_teams_selected:
-            try:
-                summary_stats_df[team]
-                reduced_teams_to_show.append(team)
-            except KeyError:
-                show_warning = True
-                missing_teams.append(team)
-
-        # The dataframe containing only the valid teams:
-        df_to_show = summary_stats_df[reduced_teams_to_show]
-
-        # If there were missing teams (should always be True),
-        # show the message.
-        if show_warning is True:
-            # Create a warning message to print.
-            # e.g. "There is no data for {1}, {2} or {3}."
-            warning_str = (
-                warning_str +
-                ', '.join(missing_teams[:-1])
-                )
-            if len(missing_teams) > 1:
-                warning_str += ' or '
-            warning_str = (
-                warning_str + missing_teams[-1] + '.'
-            )
-            # Display the warning:
-            with container_warnings:
-                st.warning(warning_str, icon='⚠️')
+        return summary_stats_df[stroke_teams_selected]
+
+    # Remove teams that aren't in the dataframe:
+    missing_set = set(missing_teams)
+    reduced_teams_to_show = [
+        t for t in stroke_teams_selected if t not in missing_set]
+    # The dataframe containing only the valid teams:
+    df_to_show = summary_stats_df[reduced_teams_to_show]
+
+    # Create a warning message to print.
+    # e.g. "There is no data for {1}, {2} or {3}."
+    warning_str = 'There is no data for ' + ', '.join(missing_teams[:-1])
+    if len(missing_teams) > 1:
+        warning_str += ' or '
+    warning_str = warning_str + missing_teams[-1] + '.'
+    # Display the warning:
+    with container_warnings:
+        st.warning(warning_str, icon='⚠️')
 
     return df_to_show
 
 
-def apply_styles_to_dataframe(df_to_show, team_colours):
+def format_stats_table(values, metrics):
     """
+    Convert the numbers in the results table to strings.
 
-    n.b. there seem to be simpler more pandas-friendly ways to
-    achieve this with style.apply_index() and similar, but I can't
-    for the life of me get it working how I want to.
+    All of the rows that share a format in metric_formats are
+    formatted together in one go.
 
     Inputs:
     -------
-    df_to_show   - pd.DataFrame. The descriptive statistics dataframe
-                   that will be shown on the app.
-    team_colours - dict. Keys are selected teams, values are the
-                   colours for columns containing them.
+    values  - np.ndarray. Float array with one row per metric.
+    metrics - list. Name of the metric in each row.
 
     Returns:
     --------
-    df_to_show - pd.DataFrame. The styled dataframe.
+    strings - np.ndarray. Strings in the same shape, with percentages
+              for proportions and rounded numbers for the rest.
     """
-    # Set up a list of styles for the table.
-    # Each style is a dict with a selector to say where to apply the
-    # style and a props list to say what to change.
-    # Start off with just a style for highlighting any row (tr)
-    # when the cursor hovers on it. (A column is td).
-    styles = [{
-            'selector': 'tr:hover',
-            'props': [('background-color', '#ffffb388')]
-        }]
-    # For each column in the dataframe, get the required colour out of
-    # the colour list and define a new style for just the header (th)
-    # of that column (child n).
-    # Change the background colour "background-color" of the box
-    # and the colour of the text "color".
-    for c, colour in enumerate(team_colours):
-        # c+2 because HTML has one-indexing,
-        # and the "first" header is the one above the index.
-        # nth-child(2) is the header for the first proper column,
-        # the one that's 0th in the list according to pandas.
-        # (Working this out has displeased me greatly.)
-        styles.append({
-            'selector': f"th.col_heading:nth-child({c+2})",
-            'props': [("background-color", f"{colour}"),
-                      ("color", "black")]
-            })
-    # Apply these styles to the pandas DataFrame:
-    df_to_show = df_to_show.style.set_table_styles(styles)
-    return df_to_show
+    strings = np.empty(values.shape, dtype=object)
+    formats = [metric_formats.get(m, float_format) for m in metrics]
+    for spec in set(formats):
+        rows = [i for i, f in enumerate(formats) if f == spec]
+        template, scale = spec
+        strings[rows] = np.char.mod(template, values[rows] * scale)
+    return strings
+
+
+def get_interval_strings(interval_cube, cohort, teams, years, metrics):
+    """
+    Make strings of the confidence intervals to go with the results.
+
+    Inputs:
+    -------
+    interval_cube - StatsCube. Output of load_interval_cube().
+    cohort        - str. Which cohort the stats are for.
+    teams         - list. Team of each column of the table.
+    years         - list. Year label of each column of the table.
+    metrics       - list. Features to include, in order.
+
+    Returns:
+    --------
+    strings - np.ndarray. Strings like "74.52 to 75.31" with one row
+              per feature and one column per team and year. Blank
+              where there's no interval.
+    """
+    limits = [
+        np.array([
+            interval_cube.lookup(interval_names(m)[i], teams, years, cohort)
+            for m in metrics
+            ]).reshape(len(metrics), len(teams))
+        for i in range(2)
+        ]
+    lower, upper = limits
+    strings = np.char.add(
+        np.char.add(format_stats_table(lower, metrics).astype(str), ' to '),
+        format_stats_table(upper, metrics).astype(str)
+        ).astype(object)
+    strings[np.isnan(lower) | np.isnan(upper)] = ''
+    return strings
+
+
+def render_table_html(row_labels, column_labels, cells, column_colours):
+    """
+    Make the HTML for a table with coloured column headers.
+
+    Inputs:
+    -------
+    row_labels     - list. Label of each row.
+    column_labels  - list. Label of each column.
+    cells          - np.ndarray. Strings with one row per row label
+                     and one column per column label.
+    column_colours - list. Background colour of each column header.
+
+    Returns:
+    --------
+    table_html - str. The table and its styles.
+    """
+    header = ''.join(
+        f'<th style="background-color: {colour}; color: black">'
+        f'{html.escape(str(label))}</th>'
+        for label, colour in zip(column_labels, column_colours)
+        )
+    rows = ''.join(
+        f'<tr><th>{html.escape(str(label))}</th>' +
+        ''.join(f'<td>{html.escape(cell)}</td>' for cell in row) +
+        '</tr>'
+        for label, row in zip(row_labels, cells)
+        )
+    return (
+        table_css +
+        '<table class="results-table">' +
+        f'<thead><tr><th></th>{header}</tr></thead>' +
+        f'<tbody>{rows}</tbody></table>'
+        )
+
+
+# The dataframe and cube arguments start with an underscore so that
+# streamlit doesn't hash them. data_version stands in for them in
+# the cache key.
+@st.cache_data(show_spinner=False, max_entries=64)
+def render_results_table(
+        column_labels,
+        column_colours,
+        cohort,
+        show_intervals,
+        data_version,
+        _df_to_show,
+        _interval_cube,
+        _index_names
+        ):
+    """
+    Format the results table and turn it into HTML.
+
+    Inputs:
+    -------
+    column_labels  - tuple. "team (year)" labels of the columns.
+    column_colours - tuple. Header colour of each column.
+    cohort         - str. Which cohort the stats are for.
+    show_intervals - bool. Whether to add the confidence intervals.
+    data_version   - tuple. Fingerprint of the data files, from
+                     get_data_version() in data_loading.py.
+    _df_to_show    - pd.DataFrame. Output of check_teams_in_stats_df()
+                     with these columns and the 'stroke_team' and
+                     'year' rows.
+    _interval_cube - StatsCube or None. Confidence intervals.
+    _index_names   - dict. Features to show, in order, and the label
+                     of each.
+
+    Returns:
+    --------
+    table_html - str. The finished table.
+    """
+    metrics = list(_index_names.keys())
+    values = _df_to_show.loc[metrics].to_numpy(dtype=float)
+    cells = format_stats_table(values, metrics)
+    column_labels = list(column_labels)
+    column_colours = list(column_colours)
+
+    if show_intervals:
+        intervals = get_interval_strings(
+            _interval_cube, cohort,
+            _df_to_show.loc['stroke_team'].to_list(),
+            _df_to_show.loc['year'].to_list(),
+            metrics
+            )
+        # Put each interval column after its results column:
+        cells = np.stack([cells, intervals], axis=2).reshape(
+            len(metrics), -1)
+        column_labels = [
+            label for c in column_labels
+            for label in [c, c + interval_column_suffix]
+            ]
+        column_colours = [c for colour in column_colours for c in [colour] * 2]
+
+    return render_table_html(
+        list(_index_names.values()), column_labels, cells, column_colours)
@@ -0,0 +1,404 @@
+"""
+Cached loading of the data files used by the app.
+
+Streamlit reruns the whole page script after every widget change,
+so anything read from disk in there is read again on every click.
+The functions here parse each file once per process and hand the
+same object to every session. The cache is keyed on the file path
+and its modification time and size, so a file that is replaced on
+disk (e.g. after the stats notebook is rerun) is picked up on the
+next rerun without restarting the app.
+
+The stats are read from the columnar dataset written by
+stats_dataset.py when it exists, and from the .csv files otherwise.
+The stats for other filters on the patients come from the cohort
+cube (cohort_cube.py) when it exists. The confidence intervals for
+the stats files are read from their own .csv files if they exist.
+
+The returned objects are shared between all sessions, so treat
+them as read-only and copy them before changing anything.
+
+The modules that read the dataset and the cohort cube (and pyarrow
+and aggregation.py with them) are only imported when a file is
+first read, so that they don't slow down the start of the page.
+"""
+import os
+import json
+
+import pandas as pd
+import streamlit as st
+
+from utilities_descriptive.fixed_params import \
+    cohort_cube_file, get_cohort_label, stats_dataset_dir, \
+    summary_stats_files, summary_stats_interval_files
+from utilities_descriptive.stats_cube import \
+    build_stats_cube, build_stats_cube_from_records
+from utilities_descriptive.team_index import TeamIndex
+
+
+def get_file_version(path):
+    """
+    Find a cheap fingerprint of a file for use as a cache key.
+
+    Inputs:
+    -------
+    path - str. Path to the file.
+
+    Returns:
+    --------
+    version - tuple. The file's modification time in nanoseconds
+              and its size in bytes.
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_dataset_version(path):
+    """
+    Find a cheap fingerprint of every file in the dataset.
+
+    Inputs:
+    -------
+    path - str. Folder containing the dataset.
+
+    Returns:
+    --------
+    version - tuple. (file name, modification time, size) for every
+              file in the dataset, in a fixed order.
+    """
+    version = []
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            stat = os.stat(os.path.join(root, file))
+            version.append((
+                os.path.relpath(os.path.join(root, file), path),
+                stat.st_mtime_ns,
+                stat.st_size
+                ))
+    return tuple(sorted(version))
+
+
+def get_data_version(data_dir):
+    """
+    Find a cheap fingerprint of all of the stats files.
+
+    This is for caching things made from the stats, e.g. the results
+    table, so that they're made again when any of the files change.
+
+    Inputs:
+    -------
+    data_dir - str. Path to the data_descriptive folder.
+
+    Returns:
+    --------
+    version - tuple. Versions of the stats, the confidence intervals
+              and the cohort cube. Missing files are None.
+    """
+    paths = [
+        os.path.join(data_dir, file)
+        for file in list(summary_stats_interval_files.values()) +
+        [cohort_cube_file]
+        ]
+    return (_get_stats_version(data_dir),) + tuple(
+        get_file_version(path) if os.path.isfile(path) else None
+        for path in paths
+        )
+
+
+def load_summary_stats(path):
+    """
+    Load a descriptive stats file, e.g. summary_stats.csv.
+
+    Inputs:
+    -------
+    path - str. Path to the descriptive stats .csv file.
+
+    Returns:
+    --------
+    summary_stats_df - pd.DataFrame. Shared copy of the stats with
+                       one row per feature and one column per team
+                       and year combination.
+    """
+    return _read_summary_stats(path, get_file_version(path))
+
+
+def load_stats_cube(data_dir):
+    """
+    Load the stats for every cohort into one StatsCube.
+
+    The columnar dataset is used if it exists and otherwise the
+    stats are read from the .csv files.
+
+    Inputs:
+    -------
+    data_dir - str. Path to the data_descriptive folder.
+
+    Returns:
+    --------
+    stats_cube - StatsCube. Shared copy of the stats for all cohorts.
+    """
+    dataset_path = os.path.join(data_dir, stats_dataset_dir)
+    if os.path.isdir(dataset_path):
+        return _build_stats_cube_from_dataset(
+            dataset_path, get_dataset_version(dataset_path))
+    else:
+        file_versions = tuple(
+            (cohort, path, get_file_version(path))
+            for cohort, path in _summary_stats_paths(data_dir).items()
+            )
+        return _build_stats_cube(file_versions)
+
+
+def load_stats_table(data_dir, cohort, years):
+    """
+    Load the stats for one cohort in the summary_stats.csv layout.
+
+    When the columnar dataset exists, only the files for the
+    requested years are read. Otherwise the whole .csv file for the
+    cohort is returned.
+
+    Inputs:
+    -------
+    data_dir - str. Path to the data_descriptive folder.
+    cohort   - str. Name of the cohort, e.g. 'all' or '4hr'.
+    years    - list. Year labels that will be looked at.
+
+    Returns:
+    --------
+    summary_stats_df - pd.DataFrame. Shared copy of the stats with
+                       one row per feature and one column per team
+                       and year combination.
+    """
+    dataset_path = os.path.join(data_dir, stats_dataset_dir)
+    if os.path.isdir(dataset_path):
+        return _read_stats_table_from_dataset(
+            dataset_path, cohort, tuple(years),
+            get_dataset_version(dataset_path)
+            )
+    else:
+        return load_summary_stats(_summary_stats_paths(data_dir)[cohort])
+
+
+def load_interval_cube(data_dir):
+    """
+    Load the confidence intervals for every cohort into a StatsCube.
+
+    The metrics in the cube are the lower and upper limits of each
+    feature, named by interval_names() in confidence_intervals.py.
+
+    Inputs:
+    -------
+    data_dir - str. Path to the data_descriptive folder.
+
+    Returns:
+    --------
+    interval_cube - StatsCube or None. Shared copy of the intervals,
+                    or None if the interval files don't exist.
+    """
+    file_versions = []
+    for cohort, file in summary_stats_interval_files.items():
+        path = os.path.join(data_dir, file)
+        if not os.path.isfile(path):
+            return None
+        file_versions.append((cohort, path, get_file_version(path)))
+    return _build_stats_cube(tuple(file_versions))
+
+
+def load_cohort_cube(data_dir):
+    """
+    Load the accumulators for filtering the patients.
+
+    Inputs:
+    -------
+    data_dir - str. Path to the data_descriptive folder.
+
+    Returns:
+    --------
+    cohort_cube - CohortCube or None. Shared copy of the cube, or
+                  None if the cube file doesn't exist.
+    """
+    path = os.path.join(data_dir, cohort_cube_file)
+    if not os.path.isfile(path):
+        return None
+    return _read_cohort_cube(path, get_file_version(path))
+
+
+def load_filtered_stats_cube(data_dir, cohort_filter):
+    """
+    Work out the stats for one filter on the patients.
+
+    Inputs:
+    -------
+    data_dir      - str. Path to the data_descriptive folder.
+    cohort_filter - dict. See get_cohort_label() in fixed_params.py.
+
+    Returns:
+    --------
+    stats_cube - StatsCube. Shared copy of the stats with one cohort
+                 named by get_cohort_label().
+    """
+    path = os.path.join(data_dir, cohort_cube_file)
+    # Lists can't be hashed for the cache key, so use tuples:
+    filter_items = tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in cohort_filter.items()
+        ))
+    return _build_filtered_stats_cube(
+        path, filter_items, get_file_version(path))
+
+
+def _summary_stats_paths(data_dir):
+    return {
+        cohort: os.path.join(data_dir, file)
+        for cohort, file in summary_stats_files.items()
+        }
+
+
+def load_stroke_team_locations(path):
+    """
+    Load the table of stroke team locations and regions.
+
+    Inputs:
+    -------
+    path - str. Path to hospitals_and_lsoas_descriptive_stats.csv.
+
+    Returns:
+    --------
+    df_stroke_team - pd.DataFrame. Shared copy of the team data,
+                     sorted by 'Stroke Team'.
+    """
+    return _read_stroke_team_locations(path, get_file_version(path))
+
+
+def load_team_index(data_dir, locations_path):
+    """
+    Load the lookups between stroke teams, regions and stats.
+
+    Inputs:
+    -------
+    data_dir       - str. Path to the data_descriptive folder.
+    locations_path - str. Path to the team locations .csv file.
+
+    Returns:
+    --------
+    team_index - TeamIndex. Shared copy of the lookups.
+    """
+    return _build_team_index(
+        data_dir, locations_path,
+        get_file_version(locations_path), _get_stats_version(data_dir)
+        )
+
+
+def _get_stats_version(data_dir):
+    # The stats are read from the dataset if it exists:
+    dataset_path = os.path.join(data_dir, stats_dataset_dir)
+    if os.path.isdir(dataset_path):
+        return get_dataset_version(dataset_path)
+    else:
+        return tuple(
+            get_file_version(path)
+            for path in _summary_stats_paths(data_dir).values()
+            )
+
+
+def load_region_map(path):
+    """
+    Load the simplified region outlines for the map.
+
+    The file is the geojson in the static folder made by
+    geography.py. Its "bbox" holds the extent of the original
+    outlines.
+
+    Inputs:
+    -------
+    path - str. Path to the simplified region .geojson file.
+
+    Returns:
+    --------
+    region_map - dict. Shared copy with keys:
+                 'geojson' - dict. The simplified geojson.
+                 'extent'  - list. [long min, long max, lat min,
+                             lat max] of the original outlines.
+                 'regions' - list. Region names in feature order.
+    """
+    return _read_region_map(path, get_file_version(path))
+
+
+# The "version" arguments below aren't used inside the functions.
+# They're there so that streamlit includes them in the cache key.
+# Old versions of each file are dropped once max_entries is reached.
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _read_summary_stats(path, version):
+    return pd.read_csv(path, index_col=0)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _build_stats_cube(file_versions):
+    summary_stats_dfs = {
+        cohort: load_summary_stats(path)
+        for cohort, path, version in file_versions
+        }
+    return build_stats_cube(summary_stats_dfs)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _build_stats_cube_from_dataset(path, version):
+    from utilities_descriptive.stats_dataset import \
+        read_stats_dataset, table_to_records
+
+    table = read_stats_dataset(path)
+    return build_stats_cube_from_records(*table_to_records(table))
+
+
+# Keep more of these because there is one per selection of years.
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _read_stats_table_from_dataset(path, cohort, years, version):
+    from utilities_descriptive.stats_dataset import \
+        read_stats_dataset, table_to_summary_stats
+
+    table = read_stats_dataset(path, cohorts=[cohort], years=years)
+    return table_to_summary_stats(table)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _read_cohort_cube(path, version):
+    from utilities_descriptive.cohort_cube import read_cohort_cube
+
+    return read_cohort_cube(path)
+
+
+# Keep more of these because there is one per filter.
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _build_filtered_stats_cube(path, filter_items, version):
+    cohort_filter = {
+        k: list(v) if isinstance(v, tuple) else v for k, v in filter_items}
+    cohort_cube = _read_cohort_cube(path, version)
+    return cohort_cube.stats_cube(
+        cohort_filter, get_cohort_label(cohort_filter))
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _read_stroke_team_locations(path, version):
+    df_stroke_team = pd.read_csv(path, index_col=False)
+    return df_stroke_team.sort_values('Stroke Team')
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _build_team_index(data_dir, locations_path, version, stats_version):
+    return TeamIndex(
+        load_stroke_team_locations(locations_path),
+        load_stats_cube(data_dir)
+        )
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _read_region_map(path, version):
+    with open(path) as f:
+        geojson_ew = json.load(f)
+    long_min, lat_min, long_max, lat_max = geojson_ew['bbox']
+    return {
+        'geojson': geojson_ew,
+        'extent': [long_min, long_max, lat_min, lat_max],
+        'regions': [f['properties']['RGN11NM']
+                    for f in geojson_ew['features']]
+        }
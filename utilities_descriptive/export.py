@@ -0,0 +1,292 @@
+"""
+Files for downloading the descriptive stats.
+
+The download buttons on the demo page used to convert the results
+table to a .csv string on every rerun, even though the file is
+hardly ever downloaded. The functions here are passed to the
+buttons instead and only make the file when a button is clicked.
+
+There are two kinds of download:
+
++ the results table that's on the page. The file is cached on the
+  teams and years shown, the cohort, the format and the version of
+  the data files, so clicking again is instant.
++ the full stats for every team, year and cohort. These are read
+  and written one cohort and year at a time straight into a file in
+  the temporary folder, so the whole export is never held as one big
+  table or string while it's made. The file is kept and reused
+  until the data files change. Only making the file is done in
+  pieces: st.download_button() needs the contents as bytes, so the
+  finished file is still read into memory for each download.
+
+Formats:
+
++ CSV. The results table keeps the layout of summary_stats.csv.
++ Parquet. One row per team and year and one typed column per
+  feature, as in the columnar stats dataset (stats_dataset.py).
++ Excel. The results table keeps the layout of summary_stats.csv
+  but with numbers in the number cells. Needs openpyxl.
+
+The writers for each format, and pyarrow for reading the stats, are
+only imported when a file is made.
+
+The full stats use the Parquet layout in every format, with an extra
+'cohort' column. In Excel there is one sheet per cohort.
+"""
+import glob
+import hashlib
+import importlib.util
+import io
+import os
+import tempfile
+
+import pandas as pd
+import streamlit as st
+
+from utilities_descriptive.fixed_params import \
+    stats_dataset_dir, summary_stats_files
+
+
+# File extension and MIME type of each format:
+export_formats = {
+    'CSV': ('.csv', 'text/csv'),
+    'Parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    }
+# Excel files can't be made without openpyxl, so then that format
+# isn't offered:
+if importlib.util.find_spec('openpyxl') is not None:
+    export_formats['Excel'] = (
+        '.xlsx',
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+# Where the full exports are kept between clicks:
+export_dir = os.path.join(tempfile.gettempdir(), 'descriptive_stats_export')
+
+# Start of the full export file names:
+full_export_name = 'stroke_descriptive_stats_all'
+
+
+def selection_to_bytes(df, cohort, file_format):
+    """
+    Make a file of the results table.
+
+    Inputs:
+    -------
+    df          - pd.DataFrame. Stats in the summary_stats.csv layout
+                  for the teams and years to export.
+    cohort      - str. Name of the cohort the stats are for.
+    file_format - str. One of the keys of export_formats.
+
+    Returns:
+    --------
+    data - bytes. Contents of the file.
+    """
+    if file_format == 'CSV':
+        return df.to_csv().encode('utf-8')
+
+    buffer = io.BytesIO()
+    if file_format == 'Parquet':
+        import pyarrow.parquet as pq
+        from utilities_descriptive.stats_dataset import \
+            summary_stats_to_table
+        pq.write_table(summary_stats_to_table({cohort: df}), buffer)
+    elif file_format == 'Excel':
+        # The stats rows come from .csv files as text, so turn them
+        # back into numbers for the spreadsheet:
+        labels = ['stroke_team', 'year']
+        metrics = [i for i in df.index if i not in labels]
+        df = pd.concat([
+            df.loc[metrics].apply(pd.to_numeric).astype(object),
+            df.loc[labels]
+            ])
+        df.to_excel(buffer, sheet_name='stats')
+    else:
+        raise ValueError(f'Unknown export format: {file_format}')
+    return buffer.getvalue()
+
+
+# df isn't hashed. The other arguments say what's in it.
+@st.cache_data(show_spinner=False, max_entries=32)
+def export_selection(column_labels, cohort, file_format, data_version, _df):
+    """
+    Cached file of the results table.
+
+    Inputs:
+    -------
+    column_labels - tuple. Labels of the columns in _df.
+    cohort        - str. Name of the cohort the stats are for.
+    file_format   - str. One of the keys of export_formats.
+    data_version  - tuple. Output of get_data_version() in
+                    data_loading.py, so that the file is made again
+                    when the data files change.
+    _df           - pd.DataFrame. Stats in the summary_stats.csv
+                    layout for the teams and years to export.
+
+    Returns:
+    --------
+    data - bytes. Contents of the file.
+    """
+    return selection_to_bytes(_df, cohort, file_format)
+
+
+def iter_stats_batches(data_dir):
+    """
+    Read the stats for every cohort, team and year a bit at a time.
+
+    The columnar dataset is read one file (cohort and year) at a
+    time if it exists. Otherwise each cohort's .csv file is read
+    in turn.
+
+    Inputs:
+    -------
+    data_dir - str. Path to the data_descriptive folder.
+
+    Returns:
+    --------
+    batches - generator of pa.RecordBatch. Columns 'cohort', 'year',
+              'stroke_team' and then the features.
+    """
+    import pyarrow.dataset as ds
+    from utilities_descriptive.stats_dataset import \
+        partitioning, summary_stats_to_table
+
+    dataset_path = os.path.join(data_dir, stats_dataset_dir)
+    if os.path.isdir(dataset_path):
+        dataset = ds.dataset(
+            dataset_path, format='ipc', partitioning=partitioning)
+        label_columns = ['cohort', 'year', 'stroke_team']
+        columns = label_columns + [
+            c for c in dataset.schema.names if c not in label_columns]
+        # Sort the files so that the export is in the same order
+        # every time:
+        fragments = sorted(
+            dataset.get_fragments(), key=lambda fragment: fragment.path)
+        for fragment in fragments:
+            scanner = ds.Scanner.from_fragment(
+                fragment, schema=dataset.schema, columns=columns)
+            yield from scanner.to_batches()
+    else:
+        for cohort, file in summary_stats_files.items():
+            df = pd.read_csv(os.path.join(data_dir, file), index_col=0)
+            yield from summary_stats_to_table({cohort: df}).to_batches()
+
+
+def write_full_export(batches, file_format, path):
+    """
+    Write the stats to a file one batch at a time.
+
+    Inputs:
+    -------
+    batches     - iterable of pa.RecordBatch. Output of
+                  iter_stats_batches().
+    file_format - str. One of the keys of export_formats.
+    path        - str. File to write.
+    """
+    writer = None
+    if file_format == 'CSV':
+        import pyarrow.csv
+        for batch in batches:
+            if writer is None:
+                writer = pyarrow.csv.CSVWriter(path, batch.schema)
+            writer.write_batch(batch)
+    elif file_format == 'Parquet':
+        import pyarrow.parquet as pq
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema)
+            writer.write_batch(batch)
+    elif file_format == 'Excel':
+        # Rows are written to temporary files and only put together
+        # when the workbook is saved.
+        import openpyxl
+        workbook = openpyxl.Workbook(write_only=True)
+        sheets = {}
+        for batch in batches:
+            for row in batch.to_pylist():
+                cohort = row['cohort']
+                if cohort not in sheets:
+                    # Sheet names can't be longer than 31 characters:
+                    sheets[cohort] = workbook.create_sheet(cohort[:31])
+                    sheets[cohort].append(list(row.keys()))
+                sheets[cohort].append(list(row.values()))
+        workbook.save(path)
+    else:
+        raise ValueError(f'Unknown export format: {file_format}')
+    if writer is not None:
+        writer.close()
+
+
+def get_full_export_path(data_dir, data_version, file_format):
+    """
+    Find the full export file, making it if it doesn't exist yet.
+
+    The file name includes a hash of the data version, so a new file
+    is made when the data files change. Older files in the same
+    format are then deleted.
+
+    Inputs:
+    -------
+    data_dir     - str. Path to the data_descriptive folder.
+    data_version - tuple. Output of get_data_version() in
+                   data_loading.py.
+    file_format  - str. One of the keys of export_formats.
+
+    Returns:
+    --------
+    path - str. Path to the export file.
+    """
+    extension = export_formats[file_format][0]
+    digest = hashlib.sha1(repr(data_version).encode()).hexdigest()[:16]
+    path = os.path.join(
+        export_dir, f'{full_export_name}_{digest}{extension}')
+    if os.path.isfile(path):
+        return path
+
+    os.makedirs(export_dir, exist_ok=True)
+    # Write to a file of our own and then move it into place, so that
+    # another session never sees a file that's only half written:
+    handle, temp_path = tempfile.mkstemp(
+        suffix=extension, dir=export_dir)
+    os.close(handle)
+    try:
+        write_full_export(
+            iter_stats_batches(data_dir), file_format, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    for old_path in glob.glob(
+            os.path.join(export_dir, f'{full_export_name}_*{extension}')):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                # Another session may have removed it already.
+                pass
+    return path
+
+
+def export_all_stats(data_dir, data_version, file_format):
+    """
+    Contents of the full export file.
+
+    The file is made a batch at a time, but the whole of it is read
+    here for st.download_button(), so the server holds one copy of
+    the file in memory for each download.
+
+    Inputs:
+    -------
+    data_dir     - str. Path to the data_descriptive folder.
+    data_version - tuple. Output of get_data_version() in
+                   data_loading.py.
+    file_format  - str. One of the keys of export_formats.
+
+    Returns:
+    --------
+    data - bytes. Contents of the file.
+    """
+    with open(get_full_export_path(
+            data_dir, data_version, file_format), 'rb') as f:
+        return f.read()
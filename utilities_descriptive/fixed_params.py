@@ -1,7 +1,15 @@
-import streamlit as st
+"""
+Settings shared by the app and the scripts that build its data.
+
+streamlit is only imported inside page_setup() so that the stats can
+be built from these settings without it.
+"""
+import os
 
 
 def page_setup():
+    import streamlit as st
+
     # ----- Page setup -----
     # The following options set up the display in the tab in your browser.
     # Set page to widescreen must be first call to st.
@@ -13,6 +21,119 @@ def page_setup():
     # n.b. this can be set separately for each separate page if you like.
 
 
+# Top folder of the app, i.e. the one with the data_descriptive folder.
+# This is found from where this file is, so it doesn't depend on
+# the working directory and no data files need to be opened to find
+# it.
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Environment variable to read the page's data from another folder,
+# e.g. the benchmark's scaled-up copies of the data:
+data_dir_env_var = 'DESCRIPTIVE_DATA_DIR'
+
+
+def get_data_dir():
+    """
+    Folder with the data for the demo page.
+
+    This is read when the page runs rather than when this module is
+    imported, so that a change to the environment variable is picked
+    up by the next run.
+
+    Returns:
+    --------
+    data_dir - str. Path to the data_descriptive folder.
+    """
+    return os.environ.get(
+        data_dir_env_var, os.path.join(app_dir, 'data_descriptive'))
+
+
 # Labels in the descriptive stats dataframe:
 all_teams_str = 'All England & Wales'
-all_years_str = '2016 to 2021'
+
+
+def get_all_years_str(years):
+    """
+    Label for all of the years combined, e.g. "2016 to 2021".
+
+    The years come from the data so that the label still matches when
+    another year is added.
+
+    Inputs:
+    -------
+    years - list. The separate years in the data, in order.
+
+    Returns:
+    --------
+    all_years_str - str. Label of the "all years" group.
+    """
+    return f'{years[0]} to {years[-1]}'
+
+
+# Descriptive stats file for each cohort of patients.
+# 'all' is every patient and '4hr' is only patients with known onset
+# who arrived within four hours of onset.
+summary_stats_files = {
+    'all': 'summary_stats.csv',
+    '4hr': 'summary_stats_4hr.csv'
+}
+# Confidence intervals for the stats in each file, in the same layout:
+summary_stats_interval_files = {
+    'all': 'summary_stats_ci.csv',
+    '4hr': 'summary_stats_4hr_ci.csv'
+}
+# Columnar copy of the stats files (see stats_dataset.py):
+stats_dataset_dir = 'summary_stats_dataset'
+# Accumulators for filtering the patients (see cohort_cube.py):
+cohort_cube_file = 'cohort_cube.npz'
+
+# True/False fields that the patients can be filtered by. The
+# cohorts in cohort_fields in aggregation.py must use fields from
+# this list.
+cohort_dimensions = [
+    'arrive_in_4_hours',
+    'onset_known',
+    'precise_onset_known',
+    'infarction'
+]
+# Age bands, also used to filter the patients. Each edge is the
+# lowest age in the next band. Missing ages go in a band of their own.
+age_band_edges = [60, 70, 80, 90]
+age_band_labels = [
+    'Under 60', '60 to 69', '70 to 79', '80 to 89', '90 and over',
+    'Age not known'
+]
+# Short names of the filters for labelling the stats.
+# The 4hr cohort on its own keeps the label of its stats file.
+cohort_short_names = {
+    'arrive_in_4_hours': '4hr',
+    'onset_known': 'onset known',
+    'precise_onset_known': 'precise onset',
+    'infarction': 'infarction'
+}
+
+
+def get_cohort_label(cohort_filter):
+    """
+    Make a short label for a filter, e.g. '4hr, infarction'.
+
+    Inputs:
+    -------
+    cohort_filter - dict. Keys are the fields in cohort_dimensions
+                    with True to keep only patients where the field is
+                    True, and 'age_bands' with a list of age band
+                    labels to keep.
+
+    Returns:
+    --------
+    label - str. 'all' with no filters, '4hr' for only the 4hr
+            filter, and otherwise a list of the filters.
+    """
+    names = [cohort_short_names[field] for field in cohort_dimensions
+             if cohort_filter.get(field, False)]
+    age_bands = cohort_filter.get('age_bands', age_band_labels)
+    if len(age_bands) < len(age_band_labels):
+        names.append('age ' + ' / '.join(age_bands))
+    if len(names) == 0:
+        return 'all'
+    return ', '.join(names)
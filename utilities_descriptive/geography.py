@@ -0,0 +1,239 @@
+"""
+Build a smaller copy of the region outlines for the map.
+
+The region geojson has around 20,000 vertices, which is far more
+detail than the small map in the app can show. Every vertex is sent
+to the browser, and the app used to go through all of them on every
+rerun just to find the map's extent.
+
+This module simplifies each region outline with the Douglas-Peucker
+algorithm and saves the result as a geojson in the app's static
+folder. The extent of the original outlines is kept in the file's
+"bbox" so that the app doesn't have to go through the vertices.
+Streamlit serves the static folder as files, so the app's map can
+point plotly at the file's address and the browser downloads the
+outlines once instead of with every rerun of the page (see
+container_plots.py). When the folder isn't served, the app reads the
+same file and puts the outlines in the figure.
+
+Run this module from the top of the repository to rebuild the file:
+    python -m utilities_descriptive.geography --tolerance 0.005
+"""
+import json
+
+import numpy as np
+
+
+# File path relative to the data_descriptive folder:
+region_geojson_file = 'region_geojson/regions_EW.geojson'
+# File name of the simplified geojson in the static folder:
+region_static_file = 'regions_EW_simplified.geojson'
+
+# Default simplification tolerance in degrees (around 500m).
+# At the size of the map in the app this looks the same as the
+# original outlines with under a third of the vertices.
+default_tolerance = 0.005
+
+
+def simplify_line(points, tolerance):
+    """
+    Simplify a line of points with the Douglas-Peucker algorithm.
+
+    Points are removed if they are closer than the tolerance to the
+    straight line between the points that are kept either side. The
+    first and last points are always kept.
+
+    Inputs:
+    -------
+    points    - np.ndarray. Shape (n, 2) array of coordinates.
+    tolerance - float. Largest distance a point can be from the
+                simplified line, in the same units as the points.
+
+    Returns:
+    --------
+    points - np.ndarray. The points that are kept, in order.
+    """
+    n = len(points)
+    if n < 3:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+
+    # Work through the sections of the line still to be checked.
+    # (A stack instead of recursion to avoid hitting the limit.)
+    sections = [(0, n - 1)]
+    while len(sections) > 0:
+        start, end = sections.pop()
+        if end - start < 2:
+            continue
+        a = points[start]
+        b = points[end]
+        middle = points[start + 1:end]
+        ab = b - a
+        length = np.hypot(*ab)
+        if length == 0.0:
+            # Closed ring, so measure distance from the start point.
+            distances = np.hypot(*(middle - a).T)
+        else:
+            # Perpendicular distance from the line through a and b:
+            distances = np.abs(
+                ab[0] * (middle[:, 1] - a[1]) -
+                ab[1] * (middle[:, 0] - a[0])
+                ) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            sections.append((start, split))
+            sections.append((split, end))
+    return points[keep]
+
+
+def simplify_polygon(rings, tolerance, decimals):
+    """
+    Simplify the rings of one polygon.
+
+    Inputs:
+    -------
+    rings     - list. geojson polygon coordinates: the outer ring
+                then any holes, each a list of [long, lat] points.
+    tolerance - float. Simplification tolerance in degrees.
+    decimals  - int. Number of decimal places to round to.
+
+    Returns:
+    --------
+    rings - list. Simplified polygon coordinates. Holes that shrink
+            to fewer than four points are removed. The list is empty
+            if the outer ring itself shrinks away.
+    """
+    simplified = []
+    for ring in rings:
+        points = simplify_line(np.array(ring, dtype=float), tolerance)
+        # A closed ring needs at least three corners plus the repeat
+        # of the first point.
+        if len(points) < 4:
+            if len(simplified) == 0:
+                # Lost the outer ring, so lose the holes too.
+                return []
+            continue
+        simplified.append(np.round(points, decimals).tolist())
+    return simplified
+
+
+def build_region_map(geojson_ew, tolerance=default_tolerance, decimals=4):
+    """
+    Simplify the region outlines and gather the details for the map.
+
+    Inputs:
+    -------
+    geojson_ew - dict. Region geojson with the region name in the
+                 'RGN11NM' property of each feature.
+    tolerance  - float. Simplification tolerance in degrees.
+    decimals   - int. Number of decimal places to keep.
+
+    Returns:
+    --------
+    geojson_simplified - dict. The simplified geojson. Its 'bbox'
+                         is [long min, lat min, long max, lat max]
+                         of the original outlines.
+    """
+    features = []
+    all_points = []
+    for feature in geojson_ew['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        else:
+            polygons = geometry['coordinates']
+        for rings in polygons:
+            all_points += rings[0]
+
+        simplified = [simplify_polygon(p, tolerance, decimals)
+                      for p in polygons]
+        simplified = [p for p in simplified if len(p) > 0]
+        if len(simplified) == 0:
+            # Keep the biggest polygon as it was rather than losing
+            # the whole region.
+            simplified = [max(polygons, key=lambda p: len(p[0]))]
+        features.append({
+            'type': 'Feature',
+            'properties': feature['properties'],
+            'geometry': {'type': 'MultiPolygon', 'coordinates': simplified}
+            })
+
+    # Find the extent of the original outlines so that simplifying
+    # doesn't change the axis limits:
+    all_points = np.array(all_points)
+    bbox = [
+        all_points[:, 0].min(),
+        all_points[:, 1].min(),
+        all_points[:, 0].max(),
+        all_points[:, 1].max()
+    ]
+    return {
+        'type': 'FeatureCollection',
+        'bbox': [float(b) for b in bbox],
+        'features': features
+        }
+
+
+def count_vertices(geojson_ew):
+    """
+    Count the number of points in every polygon in a geojson.
+
+    Inputs:
+    -------
+    geojson_ew - dict. Geojson feature collection of polygons.
+
+    Returns:
+    --------
+    n - int. Total number of points.
+    """
+    n = 0
+    for feature in geojson_ew['features']:
+        geometry = feature['geometry']
+        polygons = (
+            [geometry['coordinates']] if geometry['type'] == 'Polygon'
+            else geometry['coordinates'])
+        n += sum(len(ring) for rings in polygons for ring in rings)
+    return n
+
+
+def main():
+    """
+    Rebuild the simplified region outlines in the static folder.
+    """
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--data-dir', default='./data_descriptive',
+        help='Folder containing the region geojson.')
+    parser.add_argument(
+        '--static-dir', default='./static',
+        help='Folder that streamlit serves the static files from.')
+    parser.add_argument(
+        '--tolerance', type=float, default=default_tolerance,
+        help='Simplification tolerance in degrees.')
+    parser.add_argument(
+        '--decimals', type=int, default=4,
+        help='Decimal places to keep in the coordinates.')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.data_dir, region_geojson_file)) as f:
+        geojson_ew = json.load(f)
+    geojson_simplified = build_region_map(
+        geojson_ew, args.tolerance, args.decimals)
+    os.makedirs(args.static_dir, exist_ok=True)
+    with open(os.path.join(args.static_dir, region_static_file), 'w') as f:
+        json.dump(geojson_simplified, f, separators=(',', ':'))
+
+    print(
+        f'Vertices: {count_vertices(geojson_ew)} -> ' +
+        f'{count_vertices(geojson_simplified)}'
+        )
+
+
+if __name__ == '__main__':
+    main()
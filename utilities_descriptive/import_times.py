@@ -0,0 +1,172 @@
+"""
+Check how long the demo page's modules take to import.
+
+A new copy of the app can't draw anything until the page's imports
+are done, so the slow libraries that only some parts of the page need
+(plotly, scipy, matplotlib, pyarrow's dataset reader, the stats
+pipeline and the file writers for the downloads) are imported inside
+the functions that use them. This script checks
+that this is still true and that the imports stay within a time
+budget.
+
+Python's -X importtime option is used in a fresh process for each
+run. streamlit is imported first and isn't counted, because the
+streamlit server has already imported it before any page runs. The
+fastest of a few runs is used.
+
+The script exits with status 1 if the imports are over the budget or
+if any of the deferred libraries were imported, so it can be used in
+automated checks. Run from the top of the repository, e.g.
+    python -m utilities_descriptive.import_times --budget-ms 800
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from utilities_descriptive.fixed_params import app_dir
+
+
+# Modules that the demo page imports when it starts:
+startup_modules = [
+    'utilities_descriptive.fixed_params',
+    'utilities_descriptive.container_inputs',
+    'utilities_descriptive.data_loading',
+    'utilities_descriptive.export',
+    'utilities_descriptive.container_results',
+    'utilities_descriptive.container_plots',
+    'utilities_descriptive.plot_utils',
+    'utilities_descriptive.profiling',
+    ]
+
+# Libraries that shouldn't be imported until they're needed:
+deferred_modules = [
+    'plotly.graph_objs',
+    'plotly.express',
+    'scipy',
+    'matplotlib',
+    'pyarrow.dataset',
+    'pyarrow.parquet',
+    'pyarrow.csv',
+    'openpyxl',
+    'utilities_descriptive.aggregation',
+    'utilities_descriptive.cohort_cube',
+    'utilities_descriptive.stats_dataset',
+    ]
+
+# Default limit on the time to import startup_modules, in ms:
+default_budget_ms = 1000.0
+
+
+def parse_importtime(stderr):
+    """
+    Read the output of python -X importtime.
+
+    Inputs:
+    -------
+    stderr - str. Everything the process wrote to stderr.
+
+    Returns:
+    --------
+    imports - list. (module name, own time in ms, cumulative time
+              in ms, depth) for each module in the order they
+              finished importing. Depth 0 is a top-level import.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header line.
+            continue
+        name = fields[2].rstrip()
+        # Nested imports are indented by two spaces per level:
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((
+            name.strip(),
+            int(fields[0]) / 1000.0,
+            int(fields[1]) / 1000.0,
+            depth
+            ))
+    return imports
+
+
+def measure_imports(modules):
+    """
+    Import some modules after streamlit in a new process.
+
+    Inputs:
+    -------
+    modules - list. Names of the modules to import.
+
+    Returns:
+    --------
+    imports - list. Output of parse_importtime() for everything
+              imported after streamlit.
+    """
+    code = 'import streamlit\n' + ''.join(f'import {m}\n' for m in modules)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [app_dir] + [p for p in [env.get('PYTHONPATH')] if p])
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=app_dir, env=env, capture_output=True, text=True, check=True
+        )
+    imports = parse_importtime(result.stderr)
+    # Only keep what was imported after streamlit finished:
+    names = [name for name, own, cumulative, depth in imports]
+    return imports[names.index('streamlit') + 1:]
+
+
+def main():
+    """
+    Time the imports of the demo page and check them against a budget.
+    """
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+        )
+    parser.add_argument(
+        '--budget-ms', type=float, default=default_budget_ms,
+        help='Most time the imports may take, in ms.')
+    parser.add_argument(
+        '--repeats', type=int, default=3,
+        help='Number of runs. The fastest is used.')
+    parser.add_argument(
+        '--top', type=int, default=10,
+        help='Number of the slowest imports to list.')
+    args = parser.parse_args()
+
+    runs = [measure_imports(startup_modules) for _ in range(args.repeats)]
+    # Only the top-level imports add up to the total time:
+    totals = [
+        sum(cumulative for name, own, cumulative, depth in imports
+            if depth == 0)
+        for imports in runs
+        ]
+    best = min(range(len(runs)), key=lambda i: totals[i])
+    imports = runs[best]
+    total_ms = totals[best]
+
+    print(f'Time to import the demo page modules: {total_ms:.0f} ms '
+          f'(budget {args.budget_ms:.0f} ms)')
+    print('Slowest imports (cumulative ms):')
+    slowest = sorted(imports, key=lambda row: row[2], reverse=True)
+    for name, own, cumulative, depth in slowest[:args.top]:
+        print(f'  {cumulative:8.1f}  {name}')
+
+    imported = {name for name, own, cumulative, depth in imports}
+    early = [m for m in deferred_modules if m in imported]
+    failed = False
+    if len(early) > 0:
+        print('Imported too early: ' + ', '.join(early))
+        failed = True
+    if total_ms > args.budget_ms:
+        print('Over the budget.')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+Build the descriptive stats with several processes.
+
+The serial pipeline in aggregation.py reads the extract in chunks
+and accumulates each chunk in turn, which uses one core. Here the
+extract is still read in chunks, but each prepared chunk is turned
+into plain numpy columns and the columns are copied once into shared
+memory, sorted by stroke team (or by year). Each worker process then
+attaches to the shared memory and accumulates one contiguous slice
+of the chunk's rows, so no worker is sent a copy of the data.
+
+The next chunk is read while the workers are busy with the last one.
+Only those two chunks are held at once, so the memory used still
+depends on the chunk size rather than the size of the extract.
+
+Every slice holds all of the chunk's patients for its teams (or
+years), so each team and year in a chunk is added up by exactly one
+worker in the same row order as in the extract. The slices are
+merged in order with merge_stats(), and each chunk is then added to
+the running totals in the same way as in the serial pipeline. This
+means the output doesn't depend on the number of workers or on which
+worker finishes first.
+
+Run from the top of the repository with --workers, e.g.
+    python -m utilities_descriptive.aggregation \\
+        ~/ssnap_data/clean_samuel_ssnap_extract_v2.csv --workers 8
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from utilities_descriptive.aggregation import \
+    accumulate_cohort_cube, extract_dtypes, extract_fields, mean_fields, \
+    merge_stats, prepare_patient_data, summary_stats_dict
+
+
+# Number of slices to make for each worker. More slices than workers
+# keeps every worker busy when some teams are much bigger than others.
+shards_per_worker = 4
+
+
+def chunk_to_columns(data, team_codes):
+    """
+    Convert one prepared chunk to numpy columns for shared memory.
+
+    Team names are stored as integer codes and the mean features as
+    floats, which is how accumulate_stats() adds them up anyway.
+
+    Inputs:
+    -------
+    data       - pd.DataFrame. Output of prepare_patient_data().
+    team_codes - dict. Team name to code. New teams are added to it.
+
+    Returns:
+    --------
+    columns - dict. Column name to 1D np.ndarray.
+    """
+    teams = data['stroke_team'].astype(str).to_numpy()
+    for team in pd.unique(teams):
+        team_codes.setdefault(team, len(team_codes))
+    columns = {
+        'stroke_team': np.array(
+            [team_codes[t] for t in teams], dtype=np.int32)
+        }
+    for field in summary_stats_dict.keys():
+        if field == 'stroke_team':
+            continue
+        if field in mean_fields:
+            # True/False columns with missing values are objects,
+            # so convert them here in the same way as the serial path.
+            columns[field] = data[field].astype(float).to_numpy()
+        else:
+            columns[field] = data[field].to_numpy()
+    return columns
+
+
+def plan_shards(shard_codes, n_shards):
+    """
+    Split rows sorted by a key into slices of about the same size.
+
+    Slices only start where the key changes, so all of the rows
+    for one key are in the same slice.
+
+    Inputs:
+    -------
+    shard_codes - np.ndarray. Sorted key for each row.
+    n_shards    - int. Number of slices to aim for.
+
+    Returns:
+    --------
+    bounds - list. (start, stop) row numbers of each slice.
+    """
+    n_rows = len(shard_codes)
+    if n_rows == 0:
+        return []
+    key_starts = np.flatnonzero(
+        np.concatenate([[True], shard_codes[1:] != shard_codes[:-1]]))
+    targets = np.linspace(0, n_rows, n_shards + 1)[1:-1]
+    # Move each target cut forward to the start of the next key:
+    cuts = key_starts[np.minimum(
+        np.searchsorted(key_starts, targets), len(key_starts) - 1)]
+    edges = np.unique(np.concatenate([[0], cuts, [n_rows]]))
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def columns_to_shared_memory(columns, order):
+    """
+    Copy columns into shared memory in the given row order.
+
+    Inputs:
+    -------
+    columns - dict. Column name to np.ndarray, e.g. the output of
+              chunk_to_columns().
+    order   - np.ndarray. Row order to store the columns in.
+
+    Returns:
+    --------
+    blocks  - list. SharedMemory blocks. The caller must close and
+              unlink these.
+    columns - dict. Column name to (block name, dtype str), the
+              details that a worker needs to attach.
+    """
+    blocks = []
+    shared_columns = {}
+    for name, values in columns.items():
+        block = shared_memory.SharedMemory(
+            create=True, size=max(1, values.nbytes))
+        blocks.append(block)
+        shared = np.ndarray(values.shape, values.dtype, buffer=block.buf)
+        np.take(values, order, out=shared)
+        del shared
+        shared_columns[name] = (block.name, values.dtype.str)
+    return blocks, shared_columns
+
+
+def release_shared_memory(blocks):
+    """
+    Close and unlink the shared memory for one chunk.
+
+    Inputs:
+    -------
+    blocks - list. SharedMemory blocks from columns_to_shared_memory().
+    """
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def accumulate_shard(columns, teams, n_rows, start, stop):
+    """
+    Accumulate the stats for one slice of the rows in shared memory.
+
+    This runs in a worker process.
+
+    Inputs:
+    -------
+    columns - dict. Output of columns_to_shared_memory().
+    teams   - list. Team names in code order.
+    n_rows  - int. Number of rows in each column.
+    start   - int. First row of the slice.
+    stop    - int. Row after the last row of the slice.
+
+    Returns:
+    --------
+    cube_stats - dict. Output of accumulate_cohort_cube().
+    """
+    data = {}
+    for name, (block_name, dtype) in columns.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        shared = np.ndarray((n_rows,), np.dtype(dtype), buffer=block.buf)
+        # Copy out only this slice so that the block can be closed:
+        data[name] = shared[start:stop].copy()
+        del shared
+        block.close()
+    data['stroke_team'] = pd.Categorical.from_codes(
+        data['stroke_team'], categories=teams)
+    data = pd.DataFrame(data)[list(summary_stats_dict.keys())]
+    return accumulate_cohort_cube(data)
+
+
+def submit_chunk(data, team_codes, executor, n_shards, shard_by):
+    """
+    Put one prepared chunk in shared memory and start the workers.
+
+    Inputs:
+    -------
+    data       - pd.DataFrame. Output of prepare_patient_data().
+    team_codes - dict. Team name to code. New teams are added to it.
+    executor   - concurrent.futures.ProcessPoolExecutor. Workers.
+    n_shards   - int. Number of slices to split the rows into.
+    shard_by   - str. 'stroke_team' or 'year'. Which field to split
+                 the rows by.
+
+    Returns:
+    --------
+    blocks  - list. SharedMemory blocks holding the chunk. Release
+              these with release_shared_memory() once the futures
+              are done.
+    futures - list. One future for each slice, in row order. Empty
+              if the chunk has no patients.
+    """
+    columns = chunk_to_columns(data, team_codes)
+    n_rows = len(columns[shard_by])
+    if n_rows == 0:
+        return [], []
+    # Stable so that each team keeps the row order of the extract:
+    order = np.argsort(columns[shard_by], kind='stable')
+    bounds = plan_shards(columns[shard_by][order], n_shards)
+
+    blocks, shared_columns = columns_to_shared_memory(columns, order)
+    del columns, order
+    teams = list(team_codes.keys())
+    try:
+        futures = [
+            executor.submit(
+                accumulate_shard, shared_columns, teams, n_rows, start, stop)
+            for start, stop in bounds
+            ]
+    except BaseException:
+        release_shared_memory(blocks)
+        raise
+    return blocks, futures
+
+
+def collect_chunk(blocks, futures):
+    """
+    Wait for the workers on one chunk and merge their slices.
+
+    The shared memory is released even if a worker fails.
+
+    Inputs:
+    -------
+    blocks  - list. Output of submit_chunk().
+    futures - list. Output of submit_chunk().
+
+    Returns:
+    --------
+    cube_stats - dict or None. Accumulators for the chunk, or None if
+                 the chunk had no patients.
+    """
+    try:
+        # Merge in slice order rather than finishing order:
+        cube_stats_list = [future.result() for future in futures]
+    finally:
+        release_shared_memory(blocks)
+    if len(cube_stats_list) == 0:
+        return None
+    return merge_stats(cube_stats_list)
+
+
+def add_chunk_stats(cube_stats, chunk_stats):
+    """
+    Add one chunk's accumulators to the running totals.
+
+    Inputs:
+    -------
+    cube_stats  - dict or None. Running totals so far.
+    chunk_stats - dict or None. Output of collect_chunk().
+
+    Returns:
+    --------
+    cube_stats - dict or None. The new running totals.
+    """
+    if chunk_stats is None:
+        return cube_stats
+    if cube_stats is None:
+        return chunk_stats
+    return merge_stats([cube_stats, chunk_stats])
+
+
+def accumulate_extract_in_parallel(
+        path,
+        executor,
+        n_shards,
+        chunksize=200000,
+        shard_by='stroke_team'
+        ):
+    """
+    Read a patient-level SSNAP extract and accumulate it in parallel.
+
+    Inputs:
+    -------
+    path      - str. Path to the extract .csv file.
+    executor  - concurrent.futures.ProcessPoolExecutor. Workers.
+    n_shards  - int. Number of slices to split each chunk into.
+    chunksize - int. Number of patients to read at once.
+    shard_by  - str. 'stroke_team' or 'year'. Which field to split
+                the rows by.
+
+    Returns:
+    --------
+    cube_stats - dict. Accumulators for each team, year and cohort
+                 cell in the same format as accumulate_cohort_cube().
+    """
+    reader = pd.read_csv(
+        path,
+        usecols=extract_fields,
+        dtype=extract_dtypes,
+        chunksize=chunksize
+        )
+    team_codes = {}
+    cube_stats = None
+    # The chunk that the workers are busy with:
+    pending = None
+    try:
+        for chunk in reader:
+            submitted = submit_chunk(
+                prepare_patient_data(chunk), team_codes, executor,
+                n_shards, shard_by
+                )
+            # collect_chunk() releases the chunk it's given, so take
+            # it out of pending first:
+            previous, pending = pending, submitted
+            if previous is not None:
+                cube_stats = add_chunk_stats(
+                    cube_stats, collect_chunk(*previous))
+        last, pending = pending, None
+        if last is not None:
+            cube_stats = add_chunk_stats(cube_stats, collect_chunk(*last))
+    finally:
+        if pending is not None:
+            for future in pending[1]:
+                future.cancel()
+            release_shared_memory(pending[0])
+
+    if cube_stats is None:
+        raise ValueError(f'There are no patients to accumulate in {path}.')
+    return cube_stats
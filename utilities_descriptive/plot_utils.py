@@ -1,82 +1,363 @@
 """
 Helper functions for plotting.
 
-These highlighted colours functions are closely copied from the
-"thrombolysis decisions" app.
+The highlighted teams' colours come from a ColourAllocator kept in
+the session state. The first colours are the preferred plotly colours
+in the same order as the "thrombolysis decisions" app uses them.
+After those comes a fixed list of a few hundred more colours picked
+to look as different from each other as possible, so highlighting a
+whole region or every team still gives each team its own colour and
+the same selections always give the same colours.
+
+Colours are handed out from a free list: a team that is no longer
+highlighted gives its colour back, and the next new team gets the
+earliest free colour in the list. Only the teams that are added or
+removed are looked at, so each team takes the same short time no
+matter how many are highlighted. If every colour is in use, a team
+gets a colour from a hash of its name, which is the same in every
+session.
 """
-import plotly.express as px
-import matplotlib
+import functools
+import heapq
+import zlib
+
 import numpy as np
 import streamlit as st
 
 
+# Order to use the plotly colours in (not too close to each other
+# at the start):
+inds_preferred = [1, 5, 4, 7, 8, 9, 6, 2, 3, 0]
+
+# Total number of colours in the highlight palette:
+highlight_palette_size = 256
+
+# Candidates for the extra colours, in the OKLCH colour space.
+# Very light and very dark colours are left out so that the teams
+# still stand out against the white background and the grey
+# markers of the other teams:
+palette_lightness = np.linspace(0.45, 0.85, 9)
+palette_chroma = np.array([0.05, 0.09, 0.13, 0.17, 0.21])
+palette_hue = np.arange(0.0, 360.0, 5.0)
+
+# Conversions between linear sRGB and the OKLab colour space:
+lms_from_rgb = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005]
+    ])
+lab_from_lms = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660]
+    ])
+
+
+def hex_to_oklab(colours):
+    """
+    Convert sRGB hex strings to the OKLab colour space.
+
+    OKLab is a perceptual colour space, so the distance between two
+    colours there is roughly how different they look.
+
+    Inputs:
+    -------
+    colours - list. Hex strings, e.g. '#1f77b4'.
+
+    Returns:
+    --------
+    lab - np.ndarray. One row of (L, a, b) per colour.
+    """
+    rgb = np.array(
+        [[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colours]
+        ) / 255.0
+    # Undo the gamma correction:
+    rgb = np.where(
+        rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    return np.cbrt(rgb @ lms_from_rgb.T) @ lab_from_lms.T
+
+
+def oklab_to_hex(lab):
+    """
+    Convert colours in the OKLab colour space to sRGB hex strings.
+
+    Inputs:
+    -------
+    lab - np.ndarray. One row of (L, a, b) per colour. The colours
+          should be inside sRGB, or they're clipped.
+
+    Returns:
+    --------
+    colours - list. Hex strings, e.g. '#1f77b4'.
+    """
+    rgb = oklab_to_linear_rgb(lab)
+    rgb = np.clip(rgb, 0.0, 1.0)
+    # Gamma correction:
+    rgb = np.where(
+        rgb <= 0.0031308, 12.92 * rgb, 1.055 * rgb ** (1 / 2.4) - 0.055)
+    rgb = np.round(255 * rgb).astype(int)
+    return ['#%02x%02x%02x' % tuple(c) for c in rgb]
+
+
+def oklab_to_linear_rgb(lab):
+    """
+    Convert colours in the OKLab colour space to linear sRGB.
+
+    Inputs:
+    -------
+    lab - np.ndarray. One row of (L, a, b) per colour.
+
+    Returns:
+    --------
+    rgb - np.ndarray. One row of (red, green, blue) per colour.
+          Values outside 0 to 1 are outside sRGB.
+    """
+    lms = (lab @ np.linalg.inv(lab_from_lms).T) ** 3
+    return lms @ np.linalg.inv(lms_from_rgb).T
+
+
+@functools.lru_cache(maxsize=1)
+def get_highlight_palette():
+    """
+    List every colour that highlighted teams can have.
+
+    The preferred plotly colours come first. Then each extra colour
+    is picked from a grid of OKLCH colours to be as different as
+    possible from every colour before it, so the first colours in
+    the list are the most distinct from each other. There's no
+    randomness, so the list is the same every time. It's made the
+    first time it's needed and then kept.
+
+    Returns:
+    --------
+    palette - tuple. Hex colour strings.
+    """
+    # Imported here because it's slow to import and isn't needed
+    # until the first teams are highlighted:
+    from plotly.colors import qualitative
+
+    preferred = [qualitative.Plotly[i].lower() for i in inds_preferred]
+
+    # Grid of candidate colours:
+    lightness, chroma, hue = [
+        grid.ravel() for grid in np.meshgrid(
+            palette_lightness, palette_chroma, np.radians(palette_hue),
+            indexing='ij')
+        ]
+    candidates = np.column_stack(
+        [lightness, chroma * np.cos(hue), chroma * np.sin(hue)])
+    # Only keep colours that sRGB can show:
+    rgb = oklab_to_linear_rgb(candidates)
+    candidates = candidates[np.all((rgb >= 0.0) & (rgb <= 1.0), axis=1)]
+
+    # Distance from each candidate to the nearest colour picked so
+    # far. Picking the candidate with the largest distance each time
+    # spreads the colours out evenly.
+    nearest = np.min(np.linalg.norm(
+        candidates[:, None, :] - hex_to_oklab(preferred)[None, :, :],
+        axis=2), axis=1)
+    n_extra = min(highlight_palette_size - len(preferred), len(candidates))
+    picked = []
+    for _ in range(n_extra):
+        i = int(np.argmax(nearest))
+        picked.append(i)
+        nearest = np.minimum(
+            nearest, np.linalg.norm(candidates - candidates[i], axis=1))
+
+    # Leave out any extra colours that round to one before:
+    palette = list(dict.fromkeys(preferred + oklab_to_hex(candidates[picked])))
+    return tuple(palette)
+
+
+def get_hashed_colour(team, palette):
+    """
+    Pick a colour from a team's name.
+
+    The hash is the same in every session, unlike python's hash().
+
+    Inputs:
+    -------
+    team    - str. Team name.
+    palette - tuple. Colours to pick from.
+
+    Returns:
+    --------
+    colour - str. One of the palette colours.
+    """
+    return palette[zlib.crc32(team.encode('utf-8')) % len(palette)]
+
+
+class ColourAllocator:
+    """
+    Give each highlighted team its own colour from a palette.
+
+    A team keeps its colour for as long as it's highlighted. When it
+    is released, its colour goes back on the free list.
+
+    Attributes:
+    -----------
+    palette - tuple. Colours to hand out, in the order to use them.
+    colours - dict. Team name to colour for every team that has one,
+              in the order they were given out.
+    """
+    def __init__(self, palette=None):
+        self.palette = get_highlight_palette() if palette is None \
+            else tuple(palette)
+        self.colours = {}
+        # Palette position of each team's colour. Teams with hashed
+        # colours aren't in here because they don't use up a slot:
+        self._slot_of_team = {}
+        # Free list. Positions that have been given back, kept as a
+        # heap so that the earliest one is used next...
+        self._free_slots = []
+        # ... and the first position that hasn't been used yet:
+        self._next_slot = 0
+
+    def get_colour(self, team):
+        """
+        Find a team's colour, giving it one if it doesn't have one.
+
+        Inputs:
+        -------
+        team - str. Team name.
+
+        Returns:
+        --------
+        colour - str. The team's colour.
+        """
+        colour = self.colours.get(team)
+        if colour is not None:
+            return colour
+        if len(self._free_slots) > 0:
+            slot = heapq.heappop(self._free_slots)
+        elif self._next_slot < len(self.palette):
+            slot = self._next_slot
+            self._next_slot += 1
+        else:
+            slot = None
+
+        if slot is None:
+            # Every colour is in use.
+            colour = get_hashed_colour(team, self.palette)
+        else:
+            colour = self.palette[slot]
+            self._slot_of_team[team] = slot
+        self.colours[team] = colour
+        return colour
+
+    def assign(self, teams):
+        """
+        Make sure that every team in a list has a colour.
+
+        Inputs:
+        -------
+        teams - list. Team names in the order to give out colours.
+
+        Returns:
+        --------
+        colours - dict. The colours attribute.
+        """
+        for team in teams:
+            self.get_colour(team)
+        return self.colours
+
+    def release(self, teams):
+        """
+        Give back the colours of some teams.
+
+        Inputs:
+        -------
+        teams - iterable. Team names. Teams without colours are
+                ignored.
+        """
+        for team in teams:
+            self.colours.pop(team, None)
+            slot = self._slot_of_team.pop(team, None)
+            if slot is not None:
+                heapq.heappush(self._free_slots, slot)
+
+    def keep_only(self, teams):
+        """
+        Give back the colours of every team that isn't in a list.
+
+        Inputs:
+        -------
+        teams - list. Team names to keep the colours of.
+        """
+        keep = set(teams)
+        self.release([team for team in self.colours if team not in keep])
+
+
+def get_colour_allocator():
+    """
+    Get this session's ColourAllocator, making it if it's new.
+
+    Returns:
+    --------
+    allocator - ColourAllocator. Stored in the session state.
+    """
+    if 'highlight_colour_allocator_ds' not in st.session_state:
+        st.session_state['highlight_colour_allocator_ds'] = \
+            ColourAllocator()
+    return st.session_state['highlight_colour_allocator_ds']
+
+
 def remove_old_colours_for_highlights(highlighted_teams_input):
     # Remove highlighted colours that are no longer needed:
-    try:
-        highlighted_teams_colours_before = \
-            st.session_state['highlighted_teams_colours_ds']
-        highlighted_teams_colours = {}
-        for team in highlighted_teams_input:
-            try:
-                highlighted_teams_colours[team] = \
-                    highlighted_teams_colours_before[team]
-            except KeyError:
-                pass
-        st.session_state[
-            'highlighted_teams_colours_ds'] = highlighted_teams_colours
-    except KeyError:
-        st.session_state['highlighted_teams_colours_ds'] = {}
+    allocator = get_colour_allocator()
+    allocator.keep_only(highlighted_teams_input)
+    st.session_state['highlighted_teams_colours_ds'] = allocator.colours
 
 
 def choose_colours_for_highlights(highlighted_teams_list):
+    # Give a colour to any newly highlighted teams:
+    allocator = get_colour_allocator()
+    allocator.assign(highlighted_teams_list)
+    # Save the colour dictionary to the session state:
+    st.session_state['highlighted_teams_colours_ds'] = allocator.colours
+
+
+def add_legend_proxies(
+        fig,
+        trace_type,
+        teams,
+        team_colours_dict,
+        colour_property='marker_color',
+        **trace_kwargs
+        ):
+    """
+    Add legend entries for highlighted teams drawn in a shared trace.
+
+    The plots draw all of the highlighted teams in one trace with a
+    colour for each point so that the figure doesn't grow by a whole
+    trace per team. That trace is left out of the legend and instead
+    each team gets an entry here from a trace with a single empty
+    point, which shows up in the legend but not on the plot.
+    The entries are made as plain dicts and added to the figure in
+    one go rather than with one add_trace() call per team.
 
-    highlighted_teams_colours = \
-        st.session_state['highlighted_teams_colours_ds']
-    # Specify the indices to get a mix of colours:
-    plotly_colours = px.colors.qualitative.Plotly
-    # Pick out some colours we prefer (not too close to existing colours):
-    inds_preferred = [1, 5, 4, 7, 8, 9, 6, 2, 3, 0]
-    preferred_colours = np.array(plotly_colours)[inds_preferred]
-
-    for i, leg_entry in enumerate(highlighted_teams_list):
-        try:
-            # Check if there's already a designated colour:
-            colour = highlighted_teams_colours[leg_entry]
-        except KeyError:
-            # Pick a colour that hasn't already been used.
-            unused_colours = list(np.setdiff1d(
-                preferred_colours,
-                list(highlighted_teams_colours.values())
-                ))
-            if len(unused_colours) < 1:
-                # Select a colour from this list:
-                mpl_colours = list(matplotlib.colors.cnames.values())
-                colour = list(highlighted_teams_colours.values())[0]
-                while colour in list(highlighted_teams_colours.values()):
-                    colour = mpl_colours[
-                        np.random.randint(0, len(mpl_colours))]
-            else:
-                # np.random.shuffle(unused_colours)
-                # colour = unused_colours[0]
-                # # Take either the first or the last from this list
-                # # (mixes up the reds and blues a bit.)
-                # c_ind = 0 if i % 2 == 0 else -1
-                # colour = unused_colours[c_ind]
-                # preferred_colours = [plotly_colours[1], ]
-                success = 0
-                j = 0
-                while success < 1:
-                    colour = preferred_colours[j]
-                    if colour in highlighted_teams_colours.values():
-                        j += 1
-                    else:
-                        success = 1
-
-            # Add this to the dictionary:
-            highlighted_teams_colours[leg_entry] = colour
-        # # Store the colour:
-        # # highlighted_teams_colours.append(colour)
-        # highlighted_teams_colours[leg_entry] = colour
-    # Save the new colour dictionary to the session state:
-    st.session_state[
-        'highlighted_teams_colours_ds'] = highlighted_teams_colours
+    Inputs:
+    -------
+    fig               - go.Figure. Figure to add the entries to.
+    trace_type        - str. Plotly trace type, e.g. 'scatter'.
+    teams             - list. Team names in legend order.
+    team_colours_dict - dict. Keys are teams, values are colours.
+    colour_property   - str. Which trace property to set to the team
+                        colour, e.g. 'marker_line_color'.
+    trace_kwargs      - Any other trace properties, e.g. the marker
+                        style. Must include the empty coordinates,
+                        e.g. x=[None], y=[None].
+    """
+    if len(teams) == 0:
+        return
+    fig.add_traces([
+        dict(
+            type=trace_type,
+            name=team,
+            mode='markers',
+            hoverinfo='skip',
+            **{colour_property: team_colours_dict[team]},
+            **trace_kwargs
+            )
+        for team in teams
+        ])
@@ -0,0 +1,211 @@
+"""
+Optional timings for each section of the demo page.
+
+Profiling is off unless it is switched on in one of two ways:
+
++ the environment variable DESCRIPTIVE_STATS_PROFILE, e.g.
+      DESCRIPTIVE_STATS_PROFILE=1 streamlit run Introduction.py
++ the query parameter "profile" in the page's address, e.g.
+      http://localhost:8501/Interactive_demo?profile=1
+
+Use the value "cprofile" instead of "1" to also record which
+functions took the time.
+
+When it is on, every rerun records the wall time and the memory
+allocated by each section of the page. The results are shown in a
+"Diagnostics" expander at the bottom of the page and appended as one
+JSON line per rerun to a log file.
+
+The plot sections are fragments that can rerun on their own. Each
+fragment run makes its own profiler, shows its own "Diagnostics"
+expander inside the fragment and adds its own line to the log with
+the options that were picked in that run. The 'run' in each line
+says whether it's from the whole page or from one fragment. The log file is
+profile_log.jsonl in the working directory unless the environment
+variable DESCRIPTIVE_STATS_PROFILE_LOG gives another path.
+
+Memory is measured with tracemalloc, which sees every thread. If
+several sessions are rerunning at the same time, their allocations
+are mixed together.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+import pandas as pd
+import streamlit as st
+
+
+# Names of the switches:
+profile_env_var = 'DESCRIPTIVE_STATS_PROFILE'
+profile_query_param = 'profile'
+log_env_var = 'DESCRIPTIVE_STATS_PROFILE_LOG'
+default_log_file = 'profile_log.jsonl'
+
+# Number of functions to list from each cProfile run:
+cprofile_lines = 15
+
+
+def get_profile_setting():
+    """
+    Check whether profiling has been switched on.
+
+    The query parameter is checked first so that profiling can be
+    switched on for one browser tab.
+
+    Returns:
+    --------
+    setting - str or None. None if profiling is off, 'cprofile' to
+              also run cProfile, or 'timing' for timings only.
+    """
+    value = st.query_params.get(profile_query_param)
+    if value is None:
+        value = os.environ.get(profile_env_var)
+    if value is None or value.lower() in ['', '0', 'false', 'no', 'off']:
+        return None
+    if value.lower() == 'cprofile':
+        return 'cprofile'
+    return 'timing'
+
+
+class RerunProfiler:
+    """
+    Record timings for named sections of one rerun of the page.
+
+    Wrap each section in "with profiler.section(name):", or call
+    profiler.start(name) and profiler.stop() around it. Sections
+    shouldn't overlap. When the profiler is switched off, the
+    sections do nothing.
+
+    Attributes:
+    -----------
+    run         - str. What is being rerun, e.g. 'page' or the name
+                  of a fragment. Saved in the log.
+    enabled     - bool. Whether anything is recorded.
+    use_cprofile - bool. Whether each section is also run in cProfile.
+    results     - list. One dict per finished section with keys
+                  'section', 'wall_ms', 'allocated_mb', 'peak_mb' and,
+                  with cProfile, 'cprofile'.
+    """
+    def __init__(self, setting=None, run='page'):
+        self.run = run
+        self.enabled = setting is not None
+        self.use_cprofile = setting == 'cprofile'
+        self.results = []
+        self._started_tracemalloc = False
+        self._current = None
+        self._start_time = time.perf_counter()
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def start(self, name):
+        """
+        Start recording a section.
+
+        Inputs:
+        -------
+        name - str. Label for the section, e.g. 'container_map'.
+        """
+        if not self.enabled:
+            return
+        tracemalloc.reset_peak()
+        self._current = {
+            'section': name,
+            'memory_before': tracemalloc.get_traced_memory()[0],
+            'profile': cProfile.Profile() if self.use_cprofile else None,
+            'start': time.perf_counter()
+            }
+        if self._current['profile'] is not None:
+            self._current['profile'].enable()
+
+    def stop(self):
+        """
+        Stop recording the section from the last start().
+        """
+        if not self.enabled:
+            return
+        current = self._current
+        profile = current['profile']
+        if profile is not None:
+            profile.disable()
+        wall = time.perf_counter() - current['start']
+        memory_after, memory_peak = tracemalloc.get_traced_memory()
+        result = {
+            'section': current['section'],
+            'wall_ms': 1000.0 * wall,
+            'allocated_mb': (memory_after - current['memory_before']) / 1e6,
+            'peak_mb': (memory_peak - current['memory_before']) / 1e6,
+            }
+        if profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats(
+                'cumulative').print_stats(cprofile_lines)
+            result['cprofile'] = stream.getvalue()
+        self.results.append(result)
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """
+        Record the time and memory used inside a with block.
+
+        Inputs:
+        -------
+        name - str. Label for the section, e.g. 'container_map'.
+        """
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def finish(self, container, selection=None):
+        """
+        Show the results on the page and add them to the log file.
+
+        Inputs:
+        -------
+        container - streamlit container. Where to draw the panel.
+        selection - dict or None. Details of what the user picked,
+                    saved in the log next to the timings.
+        """
+        if not self.enabled:
+            return
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        total_ms = 1000.0 * (time.perf_counter() - self._start_time)
+
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'run': self.run,
+            'total_ms': total_ms,
+            'selection': selection,
+            'sections': self.results,
+            }
+        log_file = os.environ.get(log_env_var, default_log_file)
+        try:
+            with open(log_file, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+        except OSError:
+            # Don't break the page if the log can't be written.
+            pass
+
+        with container:
+            with st.expander('Diagnostics'):
+                if self.run == 'page':
+                    st.markdown(f'Whole rerun: {total_ms:.0f} ms')
+                else:
+                    st.markdown(f'Rerun of {self.run}: {total_ms:.0f} ms')
+                if len(self.results) > 0:
+                    df = pd.DataFrame(self.results).set_index('section')
+                    st.dataframe(
+                        df[['wall_ms', 'allocated_mb', 'peak_mb']])
+                for result in self.results:
+                    if 'cprofile' in result:
+                        st.markdown(f'__{result["section"]}__')
+                        st.code(result['cprofile'])
@@ -0,0 +1,451 @@
+"""
+Static HTML reports of the descriptive stats for every team and region.
+
+Each stroke team gets one .html file comparing it with its region and
+with England & Wales, and each region gets one comparing its teams.
+A report has the same parts as the demo page: the results table, the
+map, violins of some features over time and a scatter of two
+features. They're made by the same functions as on the page
+(render_results_table() and the create_..._figure() functions in
+container_plots.py) without running streamlit.
+
+The reports are made in a pool of processes. The stats, lookups and
+base map are loaded once in the main process and given to each
+worker when it starts rather than with every report. The region
+outlines on the map are the same in every report, so each worker
+converts them to JSON once and copies the same text into every file.
+
+By default the plotly.js library is written into every report so
+that each file works on its own, even offline. Use --plotlyjs cdn
+to load it from the internet instead, which makes the files much
+smaller.
+
+Run from the top of the repository, e.g.
+    python -m utilities_descriptive.reports --output-dir reports
+"""
+import argparse
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.graph_objs as go
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+from plotly.utils import PlotlyJSONEncoder
+
+from utilities_descriptive.container_plots import \
+    create_base_map, create_geography_figure, create_scatter_figure, \
+    create_violin_figure, map_config, scatter_config, violin_config
+from utilities_descriptive.container_results import \
+    metric_display_names, render_results_table
+from utilities_descriptive.data_loading import \
+    load_interval_cube, load_stats_cube, load_stroke_team_locations, \
+    load_team_index
+from utilities_descriptive.fixed_params import all_teams_str, app_dir
+from utilities_descriptive.geography import region_static_file
+from utilities_descriptive.plot_utils import ColourAllocator
+
+
+# Name of the team locations file in the data_descriptive folder:
+locations_file = 'hospitals_and_lsoas_descriptive_stats.csv'
+
+# Features to draw violins of:
+default_features = [
+    'arrive_in_4_hours',
+    'arrival_to_scan_time',
+    'thrombolysis',
+    'scan_to_thrombolysis_time'
+    ]
+# Features for the x and y axes of the scatter plot:
+default_scatter_features = ['arrival_to_scan_time', 'thrombolysis']
+
+# Where plotly.js is loaded from with --plotlyjs cdn. This is the
+# same version as the one that comes with the plotly package:
+plotlyjs_cdn_url = (
+    f'https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js')
+
+# Things that every report needs, set in each worker by init_worker():
+_shared = {}
+
+
+def get_report_colours(teams):
+    """
+    Pick a highlight colour for each team.
+
+    The colours are picked in the same way as on the demo page, so a
+    report and the page show the same selection in the same colours.
+
+    Inputs:
+    -------
+    teams - list. Team names, including any "All ..." groups.
+
+    Returns:
+    --------
+    team_colours_dict - dict. Keys are teams, values are colours.
+    """
+    return ColourAllocator().assign(teams)
+
+
+def get_report_file_name(kind, name):
+    """
+    Make a file name for a report.
+
+    Inputs:
+    -------
+    kind - str. 'team' or 'region'.
+    name - str. Name of the team or region.
+
+    Returns:
+    --------
+    file_name - str. e.g. 'team_Torbay_Hospital.html'.
+    """
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')
+    return f'{kind}_{slug}.html'
+
+
+def figure_to_html(fig, config, div_id, base_traces_json=None):
+    """
+    Make the HTML to draw one plotly figure.
+
+    Inputs:
+    -------
+    fig              - go.Figure. The figure.
+    config           - dict. Plotly config, e.g. violin_config.
+    div_id           - str. ID for the figure's div.
+    base_traces_json - str or None. JSON list of traces to draw
+                       under the figure's own traces.
+
+    Returns:
+    --------
+    figure_html - str. A div and the script that draws in it. Needs
+                  plotly.js to be loaded first.
+    """
+    fig_json = fig.to_json()
+    data = 'figure.data'
+    if base_traces_json is not None:
+        data = f'{base_traces_json}.concat(figure.data)'
+    return (
+        f'<div id="{div_id}"></div>\n'
+        '<script>\n'
+        '(function() {\n'
+        f'var figure = {fig_json};\n'
+        f'Plotly.newPlot("{div_id}", {data}, figure.layout, '
+        f'{json.dumps(config)});\n'
+        '})();\n'
+        '</script>\n'
+        )
+
+
+def init_worker(shared):
+    """
+    Store the data that every report needs in this worker.
+
+    Inputs:
+    -------
+    shared - dict. Made by main() with keys 'stats_cube',
+             'interval_cube', 'team_index', 'df_stroke_team',
+             'base_map', 'summary_stats_df' and 'options'.
+    """
+    _shared.update(shared)
+    base_map = shared['base_map']
+    # Convert the region outlines and team markers to JSON once.
+    # Each report draws its own highlighted teams on top of these
+    # and keeps the rest of the base map's layout:
+    _shared['base_traces_json'] = json.dumps(
+        base_map.to_plotly_json()['data'], cls=PlotlyJSONEncoder)
+    _shared['base_layout_map'] = go.Figure(layout=base_map.layout)
+    if shared['options']['plotlyjs'] == 'inline':
+        _shared['plotlyjs_html'] = (
+            f'<script type="text/javascript">{get_plotlyjs()}</script>')
+    else:
+        _shared['plotlyjs_html'] = (
+            f'<script src="{plotlyjs_cdn_url}"></script>')
+
+
+def make_report_html(title, description, table_html, figure_sections):
+    """
+    Put the parts of a report together.
+
+    Inputs:
+    -------
+    title           - str. Heading of the report.
+    description     - list. Lines of text to show under the heading.
+    table_html      - str. The results table.
+    figure_sections - list. (heading, figure HTML) for each plot.
+
+    Returns:
+    --------
+    report_html - str. The whole .html file.
+    """
+    parts = [
+        '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n',
+        f'<title>{html.escape(title)}</title>\n',
+        _shared['plotlyjs_html'],
+        '\n<style>body { font-family: sans-serif; margin: 2rem; }'
+        '</style>\n</head>\n<body>\n',
+        f'<h1>{html.escape(title)}</h1>\n'
+        ]
+    parts += [f'<p>{html.escape(line)}</p>\n' for line in description]
+    parts += ['<h2>Results</h2>\n', table_html]
+    for heading, figure_html in figure_sections:
+        parts += [f'<h2>{html.escape(heading)}</h2>\n', figure_html]
+    parts.append('</body>\n</html>\n')
+    return ''.join(parts)
+
+
+def write_report(kind, name):
+    """
+    Make the report for one team or region and save it.
+
+    This runs in a worker process after init_worker().
+
+    Inputs:
+    -------
+    kind - str. 'team' or 'region'.
+    name - str. Name of the team or region.
+
+    Returns:
+    --------
+    path - str. Where the report was saved.
+    """
+    stats_cube = _shared['stats_cube']
+    interval_cube = _shared['interval_cube']
+    team_index = _shared['team_index']
+    options = _shared['options']
+    cohort = options['cohort']
+    years = options['years']
+
+    # Teams to highlight and the columns of the results table:
+    if kind == 'team':
+        region = team_index.region_of_team[name]
+        highlighted_teams = [name]
+        title = name
+        description = [f'Region: {region}']
+    else:
+        region = name
+        highlighted_teams = [
+            t for t in team_index.teams_in_region[region]
+            if t in stats_cube.team_index
+            ]
+        title = region
+        description = [f'Stroke teams: {len(highlighted_teams)}']
+    table_teams = highlighted_teams + [f'All {region}', all_teams_str]
+    team_colours_dict = get_report_colours(table_teams)
+    description += [
+        f'Patients: {options["cohort_description"]}',
+        f'Years in the table: {", ".join(years)}'
+        ]
+
+    # Results table in the same column order as on the demo page.
+    # Only keep the team and year combinations with stats:
+    labels = [f'{team} ({year})' for year in years for team in table_teams]
+    missing = set(team_index.missing_labels(labels, cohort))
+    columns = [
+        (label, team) for label, team in zip(
+            labels, [team for year in years for team in table_teams])
+        if label not in missing
+        ]
+    df_to_show = _shared['summary_stats_df'][[c for c, t in columns]]
+    table_html = render_results_table.__wrapped__(
+        tuple(df_to_show.columns),
+        tuple(team_colours_dict[t] for c, t in columns),
+        cohort,
+        interval_cube is not None,
+        None,
+        df_to_show,
+        interval_cube,
+        metric_display_names
+        )
+
+    figure_sections = []
+    fig = create_geography_figure(
+        _shared['base_layout_map'],
+        _shared['df_stroke_team'],
+        team_index,
+        highlighted_teams,
+        team_colours_dict
+        )
+    figure_sections.append(('Location', figure_to_html(
+        fig, map_config, 'map', _shared['base_traces_json'])))
+
+    for i, feature in enumerate(options['features']):
+        fig = create_violin_figure(
+            stats_cube,
+            cohort,
+            feature,
+            metric_display_names[feature],
+            stats_cube.years,
+            highlighted_teams,
+            stats_cube.years[0],
+            all_teams_str,
+            team_colours_dict,
+            interval_cube
+            )
+        figure_sections.append((
+            metric_display_names[feature],
+            figure_to_html(fig, violin_config, f'violin-{i}')
+            ))
+
+    x_feature, y_feature = options['scatter_features']
+    fig = create_scatter_figure(
+        x_feature,
+        y_feature,
+        'None',
+        stats_cube.years[0],
+        stats_cube,
+        cohort,
+        highlighted_teams,
+        team_colours_dict,
+        metric_display_names[x_feature],
+        metric_display_names[y_feature],
+        'None',
+        interval_cube
+        )
+    figure_sections.append((
+        f'{metric_display_names[y_feature]} against '
+        f'{metric_display_names[x_feature]} ({stats_cube.years[0]})',
+        figure_to_html(fig, scatter_config, 'scatter')
+        ))
+
+    report_html = make_report_html(
+        title, description, table_html, figure_sections)
+    path = os.path.join(
+        options['output_dir'], get_report_file_name(kind, name))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(report_html)
+    return path
+
+
+def write_index(output_dir, reports):
+    """
+    Save a page with links to every report.
+
+    Inputs:
+    -------
+    output_dir - str. Folder the reports are in.
+    reports    - list. (kind, name) of each report.
+    """
+    lines = ['<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+             '<title>Descriptive stats reports</title>\n</head>\n<body>\n']
+    for kind, heading in [('region', 'Regions'), ('team', 'Stroke teams')]:
+        lines.append(f'<h2>{heading}</h2>\n<ul>\n')
+        lines += [
+            f'<li><a href="{get_report_file_name(k, name)}">'
+            f'{html.escape(name)}</a></li>\n'
+            for k, name in reports if k == kind
+            ]
+        lines.append('</ul>\n')
+    lines.append('</body>\n</html>\n')
+    with open(os.path.join(output_dir, 'index.html'), 'w',
+              encoding='utf-8') as f:
+        f.write(''.join(lines))
+
+
+def main():
+    """
+    Make an HTML report of the descriptive stats for every team and
+    region.
+    """
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+        )
+    parser.add_argument(
+        '--data-dir', default='./data_descriptive',
+        help='Folder with the stats and team files.')
+    parser.add_argument(
+        '--output-dir', default='./reports',
+        help='Folder to save the reports in.')
+    parser.add_argument(
+        '--cohort', default='all',
+        help="Cohort of patients, e.g. 'all' or '4hr'.")
+    parser.add_argument(
+        '--years', nargs='+', default=None,
+        help='Years for the results table. Default: all years '
+             'combined and the latest year.')
+    parser.add_argument(
+        '--features', nargs='+', default=default_features,
+        help='Features to draw violins of.')
+    parser.add_argument(
+        '--scatter', nargs=2, default=default_scatter_features,
+        metavar=('X', 'Y'),
+        help='Features for the x and y axes of the scatter plot.')
+    parser.add_argument(
+        '--plotlyjs', choices=['inline', 'cdn'], default='inline',
+        help='Put plotly.js in every file or load it from the internet.')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='Number of processes to use.')
+    parser.add_argument(
+        '--teams', nargs='+', default=None,
+        help='Only make the reports for these teams. '
+             'The region reports are still made.')
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+
+    # Load everything once here for all of the workers:
+    locations_path = os.path.join(args.data_dir, locations_file)
+    stats_cube = load_stats_cube(args.data_dir)
+    if args.cohort not in stats_cube.cohorts:
+        parser.error(f'--cohort must be one of {stats_cube.cohorts}')
+    for feature in args.features + args.scatter:
+        if feature not in metric_display_names:
+            parser.error(f'Unknown feature: {feature}')
+    years = args.years
+    if years is None:
+        years = [stats_cube.years[0], stats_cube.years[-1]]
+    df_stroke_team = load_stroke_team_locations(locations_path)
+    team_index = load_team_index(args.data_dir, locations_path)
+    options = {
+        'cohort': args.cohort,
+        'cohort_description': {
+            'all': 'all patients',
+            '4hr': 'known onset time and arrival within 4 hours'
+            }.get(args.cohort, args.cohort),
+        'years': years,
+        'features': args.features,
+        'scatter_features': args.scatter,
+        'plotlyjs': args.plotlyjs,
+        'output_dir': args.output_dir
+        }
+    shared = {
+        'stats_cube': stats_cube,
+        'interval_cube': load_interval_cube(args.data_dir),
+        'team_index': team_index,
+        'df_stroke_team': df_stroke_team,
+        'base_map': create_base_map(
+            df_stroke_team,
+            os.path.join(app_dir, 'static', region_static_file)
+            ),
+        'summary_stats_df': stats_cube.to_summary_stats(args.cohort, years),
+        'options': options
+        }
+
+    teams = args.teams if args.teams is not None else team_index.teams
+    reports = (
+        [('region', region) for region in team_index.regions] +
+        [('team', team) for team in teams if team in stats_cube.team_index]
+        )
+    os.makedirs(args.output_dir, exist_ok=True)
+    with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_worker,
+            initargs=(shared,)
+            ) as executor:
+        # Send the reports in small batches to save on messages:
+        chunksize = max(1, len(reports) // (4 * args.workers))
+        paths = list(executor.map(
+            write_report,
+            [kind for kind, name in reports],
+            [name for kind, name in reports],
+            chunksize=chunksize
+            ))
+    write_index(args.output_dir, reports)
+    print(f'Made {len(paths)} reports in {args.output_dir} in '
+          f'{time.perf_counter() - start_time:.1f} s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Dense array of the descriptive stats for fast lookups.
+
+The stats files store one column per "team (year)" combination and
+one row per feature, with the text rows 'stroke_team' and 'year'
+mixed in. That forces the whole dataframe to object dtype, so the
+plots had to transpose it and convert strings back to numbers on
+every rerun.
+
+The StatsCube here holds the same numbers in a single float array
+indexed [team, year, metric, cohort] with dictionaries to convert
+labels into positions. It is built once when the data is loaded and
+the plots take views of it instead of copies.
+"""
+import numpy as np
+import pandas as pd
+
+
+class StatsCube:
+    """
+    Descriptive stats in a [team, year, metric, cohort] float array.
+
+    Teams whose names start with "All " (the national and regional
+    groups) are stored first so that all of the individual stroke
+    teams can be taken as one slice without copying.
+
+    Attributes:
+    -----------
+    values      - np.ndarray. Read-only float array of the stats with
+                  shape (teams, years, metrics, cohorts). Team and year
+                  combinations with no data are NaN.
+    exists      - np.ndarray. Read-only bool array with shape
+                  (teams, years, cohorts). True where the team and year
+                  combination has a column in the original stats file.
+    teams       - np.ndarray. Team names in the order of the first axis.
+    years       - list. Year labels in the order of the second axis,
+                  starting with the "all years" label.
+    metrics     - list. Feature names in the order of the third axis.
+    cohorts     - list. Cohort names in the order of the fourth axis.
+    is_group    - np.ndarray. Bool, True for the "All ..." teams.
+    individual_teams - slice. Selects every team that is not a group.
+    team_index, year_index, metric_index, cohort_index
+                - dict. Label to position lookups for each axis.
+    """
+    def __init__(self, values, exists, teams, years, metrics, cohorts):
+        values.flags.writeable = False
+        exists.flags.writeable = False
+        self.values = values
+        self.exists = exists
+
+        self.teams = np.array(teams, dtype=object)
+        self.years = list(years)
+        self.metrics = list(metrics)
+        self.cohorts = list(cohorts)
+
+        self.team_index = {t: i for i, t in enumerate(self.teams)}
+        self.year_index = {y: i for i, y in enumerate(self.years)}
+        self.metric_index = {m: i for i, m in enumerate(self.metrics)}
+        self.cohort_index = {c: i for i, c in enumerate(self.cohorts)}
+
+        self.is_group = np.array([t[:4] == 'All ' for t in self.teams])
+        self.individual_teams = slice(int(self.is_group.sum()), None)
+
+    def metric_values(self, metric, cohort):
+        """
+        Get one feature for every team and year.
+
+        Inputs:
+        -------
+        metric - str. Name of the feature, e.g. 'age'.
+        cohort - str. Name of the cohort, e.g. 'all'.
+
+        Returns:
+        --------
+        values - np.ndarray. View of the data with shape (teams, years).
+        """
+        return self.values[
+            :, :, self.metric_index[metric], self.cohort_index[cohort]]
+
+    def year_values(self, year, cohort):
+        """
+        Get every feature for every team in one year.
+
+        Inputs:
+        -------
+        year   - str. Year label, e.g. '2019' or '2016 to 2021'.
+        cohort - str. Name of the cohort, e.g. 'all'.
+
+        Returns:
+        --------
+        values - np.ndarray. View of the data with shape
+                 (teams, metrics).
+        exists - np.ndarray. View of the bool array with shape (teams,)
+                 that is True for teams with data in this year.
+        """
+        y = self.year_index[year]
+        c = self.cohort_index[cohort]
+        return self.values[:, y, :, c], self.exists[:, y, c]
+
+    def lookup(self, metric, teams, years, cohort):
+        """
+        Get one feature for a list of team and year labels.
+
+        Inputs:
+        -------
+        metric - str. Name of the feature, e.g. 'age_lower'.
+        teams  - list. Team names.
+        years  - list. Year labels, one for each team.
+        cohort - str. Name of the cohort, e.g. 'all'.
+
+        Returns:
+        --------
+        values - np.ndarray. One value per team and year. NaN where
+                 the team, year or feature isn't in the cube.
+        """
+        t_inds = np.array(
+            [self.team_index.get(t, -1) for t in teams], dtype=int)
+        y_inds = np.array(
+            [self.year_index.get(str(y), -1) for y in years], dtype=int)
+        values = np.full(len(t_inds), np.NaN)
+        if metric not in self.metric_index:
+            return values
+        found = (t_inds >= 0) & (y_inds >= 0)
+        values[found] = self.values[
+            t_inds[found], y_inds[found], self.metric_index[metric],
+            self.cohort_index[cohort]
+            ]
+        return values
+
+    def to_summary_stats(self, cohort, years):
+        """
+        Get the stats in the summary_stats.csv layout.
+
+        This is for stats that only exist in the cube, e.g. from a
+        CohortCube filter, so that the results table can use them in
+        the same way as the stats files.
+
+        Inputs:
+        -------
+        cohort - str. Name of the cohort, e.g. 'all'.
+        years  - list. Year labels to include.
+
+        Returns:
+        --------
+        summary_stats_df - pd.DataFrame. One column per "team (year)"
+                           with stats and one row per feature, plus
+                           the 'stroke_team' and 'year' rows.
+        """
+        c = self.cohort_index[cohort]
+        y_inds = [self.year_index[y] for y in years if y in self.year_index]
+        # Team and year positions of the combinations with stats,
+        # in team then year order like the stats files:
+        t_inds, y_pos = np.nonzero(self.exists[:, y_inds, c])
+        y_inds = np.array(y_inds, dtype=int)[y_pos]
+
+        df = pd.DataFrame(
+            self.values[t_inds, y_inds, :, c], columns=self.metrics)
+        df['stroke_team'] = self.teams[t_inds]
+        df['year'] = [self.years[y] for y in y_inds]
+        df.index = [
+            f'{t} ({y})' for t, y in zip(df['stroke_team'], df['year'])]
+        return df.T
+
+
+def build_stats_cube(summary_stats_dfs):
+    """
+    Combine descriptive stats dataframes into one StatsCube.
+
+    Inputs:
+    -------
+    summary_stats_dfs - dict. Keys are cohort names and values are
+                        the dataframes read from the matching stats
+                        files, e.g. {'all': df, '4hr': df_4hr}.
+
+    Returns:
+    --------
+    stats_cube - StatsCube. All of the stats in one array.
+    """
+    label_rows = ['stroke_team', 'year']
+
+    # Metric names in the order they appear in the files:
+    metrics = []
+    for df in summary_stats_dfs.values():
+        metrics += [m for m in df.index if m not in label_rows]
+    metrics = list(dict.fromkeys(metrics))
+
+    # Turn each column of each dataframe into one record:
+    cohorts = []
+    teams = []
+    years = []
+    data = []
+    for cohort, df in summary_stats_dfs.items():
+        cohorts += [cohort] * len(df.columns)
+        teams += list(df.loc['stroke_team'])
+        years += [str(y) for y in df.loc['year']]
+        # Convert the numbers in one go (rows are metrics).
+        # Metrics missing from this file are left as NaN.
+        data.append(df.reindex(metrics).to_numpy(dtype=float).T)
+
+    return build_stats_cube_from_records(
+        cohorts, teams, years, metrics, np.concatenate(data),
+        cohort_order=list(summary_stats_dfs.keys())
+        )
+
+
+def build_stats_cube_from_records(
+        cohorts,
+        teams,
+        years,
+        metrics,
+        data,
+        cohort_order=None
+        ):
+    """
+    Build a StatsCube from one record per cohort, team and year.
+
+    Inputs:
+    -------
+    cohorts      - list. Cohort name for each record.
+    teams        - list. Team name for each record.
+    years        - list. Year label (str) for each record.
+    metrics      - list. Names of the metrics in the data columns.
+    data         - np.ndarray. Float array with one row per record
+                   and one column per metric.
+    cohort_order - list or None. Order of the cohort axis. If None,
+                   use the order the cohorts first appear in.
+
+    Returns:
+    --------
+    stats_cube - StatsCube. All of the stats in one array.
+    """
+    # Remove repeats and keep the first-seen order:
+    team_list = list(dict.fromkeys(teams))
+    # Put the group teams first:
+    team_list = sorted(team_list, key=lambda t: t[:4] != 'All ')
+    # Put the "all years" label (e.g. "2016 to 2021") first and the
+    # single years in order. The label isn't fixed so that stats
+    # with new years of data added still work.
+    year_list = sorted(set(years), key=lambda y: (y.isdigit(), y))
+    if cohort_order is None:
+        cohort_order = list(dict.fromkeys(cohorts))
+
+    team_index = {t: i for i, t in enumerate(team_list)}
+    year_index = {y: i for i, y in enumerate(year_list)}
+    cohort_index = {c: i for i, c in enumerate(cohort_order)}
+
+    values = np.full(
+        (len(team_list), len(year_list), len(metrics), len(cohort_order)),
+        np.NaN
+        )
+    exists = np.zeros(
+        (len(team_list), len(year_list), len(cohort_order)), dtype=bool)
+
+    # Position of each record in the cube:
+    t_inds = np.array([team_index[t] for t in teams], dtype=int)
+    y_inds = np.array([year_index[y] for y in years], dtype=int)
+    c_inds = np.array([cohort_index[c] for c in cohorts], dtype=int)
+    # Each record fills every metric for one (team, year, cohort):
+    values[t_inds, y_inds, :, c_inds] = data
+    exists[t_inds, y_inds, c_inds] = True
+
+    return StatsCube(
+        values, exists, team_list, year_list, metrics, cohort_order)
@@ -0,0 +1,233 @@
+"""
+Columnar copy of the descriptive stats.
+
+The stats .csv files have to be parsed and converted from text to
+numbers every time they are read. This module writes the same stats
+as a typed Arrow IPC dataset, split into one folder per cohort and
+year:
+
+    summary_stats_dataset/cohort=all/year=2019/part-0.arrow
+
+Each file has one row per stroke team (including the "All ..."
+groups) and one column per feature. The files are not compressed so
+that they can be memory-mapped, and reading only some cohorts, years
+or features skips the rest of the data entirely.
+
+The .csv files are still written by the stats pipeline as the
+export format for anyone who wants the full data.
+
+Run this module to convert the existing .csv files:
+    python -m utilities_descriptive.stats_dataset
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+
+from utilities_descriptive.fixed_params import \
+    stats_dataset_dir, summary_stats_files
+
+# Folder structure of the dataset.
+# Years are strings because one of them is the "all years" label.
+partitioning = ds.partitioning(
+    pa.schema([('cohort', pa.string()), ('year', pa.string())]),
+    flavor='hive'
+    )
+
+
+def summary_stats_to_table(summary_stats_dfs):
+    """
+    Convert descriptive stats dataframes to one Arrow table.
+
+    Inputs:
+    -------
+    summary_stats_dfs - dict. Keys are cohort names and values are
+                        dataframes in the summary_stats.csv layout.
+
+    Returns:
+    --------
+    table - pa.Table. One row per cohort, team and year with columns
+            'cohort', 'year', 'stroke_team' and one per feature.
+    """
+    tables = []
+    for cohort, df in summary_stats_dfs.items():
+        # Transpose so that each "team (year)" is one row:
+        df = df.T
+        metrics = [c for c in df.columns if c not in ['stroke_team', 'year']]
+        columns = {
+            'cohort': [cohort] * len(df),
+            'year': [str(y) for y in df['year']],
+            'stroke_team': df['stroke_team'].astype(str).to_list(),
+            }
+        for metric in metrics:
+            values = pd.to_numeric(df[metric])
+            if metric == 'count':
+                values = values.astype('int64')
+            else:
+                values = values.astype('float64')
+            columns[metric] = values.to_numpy()
+        tables.append(pa.table(columns))
+    return pa.concat_tables(tables)
+
+
+def write_stats_dataset(summary_stats_dfs, path):
+    """
+    Write the descriptive stats as a partitioned Arrow IPC dataset.
+
+    Any existing files for the same cohorts and years are replaced.
+
+    Inputs:
+    -------
+    summary_stats_dfs - dict. Keys are cohort names and values are
+                        dataframes in the summary_stats.csv layout.
+    path              - str. Folder to write the dataset into.
+    """
+    table = summary_stats_to_table(summary_stats_dfs)
+    ds.write_dataset(
+        table,
+        path,
+        format='ipc',
+        partitioning=partitioning,
+        basename_template='part-{i}.arrow',
+        existing_data_behavior='delete_matching'
+        )
+
+
+def delete_stale_years(path, year_labels):
+    """
+    Remove the files for any years that are no longer in the stats.
+
+    For example, when a new year is added the label for all years
+    combined changes from "2016 to 2021" to "2016 to 2022" and the
+    files for the old label should go.
+
+    Inputs:
+    -------
+    path        - str. Folder containing the dataset.
+    year_labels - list. Year labels to keep.
+    """
+    dataset = ds.dataset(path, format='ipc', partitioning=partitioning)
+    keep = ds.field('year').isin([str(y) for y in year_labels])
+    for fragment in dataset.get_fragments(filter=~keep):
+        os.remove(fragment.path)
+        # Remove the partition folder if it's now empty:
+        folder = os.path.dirname(fragment.path)
+        if len(os.listdir(folder)) == 0:
+            os.rmdir(folder)
+
+
+def read_stats_dataset(path, cohorts=None, years=None, metrics=None):
+    """
+    Read some or all of the descriptive stats dataset.
+
+    Only the files for the requested cohorts and years are opened and
+    only the requested feature columns are read from them.
+
+    Inputs:
+    -------
+    path    - str. Folder containing the dataset.
+    cohorts - list or None. Cohorts to read. None reads all of them.
+    years   - list or None. Year labels to read. None reads all.
+    metrics - list or None. Features to read. None reads all.
+
+    Returns:
+    --------
+    table - pa.Table. Columns 'cohort', 'year', 'stroke_team' and
+            then the features.
+    """
+    dataset = ds.dataset(
+        path,
+        format='ipc',
+        partitioning=partitioning,
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True)
+        )
+    filters = []
+    if cohorts is not None:
+        filters.append(ds.field('cohort').isin(list(cohorts)))
+    if years is not None:
+        filters.append(ds.field('year').isin([str(y) for y in years]))
+    expression = None
+    for f in filters:
+        expression = f if expression is None else (expression & f)
+
+    label_columns = ['cohort', 'year', 'stroke_team']
+    if metrics is None:
+        metrics = [
+            c for c in dataset.schema.names if c not in label_columns]
+    return dataset.to_table(
+        columns=label_columns + list(metrics), filter=expression)
+
+
+def table_to_summary_stats(table):
+    """
+    Convert a table of one cohort back to the summary_stats.csv layout.
+
+    Inputs:
+    -------
+    table - pa.Table. Output of read_stats_dataset() for one cohort.
+
+    Returns:
+    --------
+    summary_stats_df - pd.DataFrame. One column per "team (year)" and
+                       one row per feature, plus the 'stroke_team'
+                       and 'year' rows.
+    """
+    df = table.drop(['cohort']).to_pandas()
+    df.index = [f'{t} ({y})' for t, y in zip(df['stroke_team'], df['year'])]
+    metrics = [c for c in df.columns if c not in ['stroke_team', 'year']]
+    return df[metrics + ['stroke_team', 'year']].T
+
+
+def table_to_records(table):
+    """
+    Split a table into the inputs for build_stats_cube_from_records().
+
+    Inputs:
+    -------
+    table - pa.Table. Output of read_stats_dataset().
+
+    Returns:
+    --------
+    cohorts - list. Cohort name for each row.
+    teams   - list. Team name for each row.
+    years   - list. Year label for each row.
+    metrics - list. Names of the feature columns.
+    data    - np.ndarray. Float array with one row per table row
+              and one column per feature.
+    """
+    metrics = [
+        c for c in table.column_names
+        if c not in ['cohort', 'year', 'stroke_team']
+        ]
+    if len(metrics) > 0:
+        data = np.column_stack([
+            table.column(m).to_numpy().astype(float) for m in metrics])
+    else:
+        data = np.zeros((table.num_rows, 0))
+    return (
+        table.column('cohort').to_pylist(),
+        table.column('stroke_team').to_pylist(),
+        table.column('year').to_pylist(),
+        metrics,
+        data
+        )
+
+
+def main():
+    """
+    Convert the descriptive stats .csv files into the dataset.
+    """
+    data_dir = './data_descriptive'
+    summary_stats_dfs = {
+        cohort: pd.read_csv(os.path.join(data_dir, file), index_col=0)
+        for cohort, file in summary_stats_files.items()
+        }
+    write_stats_dataset(
+        summary_stats_dfs, os.path.join(data_dir, stats_dataset_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Make synthetic SSNAP-like data for load and scale testing.
+
+The real patient-level extract is secret, so this module makes up a
+patient-level extract with the same columns (extract_fields in
+aggregation.py) and a matching set of stroke team files:
+
++ hospitals_and_lsoas_descriptive_stats.csv - one row per team with
+  a location and region.
++ stroke_teams.csv - the list of teams to give their own stats.
++ the patient extract itself.
+
+Each synthetic team copies the region and area codes of a real team
+and sits a few kilometres from it, so the teams are spread across
+England and Wales in the same way as the real ones. Each team also
+gets its own typical scan times, thrombolysis rate and so on so that
+the teams' stats are spread out like the real ones. None of the
+numbers are based on real patients.
+
+The patients are made and written in chunks so that millions of
+patients can be made without holding them all in memory.
+
+Run from the top of the repository, e.g.
+    python -m utilities_descriptive.synthetic_data ./synthetic \\
+        --teams 2000 --patients 5000000 --first-year 2000 --years 25
+
+and then build the stats from it with
+    python -m utilities_descriptive.aggregation \\
+        ./synthetic/synthetic_ssnap_extract.csv --data-dir ./synthetic
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from utilities_descriptive.aggregation import extract_fields
+
+
+# File names in the output folder:
+locations_file = 'hospitals_and_lsoas_descriptive_stats.csv'
+stroke_teams_file = 'stroke_teams.csv'
+extract_file = 'synthetic_ssnap_extract.csv'
+
+# Defaults that match the size of the real data:
+default_teams = 121
+default_patients = 350000
+default_first_year = 2016
+default_years = 6
+default_chunksize = 200000
+
+# Spread of the synthetic team locations around the real teams
+# in degrees (around 10km):
+location_jitter = 0.1
+
+
+def make_stroke_teams(df_real_teams, n_teams, seed=42):
+    """
+    Make a table of synthetic stroke team locations.
+
+    Inputs:
+    -------
+    df_real_teams - pd.DataFrame. The real team locations in the
+                    hospitals_and_lsoas_descriptive_stats.csv layout.
+    n_teams       - int. Number of synthetic teams.
+    seed          - int. Seed for the random numbers.
+
+    Returns:
+    --------
+    df_stroke_team - pd.DataFrame. Same columns as the real table with
+                     one row per synthetic team, sorted by team name.
+    """
+    rng = np.random.default_rng(seed)
+    # Each synthetic team is based on a real team, so the regions
+    # have the same share of teams as in the real data:
+    anchors = rng.integers(0, len(df_real_teams), size=n_teams)
+    df = df_real_teams.iloc[anchors].reset_index(drop=True)
+
+    # Zero-padded numbers so that the names sort in number order:
+    width = len(str(n_teams))
+    df['Stroke Team'] = [
+        f'Synthetic Stroke Team {i:0{width}d}' for i in range(1, n_teams + 1)]
+    df['Postcode'] = [f'SYN{i:0{width}d}' for i in range(1, n_teams + 1)]
+    df['long'] = df['long'] + rng.normal(0.0, location_jitter, n_teams)
+    df['lat'] = df['lat'] + rng.normal(0.0, location_jitter, n_teams)
+    return df.sort_values('Stroke Team', ignore_index=True)
+
+
+def make_team_effects(n_teams, seed=42):
+    """
+    Pick the typical values that make each team different.
+
+    Inputs:
+    -------
+    n_teams - int. Number of teams.
+    seed    - int. Seed for the random numbers.
+
+    Returns:
+    --------
+    team_effects - pd.DataFrame. One row per team with columns:
+                   'size' - share of all patients.
+                   'onset_known' - proportion with known onset.
+                   'scan_median' - median arrival-to-scan minutes.
+                   'needle_median' - median scan-to-needle minutes.
+                   'thrombolysis' - thrombolysis rate for patients
+                                    who could be treated.
+    """
+    rng = np.random.default_rng(seed)
+    size = rng.lognormal(0.0, 0.5, n_teams)
+    return pd.DataFrame({
+        'size': size / size.sum(),
+        'onset_known': rng.uniform(0.5, 0.8, n_teams),
+        'scan_median': rng.uniform(15.0, 60.0, n_teams),
+        'needle_median': rng.uniform(20.0, 60.0, n_teams),
+        'thrombolysis': rng.uniform(0.15, 0.45, n_teams),
+        })
+
+
+def make_patients(team_names, team_effects, years, n_patients, rng):
+    """
+    Make one chunk of synthetic patients.
+
+    Inputs:
+    -------
+    team_names   - np.ndarray. Names of the teams.
+    team_effects - pd.DataFrame. Output of make_team_effects().
+    years        - list. Years to spread the patients over.
+    n_patients   - int. Number of patients to make.
+    rng          - np.random.Generator. Source of random numbers.
+
+    Returns:
+    --------
+    data - pd.DataFrame. One row per patient with the columns in
+           extract_fields.
+    """
+    n = n_patients
+    team = rng.choice(len(team_names), size=n, p=team_effects['size'])
+    effects = {k: v[team] for k, v in team_effects.items()}
+
+    # Ages are given in five-year bands like the real extract:
+    age = np.clip(rng.normal(75.0, 13.0, n), 18.0, 104.0)
+    age = np.floor(age / 5.0) * 5.0 + 2.5
+    infarction = rng.random(n) < 0.88
+    stroke_severity = np.clip(rng.negative_binomial(1.2, 0.13, n), 0, 42)
+
+    onset_known = rng.random(n) < effects['onset_known']
+    precise_onset_known = onset_known & (rng.random(n) < 0.6)
+    onset_during_sleep = ~precise_onset_known & (rng.random(n) < 0.3)
+    # Times are whole minutes and only known when the onset is:
+    onset_to_arrival_time = np.where(
+        onset_known, np.round(rng.lognormal(np.log(150.0), 0.8, n)), np.nan)
+    arrival_to_scan_time = np.round(
+        rng.lognormal(np.log(effects['scan_median']), 0.9, n))
+
+    # Only infarctions that arrive in time can be thrombolysed:
+    could_treat = infarction & (onset_to_arrival_time <= 240)
+    thrombolysis = could_treat & (rng.random(n) < effects['thrombolysis'])
+    scan_to_thrombolysis_time = np.where(
+        thrombolysis,
+        np.round(rng.lognormal(np.log(effects['needle_median']), 0.5, n)),
+        np.nan
+        )
+
+    prior_disability = rng.choice(
+        6, size=n, p=[0.45, 0.15, 0.12, 0.14, 0.11, 0.03])
+    # More severe strokes are more likely to be fatal:
+    death = rng.random(n) < np.clip(0.02 + 0.012 * stroke_severity, 0, 0.9)
+    # Disability gets worse with severity and death is mRS 6:
+    increase = rng.poisson(0.5 + 0.12 * stroke_severity, n)
+    discharge_disability = np.where(
+        death, 6, np.clip(prior_disability + increase, 0, 5))
+
+    data = pd.DataFrame({
+        'stroke_team': team_names[team],
+        'age': age,
+        'male': rng.random(n) < 0.5,
+        'infarction': infarction,
+        'stroke_severity': stroke_severity,
+        'onset_to_arrival_time': onset_to_arrival_time,
+        'onset_known': onset_known,
+        'precise_onset_known': precise_onset_known,
+        'onset_during_sleep': onset_during_sleep,
+        'arrive_by_ambulance': rng.random(n) < 0.85,
+        'year': rng.choice(np.array(years), size=n),
+        'afib_anticoagulant': rng.random(n) < 0.1,
+        'prior_disability': prior_disability,
+        'arrival_to_scan_time': arrival_to_scan_time,
+        'thrombolysis': thrombolysis,
+        'scan_to_thrombolysis_time': scan_to_thrombolysis_time,
+        'death': death,
+        'discharge_disability': discharge_disability,
+        })
+    return data[extract_fields]
+
+
+def write_synthetic_data(
+        out_dir,
+        df_real_teams,
+        n_teams=default_teams,
+        n_patients=default_patients,
+        first_year=default_first_year,
+        n_years=default_years,
+        seed=42,
+        chunksize=default_chunksize
+        ):
+    """
+    Write a synthetic patient extract and matching team files.
+
+    Inputs:
+    -------
+    out_dir       - str. Folder to write the files into.
+    df_real_teams - pd.DataFrame. The real team locations.
+    n_teams       - int. Number of synthetic teams.
+    n_patients    - int. Number of synthetic patients.
+    first_year    - int. First year of patients.
+    n_years       - int. Number of years of patients.
+    seed          - int. Seed for the random numbers. The same seed
+                    and sizes always give the same files.
+    chunksize     - int. Number of patients to make at once.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    df_stroke_team = make_stroke_teams(df_real_teams, n_teams, seed)
+    df_stroke_team.to_csv(os.path.join(out_dir, locations_file), index=False)
+    df_stroke_team[['Stroke Team']].rename(
+        columns={'Stroke Team': 'stroke_team'}).to_csv(
+        os.path.join(out_dir, stroke_teams_file), index=False)
+
+    team_names = df_stroke_team['Stroke Team'].to_numpy()
+    team_effects = make_team_effects(n_teams, seed)
+    years = list(range(first_year, first_year + n_years))
+
+    # Separate random numbers for each chunk so that the files don't
+    # depend on anything except the seed and the sizes:
+    n_chunks = max(1, int(np.ceil(n_patients / chunksize)))
+    chunk_seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    path = os.path.join(out_dir, extract_file)
+    for i, chunk_seed in enumerate(chunk_seeds):
+        n_chunk = min(chunksize, n_patients - i * chunksize)
+        data = make_patients(
+            team_names, team_effects, years, n_chunk,
+            np.random.default_rng(chunk_seed)
+            )
+        data.to_csv(path, index=False, mode='w' if i == 0 else 'a',
+                    header=(i == 0))
+
+
+def main():
+    """
+    Write a synthetic SSNAP-like patient extract and team files.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('out_dir', help='Folder to write the files into.')
+    parser.add_argument(
+        '--teams', type=int, default=default_teams,
+        help='Number of stroke teams.')
+    parser.add_argument(
+        '--patients', type=int, default=default_patients,
+        help='Number of patients.')
+    parser.add_argument(
+        '--first-year', type=int, default=default_first_year,
+        help='First year of patients.')
+    parser.add_argument(
+        '--years', type=int, default=default_years,
+        help='Number of years of patients.')
+    parser.add_argument(
+        '--seed', type=int, default=42, help='Seed for random numbers.')
+    parser.add_argument(
+        '--chunksize', type=int, default=default_chunksize,
+        help='Number of patients to make at once.')
+    parser.add_argument(
+        '--data-dir', default='./data_descriptive',
+        help='Folder containing the real team locations.')
+    args = parser.parse_args()
+
+    df_real_teams = pd.read_csv(
+        os.path.join(args.data_dir, locations_file), index_col=False)
+    write_synthetic_data(
+        args.out_dir, df_real_teams, args.teams, args.patients,
+        args.first_year, args.years, args.seed, args.chunksize
+        )
+
+
+if __name__ == '__main__':
+    main()
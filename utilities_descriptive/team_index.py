@@ -0,0 +1,95 @@
+"""
+Lookups between stroke teams, regions and the stats.
+
+The app used to answer questions like "which region is this team in?"
+by masking the whole team locations dataframe, and found out whether
+a "team (year)" combination had any stats by trying to pull it out of
+the stats dataframe and catching the KeyError. Each of those checks
+looks at every row, and they were repeated for every selected team on
+every rerun.
+
+The TeamIndex here is built once when the data is loaded and answers
+the same questions with dictionary and set lookups.
+"""
+import numpy as np
+
+
+class TeamIndex:
+    """
+    Prebuilt lookups for stroke teams, regions and stats columns.
+
+    Attributes:
+    -----------
+    teams          - list. Stroke team names in the order of the rows
+                     of the team locations dataframe.
+    regions        - list. Sorted region names.
+    region_of_team - dict. Team name to region name. The regional
+                     "All ..." groups map to their own region.
+    teams_in_region - dict. Region name to the list of its stroke
+                     teams, in the same order as the teams list.
+    location_row   - dict. Team name to row position in the team
+                     locations dataframe.
+    column_index   - dict. "team (year)" label to the (team, year)
+                     position of that combination in the StatsCube.
+    existing_labels - dict. Cohort name to the set of "team (year)"
+                     labels that have stats for that cohort.
+    """
+    def __init__(self, df_stroke_team, stats_cube):
+        self.teams = df_stroke_team['Stroke Team'].to_list()
+        team_regions = df_stroke_team['RGN11NM'].to_list()
+        self.regions = sorted(set(team_regions))
+
+        self.location_row = {t: i for i, t in enumerate(self.teams)}
+        self.region_of_team = dict(zip(self.teams, team_regions))
+        self.teams_in_region = {r: [] for r in self.regions}
+        for team, region in zip(self.teams, team_regions):
+            self.teams_in_region[region].append(team)
+        # The "All (region)" groups belong to their own region:
+        for region in self.regions:
+            self.region_of_team[f'All {region}'] = region
+
+        # Stats column labels in the "team (year)" format:
+        self.column_index = {
+            f'{team} ({year})': (t, y)
+            for t, team in enumerate(stats_cube.teams)
+            for y, year in enumerate(stats_cube.years)
+            }
+        labels = np.array(list(self.column_index.keys()), dtype=object)
+        # The labels are in the same order as the flattened
+        # (team, year) axes of the existence array:
+        self.existing_labels = {
+            cohort: frozenset(labels[stats_cube.exists[:, :, c].ravel()])
+            for c, cohort in enumerate(stats_cube.cohorts)
+            }
+
+    def teams_in_regions(self, regions):
+        """
+        Find the stroke teams in any of the given regions.
+
+        Inputs:
+        -------
+        regions - list. Region names.
+
+        Returns:
+        --------
+        teams - list. Stroke teams in those regions, in the same order
+                as the teams list.
+        """
+        teams = [t for r in regions for t in self.teams_in_region.get(r, [])]
+        return sorted(teams, key=self.location_row.get)
+
+    def missing_labels(self, labels, cohort):
+        """
+        Find which "team (year)" labels have no stats.
+
+        Inputs:
+        -------
+        labels - list. "team (year)" labels, e.g. "All E+W (2016)".
+        cohort - str. Name of the cohort, e.g. 'all'.
+
+        Returns:
+        --------
+        missing - list. The labels with no stats, in the input order.
+        """
+        missing = set(labels) - self.existing_labels[cohort]
+        return [label for label in labels if label in missing]